@@ -1,25 +1,102 @@
-"""The cart module provides the Cart class.
+"""The cart module provides the Cart and Track classes.
 
-Currently, carts and tracks are both represented by the "Cart"
-class, but it may be better to have separate classes.
+Carts and tracks are compact records which use __slots__ instead of a
+per-instance dictionary. Strings which repeat across many records,
+such as artists and cart types, are interned so that every record
+shares one copy.
 
 The Cart class uses the Player class to provide an audio stream. There
-are three different implementations of the Player class, and Cart currently
-uses VLC.
+are several implementations of the Player class, and the one used by
+every cart in a process is selected with set_player_backend(). The
+apps use VLC by default, while Automation uses the mixer so that tracks
+segue into each other; ZAUTOMATE_PLAYER overrides the choice. The apps
+select their backend at startup, so that a backend which has something
+to prepare, such as the engines of VLC, can start preparing it before
+the first cart is played. The player is
+not created until the cart is started or its meter data is needed, so
+a cart which is never played only costs its metadata and, if it is
+known, its cached length.
 """
+import importlib
+import os
+import sys
 import time
-from player_vlc import VLCPlayer
+import metacache
 
+# player backend, overrides the default of each app
+PLAYER_BACKEND = os.environ.get("ZAUTOMATE_PLAYER", "")
+
+# module and class of each player backend, whose module may have a start()
+# function which prepares the backend when it is selected
+PLAYER_BACKENDS = {
+    "vlc": ("player_vlc", "VLCPlayer"),
+    "mixer": ("player_mixer", "MixerPlayer"),
+    "madao": ("player_madao", "MadaoPlayer")
+}
+
+_player_class = None
+
+
+def set_player_backend(name):
+    """Select the player backend used by every cart.
+
+    The backend is imported only when it is selected, since each one
+    depends on different audio libraries. ZAUTOMATE_PLAYER, if it is
+    set, takes precedence over the name given here. If the module of
+    the backend has a start() function, it is called.
+
+    :param name: name of a backend in PLAYER_BACKENDS
+    """
+    global _player_class
+
+    module_name, class_name = PLAYER_BACKENDS[PLAYER_BACKEND or name]
+    module = importlib.import_module(module_name)
+    _player_class = getattr(module, class_name)
+
+    if hasattr(module, "start"):
+        module.start()
+
+
+def get_player_class():
+    """Get the player class of the selected backend, selecting VLC if none was selected."""
+    if _player_class is None:
+        set_player_backend("vlc")
+
+    return _player_class
+
+
+def to_ascii(string, intern=False):
+    """Strip non-ASCII characters from a string.
+
+    :param string
+    :param intern: whether to intern the result
+    """
+    string = string.encode("ascii", "ignore").decode("ascii")
+
+    if intern:
+        string = sys.intern(string)
+
+    return string
+
+
+def from_record(record):
+    """Construct a Cart or Track from a record.
+
+    Tracks are identified by [album_code]-[track_num], while carts
+    are identified by a numeric cart ID.
+
+    :param record: 5-tuple (cart_id, title, issuer, cart_type, filename)
+    """
+    if record[0].isdigit():
+        return Cart(*record)
+    else:
+        return Track(*record)
 
 
 class Cart(object):
     """The Cart class contains the metadata and audio stream of a cart."""
-    cart_id = None
-    title = None
-    issuer = None
-    cart_type = None
-
-    _player = None
+    __slots__ = ("cart_id", "title", "issuer", "cart_type",
+                 "_filename", "_length", "_playable", "_player")
 
     def __init__(self, cart_id, title, issuer, cart_type, filename):
         """Construct a Cart object.
@@ -31,41 +108,123 @@ class Cart(object):
         :param filename: location of the cart file
         """
         self.cart_id = cart_id
-        self.title = title.encode("ascii", "ignore")
-        self.issuer = issuer.encode("ascii", "ignore")
-        self.cart_type = cart_type.encode("ascii", "ignore")
+        self.title = to_ascii(title)
+        self.issuer = to_ascii(issuer, True)
+        self.cart_type = to_ascii(cart_type, True)
 
-        filename = filename.encode("ascii", "ignore")
+        self._filename = to_ascii(filename)
+        self._length = None
+        self._playable = None
+        self._player = None
 
         # uncomment to mock ZAutoLib in development
-        # filename = "test/test.mp3"
+        # self._filename = "test/test.mp3"
 
-        try:
-            self._player = VLCPlayer(filename)
-        except IOError:
-            print(time.asctime() + " :=: Cart :: could not load audio file " + filename)
+    def _get_player(self):
+        """Get the audio stream of the cart, creating it if necessary."""
+        if self._player is None:
+            self._player = get_player_class()(self._filename)
+
+        return self._player
 
     def is_playable(self):
-        """Get whether the cart has an audio stream."""
-        return self._player is not None
+        """Get whether the cart has a playable audio file.
+
+        The length of the file is looked up in the metadata cache,
+        without creating the audio stream.
+        """
+        if self._playable is None:
+            try:
+                self._length = metacache.get_length(self._filename)
+                self._playable = True
+            except IOError:
+                print(time.asctime() + " :=: Cart :: could not load audio file " + self._filename)
+                self._playable = False
+
+        return self._playable
 
     def is_playing(self):
         """Get whether the cart is currently playing."""
-        return self._player.is_playing()
+        return self._player is not None and self._player.is_playing
 
     def start(self, callback=None):
         """Play the cart's audio stream.
 
+        Raises IOError if the audio file cannot be opened, in which
+        case the cart is marked as unplayable.
+
         :param callback: function to call if the stream ends
         """
         print(time.asctime() + " :=: Cart :: Start :: " + self.issuer + " - " + self.title)
-        self._player.play(callback)
+
+        try:
+            self._get_player().play(callback)
+        except IOError:
+            self._playable = False
+            self._player = None
+            raise
+
+    def preroll(self):
+        """Prepare the cart's audio stream to start without delay."""
+        if self.is_playable():
+            self._get_player().preroll()
+
+    def cancel_preroll(self):
+        """Release the audio stream prepared by preroll() if the cart will not be played."""
+        if self._player is not None:
+            self._player.cancel_preroll()
 
     def stop(self):
         """Stop the cart's audio stream."""
         print(time.asctime() + " :=: Cart :: Stop :: " + self.issuer + " - " + self.title)
-        self._player.stop()
+
+        # the stream may have already ended, in which case there is nothing to stop
+        if self.is_playing():
+            self._player.stop()
+
+    def get_end_time(self):
+        """Get the monotonic time at which the cart's audio stream ended on its own, or None if it did not."""
+        return self._player.end_time if self._player is not None else None
 
     def get_meter_data(self):
-        """Get the meter data for the cart as a 4-tuple."""
-        return (self._player.time_elapsed(), self._player.length(), self.title, self.issuer)
+        """Get the meter data for the cart as a 4-tuple.
+
+        If the cart has not been started and its length is known,
+        the audio stream is not created.
+        """
+        if self._player is None and self._length is not None:
+            return (0, self._length, self.title, self.issuer)
+
+        player = self._get_player()
+
+        return (player.time_elapsed, player.length, self.title, self.issuer)
+
+
+class Track(Cart):
+    """The Track class contains the metadata and audio stream of a track.
+
+    A track is played like a cart; its artist is stored as the issuer
+    and its rotation as the cart type.
+    """
+    __slots__ = ()
+
+    def __init__(self, track_id, title, artist, rotation, filename):
+        """Construct a Track object.
+
+        :param track_id: [album_code]-[track_num]
+        :param title: track title
+        :param artist: artist name
+        :param rotation: rotation code
+        :param filename: location of the track file
+        """
+        Cart.__init__(self, track_id, title, artist, rotation, filename)
+
+    @property
+    def artist(self):
+        """Get the artist of the track."""
+        return self.issuer
+
+    @property
+    def rotation(self):
+        """Get the rotation of the track."""
+        return self.cart_type
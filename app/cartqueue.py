@@ -1,7 +1,13 @@
 """The cartqueue module provides the CartQueue class."""
-import datetime
+import collections
+import itertools
 import time
 import database
+import session
+from clock import Clock
+from planner import Planner
+from reservoir import Reservoir
+from timeline import Timeline, normalize_artist
 
 # temporary array used to filter carts from the cart queue
 CART_TYPES = [
@@ -42,23 +48,23 @@ AUTOMATION_CARTS = [
     }
 ]
 
+### the queue is refilled when it is shorter than the minimum length,
+### up to the minimum length plus a batch of tracks
 PLAYLIST_MIN_LENGTH = 10
+PLAYLIST_BATCH = 15
 
+# number of played tracks whose artists are not queued again
+PLAYED_ARTIST_HISTORY = 30
 
-def is_artist_in_list(cart, array):
-    """Get whether the artist of a cart is in a list of carts.
+### time budgets for network calls on the transition path, in seconds
+REFILL_DEADLINE = 15.0
+CART_DEADLINE = 3.0
 
-    :param cart
-    :param array
-    """
-    if cart is None:
-        return True
-
-    for item in array:
-        if cart.issuer is item.issuer:
-            return True
+# number of recent transition gaps kept for the stats
+GAP_HISTORY = 1000
 
-    return False
+# number of upcoming items published for the schedule view, which shows 20 rows
+SCHEDULE_LENGTH = 20
 
 
 class CartQueue(object):
@@ -66,48 +72,166 @@ class CartQueue(object):
 
     The behavior of the cart queue is as follows:
     1. enqueue a playlist from the database
-    2. insert carts according to configuration
+    2. place carts according to configuration (see the planner module)
     3. start and log the first track
-    4. [track plays to completion]
-    5. move the first track to the played list
-    6. enqueue another playlist if the queue is not sufficiently long
-        - also empty the played list (?)
-    7. insert carts if there are no carts in the queue
-    8. GOTO 3 (start the next track)
+    4. preroll the next track while the first track plays
+    5. [track plays to completion]
+    6. move the first track to the played list and start the next track
+    7. enqueue a batch of tracks if the queue is not sufficiently long,
+       skipping the artists of recently played tracks
+    8. place the carts whose target times the queue has reached
+    9. GOTO 4
+
+    The queue is changed only on the thread which runs its transitions,
+    which is the dispatch thread of the supervisor while it plays. Other
+    threads, such as the Tk thread which draws the meter and the
+    schedule, read the first item and the start of the schedule through
+    snapshots which are published after every change, so they never see
+    the queue in the middle of one. Only the first SCHEDULE_LENGTH items
+    are published, so that publishing does not make a transition cost
+    time in proportion to the length of the queue.
     """
-    _show_id = -1
     _queue = None
-    _played = None
+    _current = None
+    _schedule = None
+    _played_artists = None
+    _played_history = None
+    _planner = None
+    _reservoir = None
+    _prerolled = None
 
     _is_playing = False
     _on_cart_start = None
     _on_cart_stop = None
 
-    def __init__(self, on_cart_start, on_cart_stop):
+    _db = None
+    _clock = None
+    _num_refills = 0
+    _num_skipped = 0
+    _gaps = None
+
+    def __init__(self, on_cart_start, on_cart_stop, db=database, clock=None):
         """Construct a cart queue.
 
         :param on_cart_start: callback for when a cart starts
         :param on_cart_stop: callback for when a cart stops
+        :param db: optional module or object to use instead of the database module
+        :param clock: optional clock.Clock to use instead of the wall clock
         """
         self._on_cart_start = on_cart_start
         self._on_cart_stop = on_cart_stop
-
-        self._show_id = database.get_new_show_id(-1)
-        self._queue = []
-        self._played = []
+        self._db = db
+        self._clock = clock if clock is not None else Clock()
+
+        self._queue = Timeline()
+        self._schedule = []
+        self._played_artists = collections.Counter()
+        self._played_history = collections.deque()
+        self._planner = Planner(AUTOMATION_CARTS, self._get_cart, clock=self._clock)
+        self._reservoir = Reservoir(self._db, set(config["type"] for config in AUTOMATION_CARTS), clock=self._clock)
+        self._reservoir.fill_async()
+        self._gaps = collections.deque(maxlen=GAP_HISTORY)
 
     def get_queue(self):
-        """Get the queue."""
+        """Get the queue.
+
+        The queue may only be read on the thread which changes it; other
+        threads use get_current() and get_schedule().
+        """
         return self._queue
 
+    def get_current(self):
+        """Get the first item in the queue as of the last change, or None if the queue is empty."""
+        return self._current
+
+    def get_schedule(self):
+        """Get a list of 2-tuples (start time, cart) for the first items in the queue as of the last change."""
+        return self._schedule
+
+    def _publish(self):
+        """Publish snapshots of the first item and the schedule for other threads."""
+        self._current = self._queue[0] if len(self._queue) > 0 else None
+        self._schedule = list(itertools.islice(self._queue.iter_schedule(), SCHEDULE_LENGTH))
+
+    def get_report(self):
+        """Get the worst deviation from the window of each cart configuration entry."""
+        return self._planner.get_report(self._queue)
+
+    def get_stats(self):
+        """Get the queue counters as a dictionary.
+
+        The transition gaps are the times in milliseconds from the end
+        of a track, which is when its end timer was due, to the start of
+        the next one, over recent transitions.
+        """
+        gaps = sorted(self._gaps)
+
+        return {
+            "length": len(self._queue),
+            "refills": self._num_refills,
+            "skipped": self._num_skipped,
+            "reservoir": self._reservoir.get_stats(),
+            "gap_p50": gaps[len(gaps) // 2] if len(gaps) > 0 else None,
+            "gap_max": gaps[-1] if len(gaps) > 0 else None
+        }
+
+    def _is_artist_queued(self, cart):
+        """Get whether the artist of a cart is in the queue or has been played.
+
+        :param cart
+        """
+        return normalize_artist(cart.issuer) in self._played_artists or self._queue.has_artist(cart.issuer)
+
+    def _add_played_artist(self, cart):
+        """Remember the artist of a played track, forgetting the oldest one beyond the history.
+
+        :param cart
+        """
+        artist = normalize_artist(cart.issuer)
+        self._played_artists[artist] += 1
+        self._played_history.append(artist)
+
+        if len(self._played_history) > PLAYED_ARTIST_HISTORY:
+            oldest = self._played_history.popleft()
+            self._played_artists[oldest] -= 1
+
+            if self._played_artists[oldest] == 0:
+                del self._played_artists[oldest]
+
     def _enqueue(self):
-        """Start the first track in the queue."""
-        print(time.asctime() + " :=: CartQueue :: Enqueuing " + self._queue[0].cart_id)
+        """Start the first track in the queue.
+
+        A track whose file cannot be opened is dropped and the next one
+        is started, so that one broken file does not stop the queue.
+        """
+        while True:
+            if len(self._queue) == 0:
+                self._refill()
 
-        self._queue[0].start(self.transition)
+            if len(self._queue) == 0:
+                print(time.asctime() + " :=: CartQueue :: Queue is empty, stopping")
+                self._is_playing = False
+                return
+
+            print(time.asctime() + " :=: CartQueue :: Enqueuing " + self._queue[0].cart_id)
+
+            if self._queue[0] is self._prerolled:
+                self._prerolled = None
+
+            try:
+                self._queue[0].start(self.transition)
+                break
+            except IOError as e:
+                print(time.asctime() + " :=: CartQueue :: Could not start " + self._queue[0].cart_id + ": " + str(e))
+                self._num_skipped += 1
+                self._queue.pop_front()
+
+        # move the schedule to the actual start, now that nothing else delays it
+        self._planner.on_start(self._queue)
+        self._publish()
         self._on_cart_start()
 
-        database.log_cart(self._queue[0].cart_id)
+        self._db.log_cart(self._queue[0].cart_id)
 
     def _dequeue(self):
         """Stop and dequeue the first track in the queue."""
@@ -115,29 +239,44 @@ class CartQueue(object):
 
         self._queue[0].stop()
         self._on_cart_stop()
-        self._played.append(self._queue.pop(0))
+        self._add_played_artist(self._queue.pop_front())
 
-    def _gen_start_times(self, begin_index=0):
-        """Set the start time of each item in the queue.
+    def _preroll(self):
+        """Preroll the next item in the queue, so that the transition to it has no gap.
 
-        This function is called when items are added to the Queue
-        and when the queue is started after a stop.
-
-        :param begin_index
+        If the next item has changed since it was prerolled, such as
+        when a cart was placed before it, the old item is released.
         """
-        start_time = datetime.datetime.now()
+        cart = self._queue[1] if len(self._queue) > 1 and self._is_playing else None
+
+        if self._prerolled is not None and self._prerolled is not cart:
+            self._prerolled.cancel_preroll()
+
+        self._prerolled = cart
+
+        if cart is not None:
+            try:
+                cart.preroll()
+            except IOError as e:
+                print(time.asctime() + " :=: CartQueue :: Could not preroll " + cart.cart_id + ": " + str(e))
 
-        for i in range(begin_index, len(self._queue)):
-            if i > 0:
-                prev = self._queue[i - 1]
-                prev_length = datetime.timedelta(milliseconds=prev.get_meter_data()[1])
-                start_time = prev.start_time + prev_length
+    def _refill(self):
+        """Refill the queue and report the cart windows."""
+        print(time.asctime() + " :=: CartQueue :: Refilling tracks")
+        self._num_refills += 1
+        self.add_tracks()
 
-            self._queue[i].start_time = start_time
+        # fit the placed carts again with the new tracks
+        self._planner.refit(self._queue)
+
+        for entry in self.get_report():
+            print(time.asctime() + " :=: CartQueue :: " + entry["type"] + " at :%02d " % entry["minute"] +
+                  "played %d, missed %d, worst deviation %s s" % (
+                      entry["played"], entry["missed"], entry["worst_played"]))
 
     # TODO: make the server API return a playlist of sufficient size
     def add_tracks(self):
-        """Append tracks to the queue.
+        """Append tracks to the queue, up to the minimum length plus a batch.
 
         Previously, new playlists were retrieved by incrementing the
         current show ID, but incrementing is not guaranteed to yield
@@ -146,109 +285,81 @@ class CartQueue(object):
         is selected every time. Since shows are not scheduled according
         to genre continuity, selecting a random show every time has no
         less continuity than incrementing.
-        """
-        begin_index = len(self._queue)
 
-        while len(self._queue) < PLAYLIST_MIN_LENGTH:
-            # retrieve playlist from database
-            self._show_id = database.get_new_show_id(self._show_id)
-
-            if self._show_id is -1:
-                time.sleep(1.0)
+        Tracks are taken from the reservoir, which fetches playlists
+        ahead of time. Only if the reservoir runs dry are playlists
+        fetched here. If the queue cannot be filled before the refill
+        deadline, the tracks added so far are kept and the queue stays
+        short until the next refill.
+        """
+        # the first track starts now if the queue was empty
+        if len(self._queue) == 0:
+            self._queue.set_start_time(self._clock.now())
 
-            playlist = database.get_playlist(self._show_id)
+        deadline = session.Deadline(REFILL_DEADLINE)
 
-            # add each track whose artist isn't already in the queue or played list
-            self._queue.extend([t for t in playlist if
-                                not is_artist_in_list(t, self._played) and not is_artist_in_list(t, self._queue)])
+        while len(self._queue) < PLAYLIST_MIN_LENGTH + PLAYLIST_BATCH:
+            if deadline.expired():
+                print(time.asctime() + " :=: CartQueue :: Refill deadline expired, length is " + str(len(self._queue)))
+                break
 
-            print(time.asctime() + " :=: CartQueue :: Added tracks, length is " + str(len(self._queue)))
+            # add tracks whose artist isn't already in the queue or played list
+            tracks = self._reservoir.take_tracks(PLAYLIST_MIN_LENGTH + PLAYLIST_BATCH - len(self._queue),
+                                                  self._is_artist_queued)
 
-        self._gen_start_times(begin_index)
+            if len(tracks) > 0:
+                self._queue.extend(tracks)
+                print(time.asctime() + " :=: CartQueue :: Added tracks, length is " + str(len(self._queue)))
+                continue
 
-    def _insert_carts(self):
-        """Insert carts into the queue.
+            # fill the reservoir here if it ran dry
+            if not self._reservoir.fill(deadline):
+                self._clock.sleep(min(1.0, deadline.remaining()))
 
-        This function is called when the queue is started and when the queue
-        runs out of carts.
-        """
-        for entry in AUTOMATION_CARTS:
-            self._insert_cart(entry["type"], entry["minute"], entry["max_delta"])
+        self._publish()
 
-    def _insert_cart(self, cart_type, minute, max_delta):
-        """Insert a cart into the current hour according to a config entry.
+    def _get_cart(self, cart_type):
+        """Get a cart of a cart type for the planner.
 
-        This function inserts a cart as close as possible to the target
-        start time, even if the target window is not met.
+        The cart is taken from the reservoir, or fetched if the
+        reservoir has no carts of the type.
 
         :param cart_type
-        :param minute
-        :param max_delta
         """
-        target = datetime.datetime.now().replace(minute=minute, second=0, microsecond=0)
-        target_delta = datetime.timedelta(seconds=max_delta)
-
-        # don't insert if the target minute has already passed this hour
-        if target < datetime.datetime.now():
-            return
-
-        # don't insert if the queue has not reached the target window
-        last = self._queue[len(self._queue) - 1]
-        last_length = datetime.timedelta(milliseconds=last.get_meter_data()[1])
-
-        if last.start_time + last_length < target - target_delta:
-            return
-
-        # don't insert if there are no carts of this type
-        cart = database.get_cart(cart_type)
+        cart = self._reservoir.take_cart(cart_type)
 
         if cart is None:
-            print(time.asctime() + " :=: CartQueue :: Could not find cart of type " + cart_type)
-            return
-
-        print(time.asctime() + " :=: CartQueue :: Target insert time is " + str(target))
-
-        # find the position in queue with the closest start time to target
-        min_index = -1
-        min_delta = None
-
-        for i in range(1, len(self._queue)):
-            delta = abs(target - self._queue[i].start_time)
-
-            if min_delta is None or delta < min_delta:
-                min_index = i
-                min_delta = delta
-            elif delta > min_delta:
-                break
+            cart = self._db.get_cart(cart_type, session.Deadline(CART_DEADLINE))
 
-        print(time.asctime() + " :=: CartQueue :: min_index is " + str(min_index))
-        print(time.asctime() + " :=: CartQueue :: min_delta is " + str(min_delta))
+        return cart
 
-        if min_delta.seconds <= max_delta:
-            print(time.asctime() + " :=: CartQueue :: Cart inserted within target window")
-        else:
-            print(time.asctime() + " :=: CartQueue :: Cart not inserted within target window")
+    def _insert_carts(self):
+        """Place the carts whose target times the queue has reached.
 
-        # insert cart into the queue
-        self._queue.insert(min_index, cart)
-        self._gen_start_times(min_index)
+        This function is called when the queue is started and after
+        every transition.
+        """
+        self._planner.plan(self._queue)
 
     def _remove_carts(self):
         """Remove all carts from the queue.
 
-        This function is called after a hard stop and before new carts
-        are inserted. The queue must be cleared of carts after every
-        stop because the start times may not meet the cart configuration
-        when the queue is restarted.
+        This function is called after a stop. The queue must be cleared
+        of carts after every stop because the start times may not meet
+        the cart configuration when the queue is restarted.
         """
-        self._queue = [cart for cart in self._queue if cart.cart_type not in CART_TYPES]
+        self._queue.remove_if(lambda cart: cart.cart_type in CART_TYPES)
+        self._planner.reset()
 
     def start(self):
         """Start the queue."""
         self._is_playing = True
-        self._gen_start_times()
+        self._queue.set_start_time(self._clock.now())
         self._insert_carts()
+        self._planner.resolve_async()
         self._enqueue()
+        self._preroll()
+        self._publish()
 
     def stop_soft(self):
         """Stop the queue at the end of the current track."""
@@ -260,28 +371,39 @@ class CartQueue(object):
         """Transition to the next track.
 
         This function is called when a track ends or when the queue is stopped.
+
+        The next track was prerolled while the last one played, so it
+        is started first and everything else happens while it plays.
+        The placement of carts never changes the first item in the
+        queue, so it is safe to start it before carts are placed.
         """
+        # measure the gap from when the track was due to end, if it ended on its own
+        begin = self._queue[0].get_end_time()
+        if begin is None:
+            begin = time.monotonic()
+
         self._dequeue()
 
+        if self._is_playing is True:
+            # start the next track if the current track ended
+            self._enqueue()
+
+            gap = (time.monotonic() - begin) * 1000
+            self._gaps.append(gap)
+            print(time.asctime() + " :=: CartQueue :: Transition gap %.1f ms" % gap)
+
         # refill the queue if it is too short
         if len(self._queue) < PLAYLIST_MIN_LENGTH:
-            print(time.asctime() + " :=: CartQueue :: Refilling tracks")
-            self.add_tracks()
-            self._played = []
-            self._remove_carts()
-            self._insert_carts()
+            self._refill()
 
-        # add carts if there aren't any carts in the queue
-        carts = [c for c in self._queue if c.cart_type in CART_TYPES]
-
-        if len(carts) is 0:
-            print(time.asctime() + " :=: CartQueue :: Refilling carts")
-            self._insert_carts()
+        # place carts which the queue has reached and fetch the upcoming carts
+        self._insert_carts()
+        self._planner.resolve_async()
+        self._preroll()
 
-        if self._is_playing is True:
-            # start the next track if the current track ended
-            self._enqueue()
-        else:
+        if self._is_playing is False:
             # remove all carts if the queue was stopped
             print(time.asctime() + " :=: CartQueue :: Removing all carts")
             self._remove_carts()
+
+        self._publish()
@@ -0,0 +1,361 @@
+"""The catalog module provides the Catalog class.
+
+The catalog is a local SQLite cache of the cart and track metadata
+served by the server API. Each entry carries its own expiration time.
+Expired entries are still returned (and flagged as expired) so that the
+Cart Machine and Automation can keep running from the last good snapshot
+while the server is unreachable.
+
+The catalog also keeps a full-text index over the titles and issuers
+of every cached cart and track, which is updated whenever entries are
+cached, so that the library can be searched locally.
+
+Records are stored and returned as 5-tuples in the same order as the
+arguments of the Cart constructor:
+
+    (cart_id, title, issuer, cart_type, filename)
+"""
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.path.expanduser("~/.zautomate/")
+CATALOG_PATH = CACHE_DIR + "catalog.db"
+
+### time-to-live of each kind of entry, in seconds
+TTL_CARTS = 60 * 60
+TTL_PLAYLIST = 7 * 24 * 60 * 60
+TTL_TRACK = 7 * 24 * 60 * 60
+
+# maximum number of search results
+SEARCH_LIMIT = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS carts (
+    cart_id TEXT PRIMARY KEY,
+    type_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    issuer TEXT NOT NULL,
+    cart_type TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS carts_type ON carts (type_id);
+CREATE TABLE IF NOT EXISTS tracks (
+    track_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    rotation TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    show_id INTEGER PRIMARY KEY,
+    track_ids TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_ids (
+    docid INTEGER PRIMARY KEY,
+    record_id TEXT UNIQUE NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5 (
+    title,
+    issuer,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+"""
+
+# relative weights of the title and issuer columns when ranking search results
+RANK_WEIGHTS = (2.0, 1.0)
+
+
+def to_match_query(query):
+    """Get a full-text query which matches every word of a search as a prefix.
+
+    Returns None if the search has no words.
+
+    :param query: search term
+    """
+    words = re.findall(r"\w+", query.lower())
+
+    if len(words) == 0:
+        return None
+
+    return " ".join("\"" + word + "\"*" for word in words)
+
+
+def matches(query, title, issuer):
+    """Get whether a title and issuer match a search the way the index does.
+
+    :param query: search term
+    :param title
+    :param issuer
+    """
+    words = re.findall(r"\w+", (title + " " + issuer).lower())
+
+    for prefix in re.findall(r"\w+", query.lower()):
+        if not any(word.startswith(prefix) for word in words):
+            return False
+
+    return True
+
+
+class Catalog(object):
+    """The Catalog class is an on-disk cache of carts and tracks."""
+    _path = None
+    _conn = None
+    _lock = None
+
+    def __init__(self, path=CATALOG_PATH):
+        """Open a catalog, creating it if necessary.
+
+        :param path: location of the catalog database
+        """
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._path = path
+        self._lock = threading.Lock()
+
+        # the three apps share the catalog, so wait on locks held by other processes
+        self._conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+        # index catalogs which were cached before the index existed
+        with self._lock:
+            num_ids = self._conn.execute("SELECT COUNT(*) FROM search_ids").fetchone()[0]
+
+        if num_ids == 0:
+            self.rebuild_index()
+
+    def _index(self, records):
+        """Add records to the search index, replacing any previous entries.
+
+        Must be called within a transaction.
+
+        :param records: list of cart or track records
+        """
+        for record in records:
+            self._conn.execute("INSERT OR IGNORE INTO search_ids (record_id) VALUES (?)", (record[0],))
+            docid = self._conn.execute("SELECT docid FROM search_ids WHERE record_id = ?",
+                                       (record[0],)).fetchone()[0]
+            self._conn.execute("DELETE FROM search WHERE rowid = ?", (docid,))
+            self._conn.execute("INSERT INTO search (rowid, title, issuer) VALUES (?, ?, ?)",
+                               (docid, record[1], record[2]))
+
+    def _unindex(self, record_ids):
+        """Remove records from the search index.
+
+        Must be called within a transaction.
+
+        :param record_ids: list of cart or track IDs
+        """
+        for record_id in record_ids:
+            row = self._conn.execute("SELECT docid FROM search_ids WHERE record_id = ?", (record_id,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM search WHERE rowid = ?", (row[0],))
+                self._conn.execute("DELETE FROM search_ids WHERE docid = ?", (row[0],))
+
+    def rebuild_index(self):
+        """Rebuild the search index from every cached cart and track."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM search")
+            self._conn.execute("DELETE FROM search_ids")
+            self._index(self._conn.execute("SELECT cart_id, title, issuer FROM carts").fetchall())
+            self._index(self._conn.execute("SELECT track_id, title, artist FROM tracks").fetchall())
+
+    def get_carts(self, type_id):
+        """Get the cached carts of a cart type.
+
+        Returns a 2-tuple (records, expired). The records are None if
+        the cart type has never been cached.
+
+        :param type_id: cart type index
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT cart_id, title, issuer, cart_type, filename, expires FROM carts "
+                                      "WHERE type_id = ?", (type_id,)).fetchall()
+
+        if len(rows) == 0:
+            return (None, True)
+
+        expired = min(row[5] for row in rows) < time.time()
+
+        return ([row[0:5] for row in rows], expired)
+
+    def put_carts(self, type_id, records, ttl=TTL_CARTS):
+        """Replace the cached carts of a cart type.
+
+        :param type_id: cart type index
+        :param records: list of cart records
+        :param ttl: time-to-live in seconds
+        """
+        expires = time.time() + ttl
+
+        with self._lock, self._conn:
+            old_ids = self._conn.execute("SELECT cart_id FROM carts WHERE type_id = ?", (type_id,)).fetchall()
+            self._unindex([row[0] for row in old_ids])
+            self._conn.execute("DELETE FROM carts WHERE type_id = ?", (type_id,))
+            self._conn.executemany("INSERT OR REPLACE INTO carts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [(r[0], type_id, r[1], r[2], r[3], r[4], expires) for r in records])
+            self._index(records)
+
+    def get_random_cart(self, type_id):
+        """Get a random cached cart of a cart type, whether or not it has expired.
+
+        :param type_id: cart type index
+        """
+        records = self.get_carts(type_id)[0]
+
+        if records is None:
+            return None
+
+        return random.choice(records)
+
+    def get_playlist(self, show_id):
+        """Get the cached playlist of a show.
+
+        Returns a 2-tuple (records, expired). The records are None if
+        the playlist has never been cached.
+
+        :param show_id: show ID
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT track_ids, expires FROM playlists WHERE show_id = ?",
+                                     (show_id,)).fetchone()
+
+            if row is None:
+                return (None, True)
+
+            track_ids = [track_id for track_id in row[0].split(",") if track_id != ""]
+            tracks = {}
+            for track_id in track_ids:
+                track = self._conn.execute("SELECT track_id, title, artist, rotation, filename FROM tracks "
+                                           "WHERE track_id = ?", (track_id,)).fetchone()
+                if track is not None:
+                    tracks[track_id] = track
+
+        records = [tracks[track_id] for track_id in track_ids if track_id in tracks]
+
+        return (records, row[1] < time.time())
+
+    def get_playlist_ids(self, show_id):
+        """Get the track IDs of a cached playlist.
+
+        Returns a 2-tuple (track_ids, expired). The track IDs are None
+        if the playlist has never been cached.
+
+        :param show_id: show ID
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT track_ids, expires FROM playlists WHERE show_id = ?",
+                                     (show_id,)).fetchone()
+
+        if row is None:
+            return (None, True)
+
+        return ([track_id for track_id in row[0].split(",") if track_id != ""], row[1] < time.time())
+
+    def put_playlist(self, show_id, records, ttl=TTL_PLAYLIST):
+        """Cache the playlist of a show.
+
+        :param show_id: show ID
+        :param records: list of track records
+        :param ttl: time-to-live in seconds
+        """
+        expires = time.time() + ttl
+
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?)",
+                                   [tuple(r) + (expires,) for r in records])
+            self._conn.execute("INSERT OR REPLACE INTO playlists VALUES (?, ?, ?)",
+                               (show_id, ",".join(r[0] for r in records), expires))
+            self._index(records)
+
+    def put_tracks(self, records, ttl=TTL_TRACK):
+        """Cache tracks which do not belong to a playlist, such as search results.
+
+        Returns the number of tracks which were not cached before or
+        whose metadata has changed.
+
+        :param records: list of track records
+        :param ttl: time-to-live in seconds
+        """
+        expires = time.time() + ttl
+        num_changed = 0
+
+        with self._lock, self._conn:
+            for record in records:
+                row = self._conn.execute("SELECT track_id, title, artist, rotation, filename FROM tracks "
+                                         "WHERE track_id = ?", (record[0],)).fetchone()
+                if row != tuple(record):
+                    num_changed += 1
+
+            self._conn.executemany("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?)",
+                                   [tuple(r) + (expires,) for r in records])
+            self._index(records)
+
+        return num_changed
+
+    def get_show_ids(self):
+        """Get the IDs of all cached shows."""
+        with self._lock:
+            rows = self._conn.execute("SELECT show_id FROM playlists").fetchall()
+
+        return [row[0] for row in rows]
+
+    def get_records(self):
+        """Get the records of every cached cart and track."""
+        with self._lock:
+            carts = self._conn.execute("SELECT cart_id, title, issuer, cart_type, filename FROM carts").fetchall()
+            tracks = self._conn.execute("SELECT track_id, title, artist, rotation, filename FROM tracks").fetchall()
+
+        return carts + tracks
+
+    def get_mtime(self):
+        """Get the time of the last change to the catalog by any process."""
+        mtimes = []
+
+        for path in (self._path, self._path + "-wal"):
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                pass
+
+        return max(mtimes)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Search the cached carts and tracks.
+
+        Every word of the query must match the beginning of a word in
+        the title or issuer. Results are ranked by relevance, with
+        carts and tracks mixed together.
+
+        :param query: search term
+        :param limit: maximum number of results
+        """
+        match = to_match_query(query)
+
+        if match is None:
+            return []
+
+        with self._lock:
+            rows = self._conn.execute("SELECT COALESCE(carts.cart_id, tracks.track_id), "
+                                      "COALESCE(carts.title, tracks.title), COALESCE(carts.issuer, tracks.artist), "
+                                      "COALESCE(carts.cart_type, tracks.rotation), "
+                                      "COALESCE(carts.filename, tracks.filename) "
+                                      "FROM (SELECT rowid AS docid, bm25(search, ?, ?) AS score FROM search "
+                                      "WHERE search MATCH ? ORDER BY score LIMIT ?) AS hits "
+                                      "JOIN search_ids ON search_ids.docid = hits.docid "
+                                      "LEFT JOIN carts ON carts.cart_id = search_ids.record_id "
+                                      "LEFT JOIN tracks ON tracks.track_id = search_ids.record_id "
+                                      "ORDER BY hits.score",
+                                      (RANK_WEIGHTS[0], RANK_WEIGHTS[1], match, limit)).fetchall()
+
+        return [row for row in rows if row[0] is not None]
@@ -0,0 +1,104 @@
+"""The clock module provides the clocks used by the Automation queue.
+
+The cart queue and planner read the time, sleep and run background work
+through a clock, so that they can be driven by a virtual clock in
+simulations (see test/simulate.py) instead of the wall clock.
+"""
+import datetime
+import heapq
+import itertools
+import threading
+import time
+
+
+class Clock(object):
+    """The Clock class is the wall clock."""
+
+    def now(self):
+        """Get the current time as a datetime."""
+        return datetime.datetime.now()
+
+    def sleep(self, seconds):
+        """Wait for a number of seconds.
+
+        :param seconds
+        """
+        time.sleep(seconds)
+
+    def run_async(self, target):
+        """Run a function in the background.
+
+        :param target
+        """
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+
+
+class VirtualClock(Clock):
+    """The VirtualClock class is a clock whose time only moves when it is advanced.
+
+    Callbacks can be scheduled at virtual times; running the clock
+    moves the time to each callback in order and calls it. Background
+    work runs immediately, so simulations are deterministic.
+    """
+    _now = None
+    _events = None
+    _counter = None
+
+    def __init__(self, start):
+        """Construct a virtual clock.
+
+        :param start: initial time as a datetime
+        """
+        self._now = start
+        self._events = []
+        self._counter = itertools.count()
+
+    def now(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self._now += datetime.timedelta(seconds=seconds)
+
+    def run_async(self, target):
+        target()
+
+    def call_at(self, when, callback):
+        """Schedule a callback at a virtual time.
+
+        Returns a handle which can be passed to cancel().
+
+        :param when: datetime
+        :param callback: function to call
+        """
+        event = [when, next(self._counter), callback]
+        heapq.heappush(self._events, event)
+        return event
+
+    def cancel(self, event):
+        """Cancel a scheduled callback.
+
+        :param event: handle returned by call_at()
+        """
+        event[2] = None
+
+    def run_until(self, end):
+        """Call every scheduled callback up to a virtual time, in order.
+
+        Returns the number of callbacks called.
+
+        :param end: datetime
+        """
+        num_events = 0
+
+        while len(self._events) > 0 and self._events[0][0] <= end:
+            when, _, callback = heapq.heappop(self._events)
+
+            if callback is not None:
+                self._now = max(self._now, when)
+                callback()
+                num_events += 1
+
+        self._now = max(self._now, end)
+
+        return num_events
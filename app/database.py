@@ -1,47 +1,246 @@
 """The database module provides a collection of functions for the server API."""
+import fcntl
+import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
-from cart import Cart
+import session
+from cart import Cart, from_record
+from catalog import Catalog, CACHE_DIR, SEARCH_LIMIT, to_match_query
+from lrucache import LRUCache
+from scanner import Scanner
+import snapshot
+from spool import Spool, PermanentError
+
+# the library and server can be overridden, e.g. to use test/standin_server.py
+LIBRARY_PREFIX = os.environ.get("ZAUTOMATE_LIBRARY_PREFIX", "/media/Jemaine/")
+API_ROOT = os.environ.get("ZAUTOMATE_API_ROOT", "https://wsbf.net/api/zautomate/")
+
+URL_CARTLOAD = API_ROOT + "cartmachine_load.php"
+URL_AUTOLOAD = API_ROOT + "automation_generate_showplist.php"
+URL_AUTOSTART = API_ROOT + "automation_generate_showid.php"
+URL_AUTOCART = API_ROOT + "automation_add_carts.php"
+URL_STUDIOSEARCH = API_ROOT + "studio_search.php"
+URL_LOG_CART = API_ROOT + "log_cart.php"
+URL_LOG_TRACK = API_ROOT + "log_track.php"
+
+SPOOL_PATH = CACHE_DIR + "log_spool"
+SNAPSHOT_PATH = CACHE_DIR + "catalog.snap"
+
+# time between checks for changes to the catalog snapshot, in seconds
+SNAPSHOT_INTERVAL = 30
+
+# maximum number of requests in flight for concurrent fetches
+FETCH_WORKERS = 4
+
+### size and time-to-live of the search result cache
+SEARCH_CACHE_SIZE = 100
+SEARCH_CACHE_TTL = 10 * 60
+
+# maximum number of audio files probed at once
+PROBE_WORKERS = 8
+
+CART_TYPE_NAMES = {
+    0: "PSA",
+    1: "Underwriting",
+    2: "StationID",
+    3: "Promotion"
+}
+
+# number of keep-alive connections for each endpoint
+POOL_SIZES = {
+    URL_CARTLOAD: 4,
+    URL_AUTOLOAD: 4,
+    URL_AUTOSTART: 2,
+    URL_AUTOCART: 2,
+    URL_STUDIOSEARCH: 2,
+    URL_LOG_CART: 1,
+    URL_LOG_TRACK: 1
+}
+
+for _url in POOL_SIZES:
+    session.mount(_url, POOL_SIZES[_url])
+
+
+_catalog = Catalog()
+_search_cache = LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+_probe_executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS)
+_refreshing = set()
+_refresh_lock = threading.Lock()
+
+# index the library in the background, so that playability is checked without touching it
+_scanner = Scanner(LIBRARY_PREFIX)
+
+_snapshot = snapshot.Snapshot(SNAPSHOT_PATH)
+
+
+def write_snapshot():
+    """Write a new catalog snapshot if the catalog has changed since the last one.
+
+    Returns False if another process is writing the snapshot.
+    """
+    with open(SNAPSHOT_PATH + ".lock", "w") as owner:
+        try:
+            fcntl.flock(owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+
+        # the snapshot is stamped with the time of the catalog it was written from,
+        # so that changes made while it is being written are picked up next time
+        mtime = _catalog.get_mtime()
+
+        if mtime > _snapshot.get_mtime():
+            snapshot.write(SNAPSHOT_PATH, _catalog.get_records(), mtime)
+
+    return True
+
+
+def _run_snapshot():
+    """Keep the catalog snapshot up to date in a separate thread."""
+    while True:
+        try:
+            write_snapshot()
+        except Exception as e:
+            print(time.asctime() + " :=: Error: Could not write catalog snapshot: %s: %s" % (type(e).__name__, e))
+
+        time.sleep(SNAPSHOT_INTERVAL)
+
+
+def _refresh(key, target, *args):
+    """Refresh an expired catalog entry in a separate thread.
 
-LIBRARY_PREFIX = "/media/Jemaine/"
+    Only one refresh runs at a time for each key.
 
-URL_CARTLOAD = "https://wsbf.net/api/zautomate/cartmachine_load.php"
-URL_AUTOLOAD = "https://wsbf.net/api/zautomate/automation_generate_showplist.php"
-URL_AUTOSTART = "https://wsbf.net/api/zautomate/automation_generate_showid.php"
-URL_AUTOCART = "https://wsbf.net/api/zautomate/automation_add_carts.php"
-URL_STUDIOSEARCH = "https://wsbf.net/api/zautomate/studio_search.php"
-URL_LOG_CART = "https://wsbf.net/api/zautomate/log_cart.php"
-URL_LOG_TRACK = "https://wsbf.net/api/zautomate/log_track.php"
+    :param key: catalog entry key
+    :param target: function which fetches and caches the entry
+    :param args: arguments to target
+    """
+    with _refresh_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def _refresh_internal():
+        try:
+            target(*args)
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(key)
+
+    thread = threading.Thread(target=_refresh_internal, daemon=True)
+    thread.start()
+
+
+def fetch_concurrent(func, args_list, max_workers=FETCH_WORKERS):
+    """Call a function with each of several argument tuples in parallel.
 
+    Yields a 2-tuple (args, result) for each call as soon as it
+    completes. Calls which have not started when the caller stops
+    iterating are cancelled.
+
+    :param func: function to call
+    :param args_list: list of argument tuples
+    :param max_workers: maximum number of calls in flight
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    try:
+        futures = {executor.submit(func, *args): args for args in args_list}
 
-def get_new_show_id(show_id):
+        for future in as_completed(futures):
+            yield (futures[future], future.result())
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _probe(record):
+    """Construct a Cart or Track from a record if its audio file is playable.
+
+    :param record: cart or track record
+    """
+    cart = from_record(record)
+
+    if cart.is_playable():
+        return cart
+
+    return None
+
+
+def build_playable(records, executor=None):
+    """Construct a Cart or Track for each record and keep the playable ones.
+
+    The audio files are probed in parallel, and the order of the
+    records is preserved. Once the library has been scanned, files
+    are looked up in the library index instead of being probed.
+
+    :param records: list of cart records
+    :param executor: optional executor to use instead of the shared probe pool
+    """
+    if executor is None:
+        executor = _probe_executor
+
+    return [cart for cart in executor.map(_probe, records) if cart is not None]
+
+
+def _cart_record(cart_res):
+    """Get a cart record from a cart in an API response.
+
+    :param cart_res
+    """
+    # TODO: move pathname building to Cart constructor
+    filename = LIBRARY_PREFIX + "carts/" + cart_res["filename"]
+
+    return (cart_res["cartID"], cart_res["title"], cart_res["issuer"], cart_res["type"], filename)
+
+
+def _track_record(track_res):
+    """Get a track record from a playlist track in an API response.
+
+    :param track_res
+    """
+    # TODO: move pathname building to Track constructor
+    filename = LIBRARY_PREFIX + track_res["file_name"]
+    track_id = track_res["lb_album_code"] + "-" + track_res["lb_track_num"]
+
+    return (track_id, track_res["lb_track_name"], track_res["artist_name"], track_res["rotation"], filename)
+
+
+def get_new_show_id(show_id, deadline=None):
     """Get a new show ID for queueing playlists.
 
     :param show_id: previous show ID, which will be excluded
+    :param deadline: optional session.Deadline for the request
     """
     try:
-        res = requests.get(URL_AUTOSTART, params={"showid": show_id})
+        res = session.get(URL_AUTOSTART, deadline, params={"showid": show_id})
         return res.json()
-    except requests.exceptions.ConnectionError:
+    except requests.exceptions.RequestException:
         print("Error: Could not fetch starting show ID.")
-        return -1
 
+    # fall back to a show from the catalog
+    show_ids = [s for s in _catalog.get_show_ids() if s != show_id]
+
+    if len(show_ids) > 0:
+        return random.choice(show_ids)
 
-def get_cart(cart_type):
+    return -1
+
+
+def get_cart(cart_type, deadline=None):
     """Get a random cart of a given type.
 
+    If the server cannot provide a cart before the deadline, a cart
+    is chosen from the catalog instead.
+
     :param cart_type
+    :param deadline: optional session.Deadline for the requests
     """
 
     # temporary code to transform cart_type to index
-    types = {
-        0: "PSA",
-        1: "Underwriting",
-        2: "StationID",
-        3: "Promotion"
-    }
-    for t in types:
-        if types[t] is cart_type:
+    for t in CART_TYPE_NAMES:
+        if CART_TYPE_NAMES[t] == cart_type:
             cart_type = t
 
     try:
@@ -49,7 +248,7 @@ def get_cart(cart_type):
         count = 0
         while count < 5:
             # fetch a random cart
-            res = requests.get(URL_AUTOCART, params={"type": cart_type})
+            res = session.get(URL_AUTOCART, deadline, params={"type": cart_type})
             cart_res = res.json()
 
             # return if cart type is empty
@@ -57,121 +256,302 @@ def get_cart(cart_type):
                 return None
 
             # construct cart
-            filename = LIBRARY_PREFIX + "carts/" + cart_res["filename"]
-            cart = Cart(cart_res["cartID"], cart_res["title"], cart_res["issuer"], cart_res["type"], filename)
+            cart = Cart(*_cart_record(cart_res))
 
             # verify cart filename
             if cart.is_playable():
                 return cart
             else:
                 count += 1
-    except requests.exceptions.ConnectionError:
+    except requests.exceptions.RequestException:
         print(time.asctime() + " :=: Error: Could not fetch cart.")
 
+    # fall back to a cart from the catalog
+    for _ in range(5):
+        record = _catalog.get_random_cart(cart_type)
+
+        if record is None:
+            return None
+
+        cart = Cart(*record)
+
+        if cart.is_playable():
+            return cart
+
     return None
 
 
-def get_playlist(show_id):
+def _fetch_playlist(show_id, deadline=None):
+    """Fetch the playlist from a past show and cache it in the catalog.
+
+    :param show_id: show ID
+    :param deadline: optional session.Deadline for the request
+    """
+    try:
+        res = session.get(URL_AUTOLOAD, deadline, params={"showid": show_id})
+        records = [_track_record(track_res) for track_res in res.json()]
+    except requests.exceptions.RequestException:
+        print("Error: Could not fetch playlist.")
+        return None
+
+    _catalog.put_playlist(show_id, records)
+    _search_cache.clear()
+
+    return records
+
+
+def get_playlist(show_id, deadline=None):
     """Get the playlist from a past show.
 
+    The playlist is served from the catalog if it has been cached.
+
     :param show_id: show ID
+    :param deadline: optional session.Deadline for the request
     """
-    playlist = []
+    track_ids, expired = _catalog.get_playlist_ids(show_id)
+    records = None
 
+    if track_ids is not None:
+        records = _snapshot.get_many(track_ids)
+
+        # the snapshot may not have caught up with the catalog yet
+        if None in records:
+            records = _catalog.get_playlist(show_id)[0]
+
+    if records is None:
+        records = _fetch_playlist(show_id, deadline) or []
+    elif expired:
+        _refresh(("playlist", show_id), _fetch_playlist, show_id)
+
+    return build_playable(records)
+
+
+def _fetch_carts(cart_type):
+    """Fetch the carts of a cart type and cache them in the catalog.
+
+    :param cart_type: cart type index
+    """
     try:
-        res = requests.get(URL_AUTOLOAD, params={"showid": show_id})
-        playlist_res = res.json()
+        res = session.get(URL_CARTLOAD, params={"type": cart_type})
+        records = [_cart_record(cart_res) for cart_res in res.json()]
+    except requests.exceptions.RequestException:
+        print(time.asctime() + " :=: Error: Could not fetch carts.")
+        return None
 
-        for track_res in playlist_res:
-            # TODO: move pathname building to Track constructor
-            filename = LIBRARY_PREFIX + track_res["file_name"]
-            track_id = track_res["lb_album_code"] + "-" + track_res["lb_track_num"]
+    _catalog.put_carts(cart_type, records)
+    _search_cache.clear()
 
-            track = Cart(track_id, track_res["lb_track_name"], track_res["artist_name"], track_res["rotation"],
-                         filename)
+    return records
 
-            if track.is_playable():
-                playlist.append(track)
-    except requests.exceptions.ConnectionError:
-        print("Error: Could not fetch playlist.")
 
-    return playlist
+def _get_carts_of_type(cart_type):
+    """Get the playable carts of a cart type.
+
+    :param cart_type: cart type index
+    """
+    records, expired = _catalog.get_carts(cart_type)
+
+    if records is None:
+        records = _fetch_carts(cart_type) or []
+    elif expired:
+        _refresh(("carts", cart_type), _fetch_carts, cart_type)
+
+    return build_playable(records)
+
+
+def iter_carts():
+    """Load the carts of each cart type in parallel.
+
+    Yields a 2-tuple (cart_type, carts) for each cart type as soon as
+    its carts are loaded.
+    """
+    for args, carts in fetch_concurrent(_get_carts_of_type, [(cart_type,) for cart_type in CART_TYPE_NAMES]):
+        yield (args[0], carts)
 
 
 def get_carts():
-    """Load a dictionary of cart arrays for each cart type."""
-    carts = {
-        0: [],
-        1: [],
-        2: [],
-        3: []
-    }
+    """Load a dictionary of cart arrays for each cart type.
 
-    try:
-        for cart_type in carts:
-            res = requests.get(URL_CARTLOAD, params={"type": cart_type})
-            carts_res = res.json()
+    The carts are served from the catalog if they have been cached.
+    """
+    carts = {}
 
-            for cart_res in carts_res:
-                # TODO: move pathname building to Cart constructor
-                filename = LIBRARY_PREFIX + "carts/" + cart_res["filename"]
+    for cart_type, carts_of_type in iter_carts():
+        carts[cart_type] = carts_of_type
 
-                cart = Cart(cart_res["cartID"], cart_res["title"], cart_res["issuer"], cart_res["type"], filename)
+    return {cart_type: carts[cart_type] for cart_type in sorted(carts)}
 
-                if cart.is_playable():
-                    carts[cart_type].append(cart)
 
-    except requests.exceptions.ConnectionError:
-        print(time.asctime() + " :=: Error: Could not fetch carts.")
+def iter_playlists(show_ids, deadline=None):
+    """Get the playlists from several past shows in parallel.
 
-    return carts
+    Yields a 2-tuple (show_id, playlist) for each show as soon as its
+    playlist is loaded. Playlists which have not been loaded when the
+    caller stops iterating are cancelled.
 
+    :param show_ids: list of show IDs
+    :param deadline: optional session.Deadline for the requests
+    """
+    for args, playlist in fetch_concurrent(get_playlist, [(show_id, deadline) for show_id in show_ids]):
+        yield (args[0], playlist)
 
-def search_library(query):
-    """Search the music library for tracks and carts.
+
+def _fetch_search(query):
+    """Search the music library on the server and cache the tracks in the catalog.
 
     :param query: search term
     """
-    results = []
+    records = []
 
     try:
-        res = requests.get(URL_STUDIOSEARCH, params={"query": query})
+        res = session.get(URL_STUDIOSEARCH, params={"query": query})
         results_res = res.json()
 
         for cart_res in results_res["carts"]:
-            filename = LIBRARY_PREFIX + "carts/" + cart_res["filename"]
-
-            cart = Cart(cart_res["cartID"], cart_res["title"], cart_res["issuer"], cart_res["type"], filename)
-            if cart.is_playable():
-                results.append(cart)
+            records.append(_cart_record(cart_res))
 
         for track_res in results_res["tracks"]:
             filename = LIBRARY_PREFIX + track_res["file_name"]
             track_id = track_res["album_code"] + "-" + track_res["track_num"]
 
-            track = Cart(track_id, track_res["track_name"], track_res["artist_name"], track_res["rotation"], filename)
-            if track.is_playable():
-                results.append(track)
-    except requests.exceptions.ConnectionError:
+            records.append((track_id, track_res["track_name"], track_res["artist_name"], track_res["rotation"],
+                            filename))
+    except requests.exceptions.RequestException:
         print("Error: Could not fetch search results.")
+        return None
+
+    # the cached search results are stale if the server knows of new tracks
+    if _catalog.put_tracks([record for record in records if not record[0].isdigit()]) > 0:
+        _search_cache.clear()
+
+    return records
+
+
+def get_search_stats():
+    """Get the counters of the search result cache as a dictionary."""
+    return _search_cache.get_stats()
+
+
+def iter_search(query, page_size, limit=SEARCH_LIMIT):
+    """Search the music library and yield the results in pages.
+
+    Yields a 2-tuple (page, truncated) for each page, where the page is
+    a list of playable carts and tracks, so that callers can show the
+    first results before every audio file is probed. Truncated is True
+    if the search matched more records than the limit.
+
+    Repeated searches are answered from the search result cache,
+    without searching the index or the server again. The cache is keyed
+    on the full-text query which the index is searched with, so queries
+    which differ only in case, punctuation or spacing share an entry.
+
+    :param query: search term
+    :param page_size: number of records probed for each page
+    :param limit: maximum number of results
+    """
+    match = to_match_query(query)
+    key = (match, limit)
+    records = _search_cache.get(key)
+
+    if records is None:
+        records = _catalog.search(query, limit)
+
+        if len(records) > 0:
+            _search_cache.put(key, records)
+            _refresh(("search", match), _fetch_search, query)
+        else:
+            records = _fetch_search(query)
+
+            if records is None:
+                records = []
+            else:
+                records = records[0:limit]
+                _search_cache.put(key, records)
+
+    truncated = len(records) >= limit
+
+    for i in range(0, len(records), page_size):
+        yield (build_playable(records[i:i + page_size]), truncated)
+
+
+def search_library(query, limit=SEARCH_LIMIT):
+    """Search the music library for tracks and carts.
+
+    The search is answered from the catalog's full-text index, ranked
+    by relevance. The server is searched in the background to add new
+    tracks to the index, or directly if the index has no results.
+
+    :param query: search term
+    :param limit: maximum number of results
+    """
+    results = []
+
+    for page, _ in iter_search(query, limit, limit):
+        results.extend(page)
 
     return results
 
 
-def log_cart(cart_id):
-    """Log a cart or track.
+def _post_log(cart_id):
+    """Send a cart or track to the logger.
+
+    Returns whether the server accepted the entry. Raises PermanentError
+    if the entry is malformed or the server rejected it, since sending it
+    again would fail again.
 
     :param cart_id: cart ID, or [album_code]-[track_num] for a track
     """
+    if not cart_id.isdigit() and len(cart_id.split("-")) != 2:
+        raise PermanentError("malformed track ID " + repr(cart_id))
+
     try:
         if cart_id.isdigit():
-            res = requests.post(URL_LOG_CART, params={"cartid": cart_id})
+            res = session.post(URL_LOG_CART, params={"cartid": cart_id})
         else:
-            album_id = cart_id.split("-")[0]
+            album_id, track_num = cart_id.split("-")
             disc_num = 1
-            track_num = cart_id.split("-")[1]
-            res = requests.post(URL_LOG_TRACK,
-                                params={"albumID": album_id, "disc_num": disc_num, "track_num": track_num})
+            res = session.post(URL_LOG_TRACK,
+                               params={"albumID": album_id, "disc_num": disc_num, "track_num": track_num})
         print(res.text)
-    except requests.exceptions.ConnectionError:
+        return True
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and 400 <= e.response.status_code < 500:
+            raise PermanentError("server rejected %s with status %d" % (cart_id, e.response.status_code))
+
         print(time.asctime() + " :=: Caught error: Could not access cart logger.")
+        return False
+    except requests.exceptions.RequestException:
+        print(time.asctime() + " :=: Caught error: Could not access cart logger.")
+        return False
+
+
+_spool = Spool(SPOOL_PATH, _post_log)
+
+
+def start():
+    """Start the background work of the database module.
+
+    Importing the module starts nothing, so that tools and tests which
+    only read the catalog do not flush the log spool, scan the library
+    or write the catalog snapshot. The apps call this function once at
+    startup.
+    """
+    _spool.start()
+    _scanner.start()
+    threading.Thread(target=_run_snapshot, daemon=True).start()
+
+
+def log_cart(cart_id):
+    """Log a cart or track.
+
+    The entry is written to the log spool and sent to the server
+    in the background.
+
+    :param cart_id: cart ID, or [album_code]-[track_num] for a track
+    """
+    _spool.append(cart_id)
+
+
+def get_log_stats():
+    """Get the counters of the log spool as a dictionary."""
+    return _spool.get_stats()
@@ -59,7 +59,15 @@ class DualBox(Frame):
         """
         self._list_box1.delete(0, tkinter.END)
         self._list_box2.delete(0, tkinter.END)
+        self._prev_index = None
 
+        self.append(carts)
+
+    def append(self, carts):
+        """Append a list of carts to the DualBox.
+
+        :param carts: array of carts
+        """
         for cart in carts:
             self._list_box1.insert(tkinter.END, cart.title)
             self._list_box2.insert(tkinter.END, cart.issuer)
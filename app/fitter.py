@@ -0,0 +1,80 @@
+"""The fitter module finds tracks which fill the gap before a cart.
+
+Placing a cart at the queue position whose start time is closest to its
+target can miss the target by half a track or more. Instead, the fitter
+chooses a subset of the upcoming tracks whose total length is as close
+as possible to the gap between the current position and the target, so
+that the cart can be placed right after them.
+
+This is a subset sum problem, which is solved with a dynamic program
+over track lengths in whole seconds. The reachable sums after each
+track are kept as the bits of an integer, so that adding a track is a
+shift and an OR of the whole table. Both the number of candidate tracks
+and the CPU time are bounded, so that the fitter can run on every
+refill; when the budget runs out, the best fit among the tracks
+considered so far is used.
+"""
+import time
+
+# maximum number of tracks considered for a gap
+MAX_CANDIDATES = 32
+
+# maximum CPU time for a fit, in seconds
+FIT_BUDGET = 0.005
+
+
+def fit(lengths, gap, tolerance, max_candidates=MAX_CANDIDATES, budget=FIT_BUDGET):
+    """Choose tracks whose total length is closest to a gap.
+
+    Returns a 2-tuple (indices, error) with the indices of the chosen
+    tracks in ascending order and the difference between their total
+    length and the gap, in seconds, or None if no subset of the tracks
+    is within the tolerance of the gap.
+
+    :param lengths: lengths of the candidate tracks in seconds
+    :param gap: length of the gap in seconds
+    :param tolerance: maximum difference from the gap in seconds
+    :param max_candidates: maximum number of tracks to consider
+    :param budget: maximum CPU time in seconds
+    """
+    begin = time.process_time()
+    gap = int(round(gap))
+    tolerance = int(tolerance)
+    lengths = [int(round(length)) for length in lengths[0:max_candidates]]
+
+    if gap < 0:
+        return None
+
+    # bit s of reachable[i] is set if some subset of the first i tracks sums to s
+    mask = (1 << (gap + tolerance + 1)) - 1
+    reachable = [1]
+
+    for length in lengths:
+        reachable.append((reachable[-1] | (reachable[-1] << length)) & mask)
+
+        if time.process_time() - begin > budget:
+            break
+
+    # find the reachable sums closest to the gap from below and from above
+    table = reachable[-1]
+    below = (table & ((1 << (gap + 1)) - 1)).bit_length() - 1
+    above = table >> gap
+    above = gap + (above & -above).bit_length() - 1 if above != 0 else -1
+
+    candidates = [total for total in (below, above) if total >= 0 and abs(total - gap) <= tolerance]
+
+    if len(candidates) == 0:
+        return None
+
+    total = min(candidates, key=lambda total: abs(total - gap))
+
+    # walk back through the tables to find the tracks in the sum
+    indices = []
+    remaining = total
+
+    for i in range(len(reachable) - 2, -1, -1):
+        if not (reachable[i] >> remaining) & 1:
+            indices.append(i)
+            remaining -= lengths[i]
+
+    return (indices[::-1], total - gap)
@@ -0,0 +1,77 @@
+"""The lrucache module provides the LRUCache class."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """The LRUCache class is a bounded cache with expiring entries.
+
+    When the cache is full, the least recently used entry is evicted.
+    """
+    _entries = None
+    _max_entries = None
+    _ttl = None
+    _lock = None
+
+    _num_hits = 0
+    _num_misses = 0
+
+    def __init__(self, max_entries, ttl):
+        """Construct an LRUCache.
+
+        :param max_entries: maximum number of entries
+        :param ttl: time-to-live of each entry, in seconds
+        """
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get the value of an entry, or None if it is missing or expired.
+
+        :param key
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[1] < time.monotonic():
+                self._entries.pop(key, None)
+                self._num_misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._num_hits += 1
+
+            return entry[0]
+
+    def put(self, key, value):
+        """Add an entry to the cache.
+
+        :param key
+        :param value
+        """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """Get the cache counters as a dictionary."""
+        with self._lock:
+            total = self._num_hits + self._num_misses
+
+            return {
+                "size": len(self._entries),
+                "hits": self._num_hits,
+                "misses": self._num_misses,
+                "hit_rate": float(self._num_hits) / total if total > 0 else 0.0
+            }
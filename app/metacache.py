@@ -0,0 +1,329 @@
+"""The metacache module provides the MetadataCache class.
+
+The metadata cache is a persistent SQLite table of audio file lengths,
+shared by the three apps. Each entry is keyed by the path of a file and
+is only valid while the size and modification time of the file match,
+so a known file can be loaded with a single stat instead of parsing its
+MP3 header. Files which could not be parsed are remembered as well.
+
+The cache is bounded; when it grows past its maximum size, the least
+recently used entries are evicted.
+
+The cache also serves as the index of the library scanner (see the
+scanner module). Once a library directory tree has been scanned, files
+under it are looked up in the index without touching the file system,
+and only a file which is not in the index, such as a new upload, is
+checked with a stat. Entries in scanned directories are never evicted,
+and entries under a directory which is removed from the library are
+removed from the index at the next scan of its parent.
+"""
+import os
+import sqlite3
+import threading
+import time
+from mutagen import MutagenError
+from mutagen.mp3 import MP3
+from catalog import CACHE_DIR
+
+METADATA_PATH = CACHE_DIR + "metadata.db"
+MAX_ENTRIES = 200000
+
+# minimum time between updates of the access time of an entry, in seconds
+TOUCH_INTERVAL = 60 * 60
+
+# time between reloads of the scanned library roots, in seconds
+ROOTS_INTERVAL = 60
+
+STATUS_UNPLAYABLE = 0
+STATUS_PLAYABLE = 1
+
+# the cache is dropped and recreated when the schema version changes
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    length REAL,
+    status INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    subdirs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS roots (
+    path TEXT PRIMARY KEY,
+    scanned REAL NOT NULL
+);
+"""
+
+
+def probe(filename):
+    """Parse the length of an MP3 file in milliseconds.
+
+    Returns None if the file could not be parsed.
+
+    :param filename
+    """
+    try:
+        return MP3(filename).info.length * 1000
+    except (MutagenError, IOError):
+        return None
+
+
+class MetadataCache(object):
+    """The MetadataCache class is an on-disk cache of audio file lengths."""
+    _path = None
+    _conn = None
+    _lock = None
+    _max_entries = None
+    _num_inserted = 0
+
+    _roots = None
+    _roots_loaded = 0
+
+    def __init__(self, path=METADATA_PATH, max_entries=MAX_ENTRIES):
+        """Open a metadata cache, creating it if necessary.
+
+        :param path: location of the cache database
+        :param max_entries: maximum number of entries
+        """
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._path = path
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+
+        self._conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS dirs; "
+                                     "DROP TABLE IF EXISTS roots;")
+            self._conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def lookup(self, filename, stat):
+        """Get the cached entry of a file as a 2-tuple (length, status).
+
+        Returns None if the file is not cached or has changed.
+
+        :param filename
+        :param stat: os.stat_result of the file
+        """
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime, length, status, accessed FROM files WHERE path = ?",
+                                     (filename,)).fetchone()
+
+            if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime:
+                return None
+
+            if now - row[4] > TOUCH_INTERVAL:
+                with self._conn:
+                    self._conn.execute("UPDATE files SET accessed = ? WHERE path = ?", (now, filename))
+
+        return (row[2], row[3])
+
+    def get_path(self):
+        """Get the location of the cache database."""
+        return self._path
+
+    def lookup_indexed(self, filename):
+        """Get the indexed entry of a file as a 2-tuple (length, status), without a stat.
+
+        Returns None if the file is not indexed.
+
+        :param filename
+        """
+        with self._lock:
+            return self._conn.execute("SELECT length, status FROM files WHERE path = ?", (filename,)).fetchone()
+
+    def store(self, filename, stat, length):
+        """Cache the length of a file.
+
+        :param filename
+        :param stat: os.stat_result of the file
+        :param length: length in milliseconds, or None if the file is unplayable
+        """
+        self.store_many([(filename, stat, length)])
+
+    def store_many(self, entries):
+        """Cache the lengths of several files in one transaction.
+
+        :param entries: list of 3-tuples (filename, stat, length)
+        """
+        now = time.time()
+        rows = []
+
+        for filename, stat, length in entries:
+            status = STATUS_UNPLAYABLE if length is None else STATUS_PLAYABLE
+            rows.append((filename, os.path.dirname(filename), stat.st_size, stat.st_mtime, length, status, now))
+
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+            if (self._num_inserted + len(rows)) // 1000 > self._num_inserted // 1000:
+                self._evict()
+
+            self._num_inserted += len(rows)
+
+    def _evict(self):
+        """Evict the least recently used entries if the cache is full.
+
+        Entries in scanned directories are not evicted.
+        """
+        count = self._conn.execute("SELECT COUNT(*) FROM files WHERE dir NOT IN (SELECT path FROM dirs)").fetchone()[0]
+
+        if count > self._max_entries:
+            self._conn.execute("DELETE FROM files WHERE path IN "
+                               "(SELECT path FROM files WHERE dir NOT IN (SELECT path FROM dirs) "
+                               "ORDER BY accessed LIMIT ?)",
+                               (count - self._max_entries,))
+
+    def get_dir(self, path):
+        """Get the scanned state of a directory as a 2-tuple (mtime, subdirs).
+
+        Returns None if the directory has not been scanned.
+
+        :param path: directory path
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT mtime, subdirs FROM dirs WHERE path = ?", (path,)).fetchone()
+
+        if row is None:
+            return None
+
+        return (row[0], [subdir for subdir in row[1].split("/") if subdir != ""])
+
+    def get_dir_files(self, path):
+        """Get the indexed files of a directory as a dictionary of path to (size, mtime).
+
+        :param path: directory path
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime FROM files WHERE dir = ?", (path,)).fetchall()
+
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def put_dir(self, path, mtime, subdirs, filenames):
+        """Record a scanned directory and remove files which no longer exist from the index.
+
+        :param path: directory path
+        :param mtime: modification time of the directory
+        :param subdirs: names of the subdirectories
+        :param filenames: paths of the files which exist in the directory
+        """
+        filenames = set(filenames)
+
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT path FROM files WHERE dir = ?", (path,)).fetchall()
+            self._conn.executemany("DELETE FROM files WHERE path = ?",
+                                   [row for row in rows if row[0] not in filenames])
+
+            # remove the trees of subdirectories which no longer exist
+            row = self._conn.execute("SELECT subdirs FROM dirs WHERE path = ?", (path,)).fetchone()
+            if row is not None:
+                for subdir in set(row[0].split("/")) - set(subdirs) - {""}:
+                    self._purge_tree(os.path.join(path, subdir))
+
+            self._conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (path, mtime, "/".join(subdirs)))
+
+    def _purge_tree(self, path):
+        """Remove a directory and everything under it from the index.
+
+        Must be called with the lock held, inside a transaction.
+
+        :param path: directory path
+        """
+        # the paths under a directory sort between path + "/" and path + "0"
+        for table, column in (("files", "dir"), ("dirs", "path")):
+            self._conn.execute("DELETE FROM %s WHERE %s = ? OR (%s >= ? AND %s < ?)" % (table, column, column, column),
+                               (path, path + "/", path + "0"))
+
+    def put_root(self, path):
+        """Record that a directory tree has been completely scanned.
+
+        :param path: root directory path
+        """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO roots VALUES (?, ?)", (path, time.time()))
+            self._roots_loaded = 0
+
+    def _is_indexed(self, filename):
+        """Get whether a file is under a completely scanned directory tree.
+
+        :param filename
+        """
+        now = time.time()
+
+        with self._lock:
+            if now - self._roots_loaded > ROOTS_INTERVAL:
+                self._roots = [row[0] for row in self._conn.execute("SELECT path FROM roots").fetchall()]
+                self._roots_loaded = now
+
+            roots = self._roots
+
+        return any(filename.startswith(root.rstrip("/") + "/") for root in roots)
+
+    def get_length(self, filename):
+        """Get the length of an audio file in milliseconds.
+
+        Raises IOError if the file does not exist or is unplayable.
+
+        :param filename
+        """
+        filename = os.fsdecode(filename)
+
+        # files in the library index are looked up without touching the file system
+        entry = self.lookup_indexed(filename) if self._is_indexed(filename) else None
+
+        # files which are not in the index, such as new uploads, are checked directly
+        if entry is None:
+            stat = os.stat(filename)
+            entry = self.lookup(filename, stat)
+
+            if entry is None:
+                length = probe(filename)
+                self.store(filename, stat, length)
+                entry = (length, STATUS_UNPLAYABLE if length is None else STATUS_PLAYABLE)
+
+        if entry[1] != STATUS_PLAYABLE:
+            raise IOError("could not parse audio file " + filename)
+
+        return entry[0]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Get the metadata cache shared by this process."""
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache()
+
+    return _cache
+
+
+def get_length(filename):
+    """Get the length of an audio file in milliseconds from the shared cache.
+
+    Raises IOError if the file does not exist or is unplayable.
+
+    :param filename
+    """
+    return get_cache().get_length(filename)
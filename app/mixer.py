@@ -0,0 +1,493 @@
+"""The mixer module provides the Mixer and Source classes.
+
+The mixer plays any number of sources at once through a single audio
+output, so that tracks can overlap for segues and crossfades. Each
+source is decoded ahead of time into a ring buffer of PCM frames by a
+decoder thread, and an output thread sums the sources with NumPy in
+blocks of a fixed number of frames, applies their fade curves and
+writes the mixed block to a sink.
+
+The output thread keeps at most a few blocks ahead of the sink, which
+bounds the latency from a change, such as a stop or a fade, to the
+moment it is heard. Two kinds of underruns are counted: a source
+underrun when the ring buffer of a source runs dry before the end of
+its file, which is heard as a dropout in that source only, and an
+output underrun when a block is mixed after the sink has played
+everything it was given, which is heard as a dropout in the output.
+"""
+import threading
+import time
+import numpy as np
+import supervisor
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+# number of frames mixed at a time
+BLOCK_FRAMES = 1024
+
+# maximum number of blocks written ahead of the sink
+LATENCY_BLOCKS = 4
+
+# decoded audio kept ahead of each source, in seconds
+RING_SECONDS = 2.0
+
+# time between decoder passes, in seconds
+DECODE_INTERVAL = 0.05
+
+
+def fade_linear(t):
+    """Get the gain of a linear fade at fractions of its length.
+
+    :param t: array of fractions between 0 and 1
+    """
+    return t
+
+
+def fade_equal_power(t):
+    """Get the gain of an equal-power fade, which keeps the loudness of a crossfade constant.
+
+    :param t: array of fractions between 0 and 1
+    """
+    return np.sin(t * (np.pi / 2))
+
+
+def fade_exponential(t):
+    """Get the gain of a fade which sounds even to the ear.
+
+    :param t: array of fractions between 0 and 1
+    """
+    return t * t
+
+
+FADE_CURVES = {
+    "linear": fade_linear,
+    "equal_power": fade_equal_power,
+    "exponential": fade_exponential
+}
+
+
+class RingBuffer(object):
+    """The RingBuffer class is a fixed-size FIFO of PCM frames."""
+    _frames = None
+    _start = 0
+    _size = 0
+    _lock = None
+
+    def __init__(self, capacity):
+        """Construct an empty ring buffer.
+
+        :param capacity: number of frames
+        """
+        self._frames = np.zeros((capacity, CHANNELS), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def get_free(self):
+        """Get the number of frames which can be written."""
+        return len(self._frames) - self._size
+
+    def write(self, frames):
+        """Append frames, as many as fit.
+
+        Returns the number of frames written.
+
+        :param frames: float32 array of shape (count, CHANNELS)
+        """
+        with self._lock:
+            capacity = len(self._frames)
+            count = min(len(frames), capacity - self._size)
+            end = (self._start + self._size) % capacity
+            first = min(count, capacity - end)
+
+            self._frames[end:end + first] = frames[0:first]
+            self._frames[0:count - first] = frames[first:count]
+            self._size += count
+
+            return count
+
+    def read(self, count):
+        """Remove and get up to a number of frames.
+
+        :param count
+        """
+        with self._lock:
+            capacity = len(self._frames)
+            count = min(count, self._size)
+            first = min(count, capacity - self._start)
+
+            frames = np.concatenate((self._frames[self._start:self._start + first], self._frames[0:count - first]))
+            self._start = (self._start + count) % capacity
+            self._size -= count
+
+            return frames
+
+
+class Source(object):
+    """The Source class is a stream of PCM frames played by the mixer."""
+    _decode = None
+    _rate = None
+    _on_end = None
+    _ring = None
+    _pending = None
+    _last = None
+    _phase = 0.0
+    _eof = False
+    _finished = False
+    _position = 0
+    _gain = 1.0
+    _fade = None
+    _lock = None
+
+    def __init__(self, decode, rate=SAMPLE_RATE, on_end=None, gain=1.0):
+        """Construct a source.
+
+        :param decode: function which returns the next buffer of 16-bit stereo PCM, an empty
+                       buffer if none is ready yet, or None at the end
+        :param rate: sample rate of the decoded PCM
+        :param on_end: function to call on the dispatch thread of the supervisor when the source ends
+        :param gain: initial gain
+        """
+        self._decode = decode
+        self._rate = rate
+        self._on_end = on_end
+        self._gain = gain
+        self._ring = RingBuffer(int(RING_SECONDS * SAMPLE_RATE))
+        self._lock = threading.Lock()
+
+    def _convert(self, buf):
+        """Convert a buffer of 16-bit PCM to float frames at the output sample rate.
+
+        The resampler is linear and carries its state from one buffer to
+        the next: the last input frame of the previous buffer, so that
+        output frames between two buffers are interpolated, and the
+        phase of the next output frame, so that the fraction of a frame
+        left over at the end of a buffer is not dropped.
+
+        :param buf
+        """
+        frames = np.frombuffer(buf, dtype=np.int16).reshape(-1, CHANNELS).astype(np.float32) / 32768.0
+
+        if self._rate != SAMPLE_RATE and len(frames) > 0:
+            # the phase is measured from the last input frame of the previous buffer
+            if self._last is not None:
+                frames = np.concatenate((self._last, frames))
+
+            step = self._rate / SAMPLE_RATE
+            count = max(0, int(np.floor((len(frames) - 1 - self._phase) / step)) + 1)
+            x = self._phase + np.arange(count) * step
+
+            self._last = frames[-1:]
+            self._phase = self._phase + count * step - (len(frames) - 1)
+
+            frames = np.stack([np.interp(x, np.arange(len(frames)), frames[:, c]) for c in range(CHANNELS)],
+                              axis=1).astype(np.float32)
+
+        return frames
+
+    def fill(self):
+        """Decode until the ring buffer is full or the file ends.
+
+        This function runs on the decoder thread.
+        """
+        while not self._eof and not self._finished:
+            if self._pending is None:
+                if self._ring.get_free() < BLOCK_FRAMES:
+                    return
+
+                buf = self._decode()
+
+                if buf is None:
+                    self._eof = True
+                    return
+
+                # no frames are ready yet
+                if len(buf) == 0:
+                    return
+
+                self._pending = self._convert(buf)
+
+            count = self._ring.write(self._pending)
+            self._pending = self._pending[count:] if count < len(self._pending) else None
+
+            if self._pending is not None:
+                return
+
+    def fade(self, seconds, gain, curve="equal_power", stop=False):
+        """Fade the source from its current gain to another gain.
+
+        :param seconds: length of the fade
+        :param gain: gain at the end of the fade
+        :param curve: name of a curve in FADE_CURVES
+        :param stop: whether to end the source when the fade is done
+        """
+        with self._lock:
+            self._fade = (self._position, max(1, int(seconds * SAMPLE_RATE)), self._gain, gain,
+                          FADE_CURVES[curve], stop)
+
+    def _get_gains(self, count):
+        """Get the gain of each of the next frames and advance the fade.
+
+        :param count: number of frames
+        """
+        start, length, begin, end, curve, stop = self._fade
+        t = np.clip((np.arange(self._position, self._position + count) - start) / length, 0.0, 1.0)
+
+        if end >= begin:
+            gains = begin + (end - begin) * curve(t)
+        else:
+            gains = end + (begin - end) * curve(1.0 - t)
+
+        if self._position + count >= start + length:
+            self._gain = end
+            self._fade = None
+            self._finished = self._finished or stop
+        else:
+            self._gain = float(gains[-1])
+
+        return gains.astype(np.float32)
+
+    def render(self, count):
+        """Take the next frames of the source with its gain applied.
+
+        Returns a 2-tuple (frames, underrun), where frames is a float32
+        array of shape (count, CHANNELS), padded with silence, and
+        underrun is whether the source ran dry before its end.
+
+        This function runs on the output thread.
+
+        :param count: number of frames
+        """
+        with self._lock:
+            if self._finished:
+                return np.zeros((count, CHANNELS), dtype=np.float32), False
+
+            frames = self._ring.read(count)
+            underrun = len(frames) < count and not self._eof
+
+            if len(frames) < count:
+                frames = np.concatenate((frames, np.zeros((count - len(frames), CHANNELS), dtype=np.float32)))
+
+            if self._fade is not None:
+                frames *= self._get_gains(count)[:, np.newaxis]
+            elif self._gain != 1.0:
+                frames *= self._gain
+
+            self._position += count
+
+            if self._eof and self._pending is None and len(self._ring) == 0:
+                self._finished = True
+
+            return frames, underrun
+
+    def is_finished(self):
+        """Get whether the source has ended."""
+        return self._finished
+
+    def get_position(self):
+        """Get the position of the source in milliseconds."""
+        return self._position * 1000 // SAMPLE_RATE
+
+    def end(self):
+        """Call the end callback of the source."""
+        if self._on_end is not None:
+            supervisor.dispatch(self._on_end)
+
+
+class NullSink(object):
+    """The NullSink class is an audio output which discards the audio."""
+
+    def write(self, data):
+        """Play a block of 16-bit stereo PCM.
+
+        :param data
+        """
+
+    def close(self):
+        """Close the audio output."""
+
+
+class AlsaSink(object):
+    """The AlsaSink class is an ALSA audio output."""
+    _pcm = None
+
+    def __init__(self, device="default"):
+        """Open an ALSA device.
+
+        :param device: ALSA device name
+        """
+        import alsaaudio
+
+        self._pcm = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, device=device, channels=CHANNELS, rate=SAMPLE_RATE,
+                                  format=alsaaudio.PCM_FORMAT_S16_LE, periodsize=BLOCK_FRAMES,
+                                  periods=LATENCY_BLOCKS)
+
+    def write(self, data):
+        """Play a block of 16-bit stereo PCM.
+
+        :param data
+        """
+        self._pcm.write(data)
+
+    def close(self):
+        """Close the audio output."""
+        self._pcm.close()
+
+
+def open_sink(name):
+    """Open an audio output by name.
+
+    :param name: "null" for no output, or an ALSA device name
+    """
+    if name == "null":
+        return NullSink()
+
+    return AlsaSink(name)
+
+
+class Mixer(object):
+    """The Mixer class sums sources into one audio output."""
+    _sink = None
+    _block_frames = None
+    _sources = None
+    _lock = None
+    _wakeup = None
+    _started = False
+
+    _num_blocks = 0
+    _num_source_underruns = 0
+    _num_output_underruns = 0
+    _max_mix_time = 0.0
+
+    def __init__(self, sink, block_frames=BLOCK_FRAMES):
+        """Construct a mixer.
+
+        :param sink: audio output, such as NullSink or AlsaSink
+        :param block_frames: number of frames mixed at a time
+        """
+        self._sink = sink
+        self._block_frames = block_frames
+        self._sources = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def start(self):
+        """Start the decoder and output threads."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        threading.Thread(target=self._run_decode, daemon=True).start()
+        threading.Thread(target=self._run_output, daemon=True).start()
+
+    def add(self, source):
+        """Start playing a source.
+
+        :param source
+        """
+        # decode the beginning of the source before the output thread reaches it
+        source.fill()
+
+        with self._lock:
+            self._sources.append(source)
+
+        self._wakeup.set()
+
+    def remove(self, source):
+        """Stop playing a source immediately, without calling its end callback.
+
+        :param source
+        """
+        with self._lock:
+            if source in self._sources:
+                self._sources.remove(source)
+
+    def mix(self):
+        """Mix the next block of every source.
+
+        Returns a 2-tuple (data, ended) of the block as 16-bit stereo
+        PCM and the sources which ended in the block.
+        """
+        with self._lock:
+            sources = list(self._sources)
+
+        block = np.zeros((self._block_frames, CHANNELS), dtype=np.float32)
+        ended = []
+
+        for source in sources:
+            frames, underrun = source.render(self._block_frames)
+            block += frames
+
+            if underrun:
+                self._num_source_underruns += 1
+
+            if source.is_finished():
+                ended.append(source)
+
+        with self._lock:
+            for source in ended:
+                if source in self._sources:
+                    self._sources.remove(source)
+
+            self._num_blocks += 1
+
+        data = (np.clip(block, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+        return data, ended
+
+    def _run_decode(self):
+        """Keep the ring buffer of every source full in a separate thread."""
+        while True:
+            with self._lock:
+                sources = list(self._sources)
+
+            for source in sources:
+                source.fill()
+
+            self._wakeup.wait(DECODE_INTERVAL)
+            self._wakeup.clear()
+
+    def _run_output(self):
+        """Mix blocks and write them to the sink in a separate thread."""
+        block_time = self._block_frames / SAMPLE_RATE
+        latency = LATENCY_BLOCKS * block_time
+        played_until = time.monotonic()
+
+        while True:
+            begin = time.monotonic()
+            data, ended = self.mix()
+
+            for source in ended:
+                source.end()
+
+            # the sink has played everything it was given
+            now = time.monotonic()
+            if now > played_until:
+                if self._num_blocks > 1:
+                    self._num_output_underruns += 1
+                played_until = now
+
+            self._max_mix_time = max(self._max_mix_time, now - begin)
+
+            self._sink.write(data)
+            played_until += block_time
+
+            # stay no more than the latency ahead of the sink
+            ahead = played_until - time.monotonic()
+            if ahead > latency:
+                time.sleep(ahead - latency)
+
+    def get_stats(self):
+        """Get the mixer counters as a dictionary."""
+        with self._lock:
+            return {
+                "sources": len(self._sources),
+                "blocks": self._num_blocks,
+                "source_underruns": self._num_source_underruns,
+                "output_underruns": self._num_output_underruns,
+                "latency_ms": LATENCY_BLOCKS * self._block_frames * 1000.0 / SAMPLE_RATE,
+                "max_mix_ms": self._max_mix_time * 1000
+            }
@@ -0,0 +1,378 @@
+"""The planner module provides the Planner class.
+
+The planner schedules the carts of the Automation queue. Every cart slot
+in the configuration is planned for each hour of a lookahead period, and
+the cart for each slot is fetched ahead of time, in the background, so
+that no cart is fetched from the server when a track ends.
+
+A slot is placed in the queue as soon as the queue reaches its target
+time, at the position whose start time is closest to the target. Slots
+which the queue has not reached yet stay pending until tracks are added,
+so they are not dropped when the queue is short. When the queue falls
+behind or ahead of its planned start times, only the carts which have
+drifted out of their windows are moved.
+
+When the closest position misses the target, the tracks after the
+previous cart are reordered so that the ones which best fill the gap
+to the target play before the cart (see the fitter module). A cart is
+placed when the queue first reaches its target, when few tracks may be
+left to choose from, so the carts which have not started are placed
+again whenever the queue is refilled.
+
+The planner also keeps, for each configuration entry, the worst
+deviation from the target time of the carts it has played and of the
+carts it has placed, to show how well the configuration is met.
+"""
+import datetime
+import threading
+import time
+import fitter
+from clock import Clock
+
+# number of hours to plan ahead
+LOOKAHEAD_HOURS = 3
+
+# minimum drift of the queue from its planned start times before carts are moved, in seconds
+DRIFT_TOLERANCE = 2.0
+
+# maximum deviation of a cart from its target before the tracks before it are fitted, in seconds
+FIT_TOLERANCE = 5.0
+
+
+class Slot(object):
+    """The Slot class is a planned cart at a target time."""
+    __slots__ = ("entry", "target", "cart", "placed")
+
+    def __init__(self, entry, target):
+        """Construct a slot.
+
+        :param entry: index of the configuration entry
+        :param target: target start time
+        """
+        self.entry = entry
+        self.target = target
+        self.cart = None
+        self.placed = False
+
+
+class Planner(object):
+    """The Planner class schedules the carts of a cart queue."""
+    _config = None
+    _get_cart = None
+    _lookahead = None
+    _clock = None
+
+    _slots = None
+    _horizon = None
+    _lock = None
+    _resolving = False
+
+    _played = None
+    _missed = None
+
+    def __init__(self, config, get_cart, lookahead=LOOKAHEAD_HOURS, clock=None):
+        """Construct a planner.
+
+        :param config: list of cart slot entries, each with a type, minute and max_delta
+        :param get_cart: function which fetches a cart of a cart type
+        :param lookahead: number of hours to plan ahead
+        :param clock: optional clock.Clock to use instead of the wall clock
+        """
+        self._config = config
+        self._get_cart = get_cart
+        self._lookahead = lookahead
+        self._clock = clock if clock is not None else Clock()
+
+        self._slots = []
+        self._lock = threading.Lock()
+        self._played = [[] for _ in config]
+        self._missed = [0 for _ in config]
+
+    def _update_slots(self, now):
+        """Add the slots of the lookahead period and drop the slots which have passed.
+
+        :param now: current time
+        """
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        begin = now if self._horizon is None else max(now, self._horizon)
+        end = now + datetime.timedelta(hours=self._lookahead)
+
+        # each slot is added once, when it enters the lookahead period
+        for i in range(self._lookahead + 1):
+            for entry, config in enumerate(self._config):
+                target = hour + datetime.timedelta(hours=i, minutes=config["minute"])
+
+                if begin <= target < end:
+                    self._slots.append(Slot(entry, target))
+
+        self._horizon = end
+
+        self._slots.sort(key=lambda slot: slot.target)
+
+        # slots which were never placed are missed once their window has passed
+        for slot in self._slots:
+            if not slot.placed and slot.target + self._get_max_delta(slot) < now:
+                print(time.asctime() + " :=: Planner :: Missed " + self._config[slot.entry]["type"] +
+                      " slot at " + str(slot.target))
+                self._missed[slot.entry] += 1
+
+        self._slots = [slot for slot in self._slots if slot.placed or slot.target + self._get_max_delta(slot) >= now]
+
+    def _get_max_delta(self, slot):
+        """Get the maximum deviation from the target time of a slot.
+
+        :param slot
+        """
+        return datetime.timedelta(seconds=self._config[slot.entry]["max_delta"])
+
+    def _place(self, timeline, slot):
+        """Insert the cart of a slot into a timeline as close as possible to its target time.
+
+        :param timeline
+        :param slot
+        """
+        index = timeline.find_nearest(slot.target, 1)
+
+        # the end of the queue may be closer than any start time
+        if abs(timeline.get_end_time() - slot.target) < abs(timeline.get_start_time(index) - slot.target):
+            index = len(timeline)
+
+        delta = abs(timeline.get_start_time(index) - slot.target).total_seconds()
+
+        if delta > FIT_TOLERANCE:
+            index = self._fit(timeline, slot, delta) or index
+
+        timeline.insert(index, slot.cart)
+        slot.placed = True
+
+        delta = abs(timeline.get_start_time(index) - slot.target)
+
+        print(time.asctime() + " :=: Planner :: Placed " + slot.cart.cart_type + " at " +
+              str(timeline.get_start_time(index)) + ", target is " + str(slot.target) +
+              (" (within window)" if delta <= self._get_max_delta(slot) else " (outside window)"))
+
+    def _fit(self, timeline, slot, delta):
+        """Reorder the tracks before a slot so that its cart lands closer to its target.
+
+        Returns the position at which to insert the cart, or None if
+        no reordering comes closer than the given deviation.
+
+        :param timeline
+        :param slot
+        :param delta: deviation of the closest position, in seconds
+        """
+        with self._lock:
+            placed = set(id(other.cart) for other in self._slots if other.placed)
+
+        # only the tracks after the last placed cart may be moved
+        begin = 1
+        for index, cart in enumerate(timeline):
+            if id(cart) in placed:
+                begin = index + 1
+
+        if begin >= len(timeline):
+            return None
+
+        gap = (slot.target - timeline.get_start_time(begin)).total_seconds()
+        tolerance = min(delta, self._config[slot.entry]["max_delta"])
+        tracks = [timeline[i] for i in range(begin, len(timeline))]
+        result = fitter.fit([track.get_meter_data()[1] / 1000 for track in tracks], gap, tolerance)
+
+        if result is None or abs(result[1]) >= delta:
+            return None
+
+        # play the chosen tracks first, then the cart, then the rest
+        chosen = set(result[0])
+        timeline.truncate(begin)
+        timeline.extend([tracks[i] for i in result[0]])
+        index = len(timeline)
+        timeline.extend([track for i, track in enumerate(tracks) if i not in chosen])
+
+        return index
+
+    def _resolve_slot(self, slot):
+        """Fetch the cart of a slot unless it already has one.
+
+        The cart is fetched outside of the lock, since fetching may take
+        a network round trip, so the slot may have been given a cart by
+        plan() or resolve() in the meantime, in which case that cart is
+        kept and the fetched one is discarded.
+
+        :param slot
+        """
+        with self._lock:
+            if slot.cart is not None:
+                return slot.cart
+
+        cart = self._get_cart(self._config[slot.entry]["type"])
+
+        with self._lock:
+            if slot.cart is None:
+                slot.cart = cart
+
+            return slot.cart
+
+    def plan(self, timeline, now=None):
+        """Place every pending slot which the timeline has reached.
+
+        Slots whose cart has not been fetched yet are fetched now.
+
+        :param timeline: Timeline of the queue
+        :param now: current time
+        """
+        if now is None:
+            now = self._clock.now()
+
+        with self._lock:
+            self._update_slots(now)
+            pending = [slot for slot in self._slots if not slot.placed]
+
+        for slot in pending:
+            # don't place the slot until the queue reaches its target
+            if len(timeline) < 2 or timeline.get_end_time() < slot.target:
+                break
+
+            if self._resolve_slot(slot) is None:
+                print(time.asctime() + " :=: Planner :: Could not find cart of type " +
+                      self._config[slot.entry]["type"])
+                continue
+
+            self._place(timeline, slot)
+
+    def resolve(self):
+        """Fetch the carts of every slot in the lookahead period which has no cart."""
+        with self._lock:
+            if self._resolving:
+                return
+            self._resolving = True
+            self._update_slots(self._clock.now())
+            slots = [slot for slot in self._slots if slot.cart is None]
+
+        try:
+            for slot in slots:
+                self._resolve_slot(slot)
+        finally:
+            with self._lock:
+                self._resolving = False
+
+    def resolve_async(self):
+        """Fetch the carts of the lookahead period in the background."""
+        self._clock.run_async(self.resolve)
+
+    def on_start(self, timeline, now=None):
+        """Update the plan when the first cart of a timeline starts.
+
+        The start times of the timeline are moved to the actual start
+        time. If they have drifted, placed carts which are now outside
+        of their windows are moved.
+
+        :param timeline: Timeline of the queue
+        :param now: current time
+        """
+        if now is None:
+            now = self._clock.now()
+
+        drift = (now - timeline.get_start_time(0)).total_seconds()
+        timeline.set_start_time(now)
+
+        # record the deviation of a cart when it starts
+        with self._lock:
+            for slot in self._slots:
+                if slot.placed and slot.cart is timeline[0]:
+                    self._played[slot.entry].append(abs(now - slot.target).total_seconds())
+                    self._slots.remove(slot)
+                    break
+
+        if abs(drift) <= DRIFT_TOLERANCE:
+            return
+
+        print(time.asctime() + " :=: Planner :: Queue drifted by %.1f seconds" % drift)
+
+        self._replan(timeline)
+
+    def _replan(self, timeline):
+        """Move the placed carts which are outside of their windows.
+
+        :param timeline: Timeline of the queue
+        """
+        with self._lock:
+            slots = {id(slot.cart): slot for slot in self._slots if slot.placed}
+
+        moved = []
+
+        for index, (start_time, cart) in enumerate(timeline.iter_schedule()):
+            slot = slots.get(id(cart))
+
+            if index > 0 and slot is not None and abs(start_time - slot.target) > self._get_max_delta(slot):
+                moved.append(index)
+
+        # remove the carts from the back, so that the positions of the others stay the same
+        for index in reversed(moved):
+            slots[id(timeline.pop(index))].placed = False
+
+        if len(moved) > 0:
+            self.plan(timeline)
+
+    def refit(self, timeline):
+        """Place every placed cart which has not started again, after tracks have been added.
+
+        A cart is placed when the queue first reaches its target, when
+        only the few tracks before the end of the queue can be fitted
+        before it. Once the queue is refilled, placing it again lets the
+        fitter choose from the new tracks as well.
+
+        :param timeline: Timeline of the queue
+        """
+        # the first item is playing and is never moved
+        first = timeline[0] if len(timeline) > 0 else None
+
+        with self._lock:
+            slots = [slot for slot in self._slots if slot.placed and slot.cart is not first]
+            carts = set(id(slot.cart) for slot in slots)
+
+            for slot in slots:
+                slot.placed = False
+
+        if len(slots) > 0:
+            timeline.remove_if(lambda cart: id(cart) in carts and cart is not first)
+            self.plan(timeline)
+
+    def reset(self):
+        """Mark every slot as not placed, after the carts have been removed from the queue."""
+        with self._lock:
+            for slot in self._slots:
+                slot.placed = False
+
+    def get_report(self, timeline):
+        """Get the worst deviation from the window of each configuration entry.
+
+        Returns a list with a dictionary for each entry, with the number
+        of carts played, played within the window, placed and missed, and
+        the worst deviation from the target time, in seconds, of the
+        played carts and of the carts placed in the queue.
+
+        :param timeline: Timeline of the queue
+        """
+        with self._lock:
+            slots = {id(slot.cart): slot for slot in self._slots if slot.placed}
+            played = [list(deltas) for deltas in self._played]
+            missed = list(self._missed)
+
+        placed = [[] for _ in self._config]
+
+        for start_time, cart in timeline.iter_schedule():
+            slot = slots.get(id(cart))
+            if slot is not None:
+                placed[slot.entry].append(abs(start_time - slot.target).total_seconds())
+
+        return [{
+            "type": config["type"],
+            "minute": config["minute"],
+            "max_delta": config["max_delta"],
+            "played": len(played[entry]),
+            "within": sum(1 for delta in played[entry] if delta <= config["max_delta"]),
+            "placed": len(placed[entry]),
+            "missed": missed[entry],
+            "worst_played": max(played[entry]) if len(played[entry]) > 0 else None,
+            "worst_placed": max(placed[entry]) if len(placed[entry]) > 0 else None
+        } for entry, config in enumerate(self._config)]
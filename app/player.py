@@ -1,7 +1,64 @@
 """The player_abstract class for other players to inherit from"""
+import time
 from abc import ABC, abstractmethod
 
 
+class Position(object):
+    """The Position class tracks the position of an audio stream.
+
+    The position is measured from a monotonic clock from the moment the
+    stream starts, rather than counted in ticks of a sleeping thread, so
+    it does not fall behind however late the thread that reads it
+    wakes up. The stream ends when the position reaches its length.
+    """
+    _length = 0
+    _offset = 0
+    _started = None
+    _monotonic = None
+
+    def __init__(self, length, monotonic=time.monotonic):
+        """Construct a position at the beginning of a stream.
+
+        :param length: length of the stream in milliseconds
+        :param monotonic: optional function which returns a monotonic time in seconds
+        """
+        self._length = length
+        self._monotonic = monotonic
+
+    def start(self):
+        """Start or resume advancing the position."""
+        if self._started is None:
+            self._started = self._monotonic()
+
+    def pause(self):
+        """Stop advancing the position."""
+        if self._started is not None:
+            self._offset += (self._monotonic() - self._started) * 1000
+            self._started = None
+
+    def reset(self):
+        """Move the position back to the beginning of the stream."""
+        self._offset = 0
+        self._started = None
+
+    def get_elapsed(self):
+        """Get the position in milliseconds."""
+        elapsed = self._offset
+
+        if self._started is not None:
+            elapsed += (self._monotonic() - self._started) * 1000
+
+        return min(self._length, elapsed)
+
+    def get_remaining(self):
+        """Get the time until the end of the stream in milliseconds."""
+        return self._length - self.get_elapsed()
+
+    def is_finished(self):
+        """Get whether the position has reached the end of the stream."""
+        return self.get_remaining() <= 0
+
+
 class Player(ABC):
     """The Player class provides an audio stream for a file."""
 
@@ -14,6 +71,7 @@ class Player(ABC):
         self._filename = filename
         self._is_playing = False
         self._callback = None
+        self._end_time = None
 
     @property
     @abstractmethod
@@ -32,6 +90,16 @@ class Player(ABC):
         """Get whether the audio stream is currently playing."""
         return self._is_playing
 
+    @property
+    def end_time(self):
+        """Get the monotonic time at which the stream ended on its own, or None if it did not.
+
+        For a stream which ended at a timer, this is the time the
+        timer was due, so that the delay to the next stream includes
+        any lateness of the timer.
+        """
+        return self._end_time
+
     @abstractmethod
     def play(self, callback=None):
         """Play the audio stream.
@@ -42,3 +110,12 @@ class Player(ABC):
     @abstractmethod
     def stop(self):
         """Stop the audio stream."""
+
+    def preroll(self):
+        """Prepare the audio stream so that it starts without delay when played.
+
+        Players which start quickly do nothing.
+        """
+
+    def cancel_preroll(self):
+        """Release whatever preroll() prepared, if the stream will not be played."""
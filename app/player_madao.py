@@ -2,15 +2,71 @@
 
 This implementation of Player uses python wrappers for libmad and libao,
 which provide interfaces to audio files and audio devices.
+
+Every playing stream is decoded and written to the audio device by one
+shared pump thread, instead of a thread per stream. When a stream ends,
+its callback runs on the dispatch thread of the shared supervisor,
+after the player has released its lock.
 """
 import threading
 import time
 import ao
 import mad
+import supervisor
 from player import Player
 
 AODEV = ao.AudioDevice(0)
 
+_playing = []
+_pump_cond = threading.Condition()
+_pump_started = False
+
+
+def _run_pump():
+    """Write a buffer of each playing stream to the audio device in turn."""
+    while True:
+        with _pump_cond:
+            while len(_playing) == 0:
+                _pump_cond.wait()
+
+            players = list(_playing)
+
+        for player in players:
+            # a stream which fails is stopped without holding up the others
+            try:
+                player._pump()
+            except Exception as e:
+                print(time.asctime() + " :=: Player_madao :: Stream failed: %s: %s" % (type(e).__name__, e))
+                player._fail()
+
+
+def _add_playing(player):
+    """Add a stream to the pump, starting the pump if necessary.
+
+    :param player
+    """
+    global _pump_started
+
+    with _pump_cond:
+        if player not in _playing:
+            _playing.append(player)
+
+        if not _pump_started:
+            _pump_started = True
+            threading.Thread(target=_run_pump, daemon=True).start()
+
+        _pump_cond.notify()
+
+
+def _remove_playing(player):
+    """Remove a stream from the pump.
+
+    :param player
+    """
+    with _pump_cond:
+        if player in _playing:
+            _playing.remove(player)
+
 
 class MadaoPlayer(Player):
     """The Player class provides an audio stream for a file."""
@@ -22,6 +78,7 @@ class MadaoPlayer(Player):
         """
         super().__init__(filename)
         self._madfile = None
+        self._lock = threading.Lock()
         self.reset()
 
     @property
@@ -38,36 +95,70 @@ class MadaoPlayer(Player):
         """Reset the audio stream."""
         self._madfile = mad.MadFile(self._filename)
 
-    def _play_internal(self):
-        """Play the audio stream in a separate thread."""
-        while self._is_playing:
+    def _pump(self):
+        """Write the next buffer of the audio stream to the audio device.
+
+        This function runs on the pump thread.
+        """
+        with self._lock:
+            if not self._is_playing:
+                return
+
             buf = self._madfile.read()
-            if buf is not None:
-                AODEV.play(buf, len(buf))
-            else:
+
+            if buf is None:
                 print(time.asctime() + " :=: Player_madao :: Buffer is empty")
-                break
 
-        if self._callback is not None and self._is_playing:
-            self.reset()
+                callback = self._callback
+                self._callback = None
+                self._end_time = time.monotonic()
+                self._is_playing = False
+                self.reset()
+
+        if buf is None:
+            _remove_playing(self)
+
+            if callback is not None:
+                supervisor.dispatch(callback)
+        else:
+            AODEV.play(buf, len(buf))
+
+    def _fail(self):
+        """End the audio stream after an error, as if it had finished.
+
+        This function runs on the pump thread.
+        """
+        with self._lock:
+            callback = self._callback
+            self._callback = None
+            self._end_time = time.monotonic()
             self._is_playing = False
-            self._callback()
+
+        _remove_playing(self)
+
+        if callback is not None:
+            supervisor.dispatch(callback)
 
     def play(self, callback=None):
         """Play the audio stream.
 
         :param callback: function to call if the stream finishes
         """
-        if self._is_playing:
-            print(time.asctime() + " :=: Player_madao :: Tried to start, but already playing")
-            return
+        with self._lock:
+            if self._is_playing:
+                print(time.asctime() + " :=: Player_madao :: Tried to start, but already playing")
+                return
 
-        self._is_playing = True
-        self._callback = callback
-        thread = threading.Thread(target=self._play_internal, daemon=True)  # Set daemon=True
-        thread.start()
+            self._is_playing = True
+            self._callback = callback
+            self._end_time = None
+
+        _add_playing(self)
 
     def stop(self):
         """Stop the audio stream."""
-        self._is_playing = False
-        self._callback = None
+        with self._lock:
+            self._is_playing = False
+            self._callback = None
+
+        _remove_playing(self)
@@ -0,0 +1,179 @@
+"""The player_mixer module provides the MixerPlayer class.
+
+This implementation of Player decodes files with libmad and plays them
+through a mixer shared by every player (see the mixer module), so that
+streams can overlap. A stream segues into the next one: its callback
+is called a few seconds before its end, so that the next stream starts
+while its tail fades out. The next stream can also fade in, which
+makes the segue a crossfade.
+
+A player can be prerolled, which opens its file and decodes the
+beginning of it into the ring buffer of a new source ahead of time, so
+that playing it only adds the source to the mixer.
+"""
+import os
+import threading
+import time
+import mad
+import supervisor
+from mixer import Mixer, Source, open_sink
+from player import Player
+
+# audio output, "null" for none or an ALSA device name
+MIXER_SINK = os.environ.get("ZAUTOMATE_MIXER_SINK", "default")
+
+# overlap with the next stream, in seconds
+SEGUE = 2.0
+
+# fade in at the start of each stream, in seconds, which makes segues crossfades
+FADE_IN = 0.0
+
+# fade out when a stream is stopped, in seconds, to avoid a click
+STOP_FADE = 0.05
+
+FADE_CURVE = "equal_power"
+
+_mixer = None
+_mixer_lock = threading.Lock()
+
+
+def get_mixer():
+    """Get the shared mixer, starting it if necessary."""
+    global _mixer
+
+    with _mixer_lock:
+        if _mixer is None:
+            _mixer = Mixer(open_sink(MIXER_SINK))
+            _mixer.start()
+
+        return _mixer
+
+
+class MixerPlayer(Player):
+    """The Player class provides an audio stream for a file."""
+    _madfile = None
+    _source = None
+    _prerolled = None
+    _timer = None
+    _lock = None
+
+    def __init__(self, filename):
+        """Construct a Player.
+
+        :param filename
+        """
+        super().__init__(filename)
+        self._madfile = mad.MadFile(filename)
+        self._lock = threading.Lock()
+
+    @property
+    def length(self):
+        """Get the length of the audio stream in milliseconds."""
+        return self._madfile.total_time()
+
+    @property
+    def time_elapsed(self):
+        """Get the elapsed time of the audio stream in milliseconds."""
+        with self._lock:
+            return self._source.get_position() if self._source is not None else 0
+
+    def _end(self, source, fade):
+        """End the stream, fading out its remainder, and call the callback.
+
+        This function runs on a thread of the supervisor, either when
+        the segue is due or when the source has ended before it.
+
+        :param source: source which was playing when the end was scheduled
+        :param fade: length of the fade out in seconds, or None if the source has ended
+        """
+        with self._lock:
+            if not self._is_playing or self._source is not source:
+                return
+
+            callback = self._callback
+
+            self._callback = None
+            self._end_time = self._timer[0] if fade is not None and self._timer is not None else time.monotonic()
+            self._timer = None
+            self._is_playing = False
+            self._source = None
+
+        if fade is not None:
+            source.fade(fade, 0.0, FADE_CURVE, stop=True)
+
+        if callback is not None:
+            supervisor.dispatch(callback)
+
+    def _open(self):
+        """Open the file and construct a source which plays it from the beginning."""
+        madfile = mad.MadFile(self._filename)
+
+        source = Source(madfile.read, madfile.samplerate(),
+                        on_end=lambda: self._end(source, None), gain=0.0 if FADE_IN > 0 else 1.0)
+
+        if FADE_IN > 0:
+            source.fade(FADE_IN, 1.0, FADE_CURVE)
+
+        return madfile, source
+
+    def preroll(self):
+        """Open the file and decode its beginning, so that play() only has to add it to the mixer."""
+        with self._lock:
+            if self._is_playing or self._prerolled is not None:
+                return
+
+            self._madfile, source = self._open()
+            source.fill()
+
+            self._prerolled = source
+
+    def cancel_preroll(self):
+        """Release the source decoded by preroll()."""
+        with self._lock:
+            self._prerolled = None
+
+    def play(self, callback=None):
+        """Play the audio stream.
+
+        :param callback: function to call if the stream finishes
+        """
+        with self._lock:
+            if self._is_playing:
+                print(time.asctime() + " :=: Player_mixer :: Tried to start, but already playing")
+                return
+
+            if self._prerolled is not None:
+                source = self._prerolled
+                self._prerolled = None
+            else:
+                self._madfile, source = self._open()
+
+            self._source = source
+            self._is_playing = True
+            self._callback = callback
+            self._end_time = None
+
+            # segue into the next stream before the end
+            segue = max(0.0, min(SEGUE, self.length / 2000.0))
+            self._timer = supervisor.call_later(self.length / 1000.0 - segue, lambda: self._end(source, segue))
+
+        get_mixer().add(source)
+
+    def stop(self):
+        """Stop the audio stream."""
+        with self._lock:
+            if not self._is_playing:
+                print(time.asctime() + " :=: Player_mixer :: Tried to stop, but not playing")
+                return
+
+            if self._timer is not None:
+                supervisor.cancel(self._timer)
+
+            source = self._source
+
+            self._callback = None
+            self._timer = None
+            self._is_playing = False
+            self._source = None
+
+        source.fade(STOP_FADE, 0.0, FADE_CURVE, stop=True)
@@ -1,20 +1,60 @@
-import os
-import signal
-import subprocess
+"""The player_vlc module provides the VLCPlayer class.
+
+This implementation of Player plays files in VLC engines (see the
+vlcengine module), which are long-lived VLC processes shared by every
+player, so that starting a cart only loads its file.
+
+A player can be prerolled, which loads its file paused into an engine
+ahead of time, so that playing it only resumes the engine.
+
+Engines are acquired and loaded outside of the lock of the player,
+since starting an engine can take seconds, so that the meter and the
+other threads which read the player are never held up by it.
+
+A playing stream has no thread of its own. Its end is a timer of the
+shared supervisor, and the callback for the end runs on the dispatch
+thread of the supervisor, after the player has released its lock.
+
+VLC starts to play some time after it is told to, because it caches
+the file and buffers the audio output, so it finishes later than the
+length of the file after play(). When the timer fires, the engine is
+asked whether it is still playing, and the stream only ends once VLC
+has finished it, up to END_GRACE after its length has elapsed.
+
+The apps which play through VLC select it at startup, which calls
+start() to prewarm the pool of engines, so that the first cart does not
+wait for VLC to start.
+"""
 import threading
 import time
-from player import Player
-from mutagen.mp3 import MP3
+import metacache
+import supervisor
+import vlcengine
+from player import Player, Position
 
+# number of engines to try when a file cannot be loaded
+LOAD_ATTEMPTS = 2
+
+# maximum time to wait for VLC to finish a stream after its length has elapsed, in seconds
+END_GRACE = 3.0
+
+# time between checks whether VLC has finished a stream, in seconds
+END_POLL = 0.05
+
+
+def start():
+    """Start the engines of the pool in the background."""
+    vlcengine.prewarm()
 
 
 class VLCPlayer(Player):
     """The Player class provides an audio stream for a file."""
-    _command = None
-    _pid = None
+    _engine = None
     _length = 0
-    _elapsed = 0
-    _is_playing = False  # may need a lock
+    _position = None
+    _timer = None
+    _end_due = None
+    _is_playing = False
     _callback = None
 
     def __init__(self, filename):
@@ -23,10 +63,10 @@ class VLCPlayer(Player):
         :param filename
         """
         super().__init__(filename)
-        self._command = ["/usr/bin/vlc", "--intf", "dummy", "--play-and-exit", filename]
-        self._length = MP3(filename).info.length * 1000
-        self._elapsed = 0
-        self._pid = None
+        self._length = metacache.get_length(filename)
+        self._position = Position(self._length)
+        self._engine = None
+        self._timer = None
         self._lock = threading.Lock()
 
     @property
@@ -39,34 +79,166 @@ class VLCPlayer(Player):
     def time_elapsed(self):
         """Get the elapsed time of the audio stream in milliseconds."""
         with self._lock:
-            return self._elapsed
+            return self._position.get_elapsed()
 
-    def _play_internal(self):
-        """Internal method to simulate playback and track elapsed time."""
-        while True:
-            with self._lock:
-                if not self._is_playing:
-                    break
-                self._elapsed += 1000
+    def _release(self, engine):
+        """Stop an engine and return it to the pool.
 
-            time.sleep(1.0)
+        :param engine
+        """
+        engine.set_on_exit(None)
 
-            with self._lock:
-                if self._elapsed >= self._length:
-                    break
+        try:
+            engine.stop()
+        except OSError:
+            print(time.asctime() + " :=: Player_vlc :: Lost connection to VLC engine " + str(engine.get_pid()))
+
+        vlcengine.release(engine)
+
+    def _finish(self, engine, callback):
+        """Call the callback and release the engine once the stream has ended.
+
+        The callback starts the next stream, so the engine is released
+        after it, which keeps its round trips out of the gap between
+        the streams.
+
+        This function runs on the dispatch thread of the supervisor.
+
+        :param engine
+        :param callback
+        """
+        if callback is not None:
+            callback()
+
+        if engine is not None:
+            self._release(engine)
+
+    def _end(self, finished):
+        """End the stream when VLC has finished it or its engine exits.
 
+        This function runs on a thread of the supervisor.
+
+        :param finished: whether VLC has finished the stream
+        """
         with self._lock:
-            if self._pid:
-                os.kill(self._pid, signal.SIGKILL)
-                self._pid = None
+            if not self._is_playing:
+                return
 
-            if self._callback is not None and self._elapsed >= self._length:
-                callback = self._callback
-                self._callback = None
-                callback()
+            engine = self._engine
+            callback = self._callback
 
+            self._engine = None
+            self._callback = None
+            self._end_time = self._timer[0] if finished and self._timer is not None else time.monotonic()
+            self._timer = None
+            self._end_due = None
             self._is_playing = False
-            self._elapsed = 0
+            self._position.reset()
+
+        supervisor.dispatch(lambda: self._finish(engine, callback))
+
+    def _on_timer(self):
+        """Check whether VLC has finished the stream.
+
+        This function runs on the timer thread of the supervisor.
+        """
+        with self._lock:
+            if not self._is_playing:
+                return
+
+            if self._end_due is None:
+                self._end_due = self._timer[0] if self._timer is not None else time.monotonic()
+
+        supervisor.dispatch(self._check_end)
+
+    def _check_end(self):
+        """End the stream if VLC has finished it, or check again shortly.
+
+        This function runs on the dispatch thread of the supervisor.
+        """
+        with self._lock:
+            if not self._is_playing:
+                return
+
+            # the stream was paused and resumed, so its end is later
+            if not self._position.is_finished():
+                self._end_due = None
+                self._timer = supervisor.call_later(self._position.get_remaining() / 1000.0, self._on_timer)
+                return
+
+            engine = self._engine
+            due = self._end_due
+
+        try:
+            playing = engine.is_playing()
+        except OSError:
+            playing = False
+
+        if playing and time.monotonic() - due < END_GRACE:
+            with self._lock:
+                if self._is_playing and self._engine is engine:
+                    self._timer = supervisor.call_later(END_POLL, self._on_timer)
+            return
+
+        self._end(True)
+
+    def _on_exit(self):
+        """End the stream if its engine exits."""
+        print(time.asctime() + " :=: Player_vlc :: VLC engine exited while playing " + self._filename)
+        self._end(False)
+
+    def _load(self, paused):
+        """Load the file into an engine from the pool.
+
+        If the engine fails, such as an idle engine which has hung, it
+        is dropped and the file is loaded into a new engine.
+
+        This function must be called without the lock held.
+
+        :param paused: whether to hold the file at its first frame
+        """
+        for attempt in range(LOAD_ATTEMPTS):
+            engine = vlcengine.acquire()
+
+            try:
+                engine.load(self._filename, paused)
+                return engine
+            except OSError as e:
+                print(time.asctime() + " :=: Player_vlc :: Could not load " + self._filename + ": " + str(e))
+                vlcengine.release(engine)
+
+                if attempt == LOAD_ATTEMPTS - 1:
+                    raise
+
+    def preroll(self):
+        """Load the file paused, so that play() only has to resume it."""
+        with self._lock:
+            if self._is_playing or self._engine is not None:
+                return
+
+        engine = self._load(True)
+
+        with self._lock:
+            # the stream was started or prerolled while the file was loading
+            if self._is_playing or self._engine is not None:
+                stale = engine
+            else:
+                self._engine = engine
+                stale = None
+
+        if stale is not None:
+            self._release(stale)
+
+    def cancel_preroll(self):
+        """Return the engine loaded by preroll() to the pool."""
+        with self._lock:
+            if self._is_playing or self._engine is None:
+                return
+
+            engine = self._engine
+            self._engine = None
+
+        self._release(engine)
 
     def play(self, callback=None):
         """Play the audio stream.
@@ -81,12 +253,39 @@ class VLCPlayer(Player):
             if self._is_playing:
                 raise RuntimeError("Audio is already playing")
 
-            self._pid = subprocess.Popen(self._command).pid
-            self._is_playing = True
-            self._callback = callback
+            engine = self._engine
+            self._engine = None
+
+        if engine is not None:
+            try:
+                engine.resume()
+            except OSError:
+                # the prerolled engine was lost, so load the file again
+                vlcengine.release(engine)
+                engine = None
+
+        if engine is None:
+            engine = self._load(False)
 
-        thread = threading.Thread(target=self._play_internal, daemon=True)  # Set daemon=True
-        thread.start()
+        with self._lock:
+            # the stream was started by another thread while the file was loading
+            if self._is_playing:
+                stale = engine
+            else:
+                stale = None
+                engine.set_on_exit(self._on_exit)
+
+                self._engine = engine
+                self._is_playing = True
+                self._callback = callback
+                self._end_time = None
+                self._end_due = None
+                self._position.start()
+                self._timer = supervisor.call_later(self._position.get_remaining() / 1000.0, self._on_timer)
+
+        if stale is not None:
+            self._release(stale)
+            raise RuntimeError("Audio is already playing")
 
     def stop(self):
         """Stop the audio stream."""
@@ -95,12 +294,17 @@ class VLCPlayer(Player):
                 print(time.asctime() + " :=: Player_vlc :: Tried to stop, but not playing")
                 return
 
-            self._is_playing = False
-            self._callback = None
+            if self._timer is not None:
+                supervisor.cancel(self._timer)
 
-        if self._pid:
-            os.kill(self._pid, signal.SIGKILL)
-            self._pid = None
+            engine = self._engine
 
-        with self._lock:
-            self._elapsed = 0
+            self._engine = None
+            self._callback = None
+            self._timer = None
+            self._end_due = None
+            self._is_playing = False
+            self._position.reset()
+
+        if engine is not None:
+            self._release(engine)
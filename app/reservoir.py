@@ -0,0 +1,223 @@
+"""The reservoir module provides the Reservoir class.
+
+The reservoir keeps tracks and carts ready for the Automation queue, so
+that refilling the queue and placing carts take them from memory rather
+than fetching them from the server while the next track is due. Tracks
+are fetched a playlist at a time and only playable tracks are kept
+(see database.build_playable), with at most one track by each artist.
+
+Whenever a take leaves the reservoir below its low-water mark, it is
+refilled in the background. Each time the reservoir falls below the
+mark is counted as a low-water event, and each take which the
+reservoir could not satisfy is counted as well, so that the size of the
+reservoir can be tuned.
+"""
+import collections
+import threading
+import time
+import session
+from clock import Clock
+from timeline import normalize_artist
+
+# number of tracks and of carts of each type to keep ready
+RESERVOIR_TRACKS = 40
+RESERVOIR_CARTS = 3
+
+# fraction of the reservoir below which it is refilled
+LOW_WATER = 0.5
+
+# number of playlists fetched in parallel when filling the reservoir
+PLAYLIST_FETCH_COUNT = 3
+
+# time budget for filling the reservoir, in seconds
+FILL_DEADLINE = 30.0
+
+
+class Reservoir(object):
+    """The Reservoir class keeps tracks and carts ready in advance."""
+    _db = None
+    _clock = None
+    _cart_types = None
+    _num_tracks = None
+    _num_carts = None
+
+    _show_id = -1
+    _tracks = None
+    _artists = None
+    _carts = None
+    _lock = None
+    _filling = False
+    _is_low = False
+
+    _num_fills = 0
+    _num_low_water = 0
+    _num_empty = 0
+
+    def __init__(self, db, cart_types, num_tracks=RESERVOIR_TRACKS, num_carts=RESERVOIR_CARTS, clock=None):
+        """Construct a reservoir. It is empty until it is filled.
+
+        :param db: database module or an object with the same functions
+        :param cart_types: cart types to keep ready
+        :param num_tracks: number of tracks to keep ready
+        :param num_carts: number of carts of each type to keep ready
+        :param clock: optional clock.Clock to use instead of the wall clock
+        """
+        self._db = db
+        self._cart_types = list(cart_types)
+        self._num_tracks = num_tracks
+        self._num_carts = num_carts
+        self._clock = clock if clock is not None else Clock()
+
+        self._tracks = collections.deque()
+        self._artists = set()
+        self._carts = {cart_type: collections.deque() for cart_type in self._cart_types}
+        self._lock = threading.Lock()
+
+    def _fill_tracks(self, deadline):
+        """Fetch playlists until the reservoir holds enough tracks.
+
+        :param deadline: session.Deadline
+        """
+        while len(self._tracks) < self._num_tracks and not deadline.expired():
+            # choose several shows at once
+            args = [(self._show_id, deadline)] * PLAYLIST_FETCH_COUNT
+            show_ids = set(show_id for _, show_id in self._db.fetch_concurrent(self._db.get_new_show_id, args))
+            show_ids.discard(-1)
+
+            if len(show_ids) == 0:
+                return
+
+            # retrieve playlists from database, using each one as soon as it arrives
+            for self._show_id, playlist in self._db.iter_playlists(list(show_ids), deadline):
+                with self._lock:
+                    for track in playlist:
+                        artist = normalize_artist(track.issuer)
+
+                        if artist not in self._artists:
+                            self._tracks.append(track)
+                            self._artists.add(artist)
+
+                if len(self._tracks) >= self._num_tracks:
+                    break
+
+    def _fill_carts(self, deadline):
+        """Fetch carts until the reservoir holds enough carts of each type.
+
+        :param deadline: session.Deadline
+        """
+        for cart_type in self._cart_types:
+            while len(self._carts[cart_type]) < self._num_carts and not deadline.expired():
+                cart = self._db.get_cart(cart_type, deadline)
+
+                if cart is None:
+                    break
+
+                with self._lock:
+                    self._carts[cart_type].append(cart)
+
+    def fill(self, deadline=None):
+        """Fill the reservoir.
+
+        Returns whether the reservoir holds any tracks.
+
+        :param deadline: optional session.Deadline
+        """
+        if deadline is None:
+            deadline = session.Deadline(FILL_DEADLINE)
+
+        self._fill_tracks(deadline)
+        self._fill_carts(deadline)
+
+        with self._lock:
+            self._num_fills += 1
+            self._is_low = False
+
+            print(time.asctime() + " :=: Reservoir :: Filled, %d tracks ready" % len(self._tracks))
+
+            return len(self._tracks) > 0
+
+    def _fill_internal(self):
+        """Fill the reservoir, allowing only one background fill at a time."""
+        try:
+            self.fill()
+        finally:
+            with self._lock:
+                self._filling = False
+
+    def fill_async(self):
+        """Fill the reservoir in the background, unless it is already being filled."""
+        with self._lock:
+            if self._filling:
+                return
+            self._filling = True
+
+        self._clock.run_async(self._fill_internal)
+
+    def _check_level(self):
+        """Refill the reservoir in the background if it has fallen below its low-water mark."""
+        with self._lock:
+            is_low = len(self._tracks) < self._num_tracks * LOW_WATER or \
+                any(len(carts) < self._num_carts * LOW_WATER for carts in self._carts.values())
+
+            if is_low and not self._is_low:
+                self._num_low_water += 1
+                print(time.asctime() + " :=: Reservoir :: Below low-water mark, %d tracks ready" % len(self._tracks))
+
+            self._is_low = is_low
+
+        if is_low:
+            self.fill_async()
+
+    def take_tracks(self, count, is_excluded):
+        """Take up to a number of tracks from the reservoir.
+
+        Tracks whose artist is excluded are discarded.
+
+        :param count: maximum number of tracks
+        :param is_excluded: function of a track which returns True if it should not be taken
+        """
+        tracks = []
+
+        with self._lock:
+            while len(tracks) < count and len(self._tracks) > 0:
+                track = self._tracks.popleft()
+                self._artists.discard(normalize_artist(track.issuer))
+
+                if not is_excluded(track):
+                    tracks.append(track)
+
+            if len(tracks) < count:
+                self._num_empty += 1
+
+        self._check_level()
+
+        return tracks
+
+    def take_cart(self, cart_type):
+        """Take a cart of a cart type from the reservoir.
+
+        Returns None if the reservoir has no carts of the type.
+
+        :param cart_type
+        """
+        with self._lock:
+            carts = self._carts.get(cart_type)
+            cart = carts.popleft() if carts else None
+
+            if cart is None:
+                self._num_empty += 1
+
+        self._check_level()
+
+        return cart
+
+    def get_stats(self):
+        """Get the reservoir levels and counters as a dictionary."""
+        with self._lock:
+            return {
+                "tracks": len(self._tracks),
+                "carts": {cart_type: len(carts) for cart_type, carts in self._carts.items()},
+                "fills": self._num_fills,
+                "low_water": self._num_low_water,
+                "empty": self._num_empty
+            }
@@ -0,0 +1,159 @@
+"""The scanner module provides the Scanner class.
+
+The scanner walks the music library in the background and records the
+presence, size, modification time and length of every audio file in the
+metadata cache, so that carts and tracks can be checked for playability
+without touching the library mount at request time.
+
+Directories are scanned in parallel. On a rescan, a directory whose
+modification time has not changed is not listed again, so only the
+directories where files were added, removed or renamed are scanned.
+Files which are rewritten in place are not noticed until their
+directory changes.
+
+A tree is only marked as completely scanned after a scan in which
+every directory could be read, since files under a complete tree are
+looked up in the index first (see metacache.MetadataCache.get_length).
+
+The three apps share the index, so only one process scans at a time.
+"""
+import fcntl
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import metacache
+
+SCAN_WORKERS = 8
+SCAN_INTERVAL = 15 * 60
+
+AUDIO_EXTENSIONS = (".mp3",)
+
+
+class Scanner(object):
+    """The Scanner class keeps the library index up to date."""
+    _root = None
+    _cache = None
+    _workers = None
+
+    _num_scans = 0
+    _num_dirs = 0
+    _num_probed = 0
+    _num_errors = 0
+    _scan_time = None
+
+    def __init__(self, root, cache=None, workers=SCAN_WORKERS):
+        """Construct a Scanner.
+
+        :param root: library directory
+        :param cache: optional MetadataCache to use instead of the shared cache
+        :param workers: number of directories scanned at once
+        """
+        self._root = root.rstrip("/")
+        self._cache = cache if cache is not None else metacache.get_cache()
+        self._workers = workers
+
+    def _scan_dir(self, path):
+        """Scan a directory and return the paths of its subdirectories.
+
+        :param path: directory path
+        """
+        mtime = os.stat(path).st_mtime
+        state = self._cache.get_dir(path)
+
+        if state is not None and state[0] == mtime:
+            return [os.path.join(path, subdir) for subdir in state[1]]
+
+        indexed = self._cache.get_dir_files(path)
+        subdirs = []
+        filenames = []
+        entries = []
+
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+
+                    filenames.append(entry.path)
+
+                    # only probe files which are new or have changed
+                    if indexed.get(entry.path) != (stat.st_size, stat.st_mtime):
+                        entries.append((entry.path, stat, metacache.probe(entry.path)))
+
+        self._cache.store_many(entries)
+        self._cache.put_dir(path, mtime, subdirs, filenames)
+        self._num_dirs += 1
+        self._num_probed += len(entries)
+
+        return [os.path.join(path, subdir) for subdir in subdirs]
+
+    def scan(self):
+        """Scan the library once.
+
+        Returns False if another process is scanning the library.
+        """
+        with open(self._cache.get_path() + ".scan", "w") as owner:
+            try:
+                fcntl.flock(owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return False
+
+            begin = time.monotonic()
+            num_errors = 0
+
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                pending = {executor.submit(self._scan_dir, self._root)}
+
+                while len(pending) > 0:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        try:
+                            subdirs = future.result()
+                        except OSError as e:
+                            print(time.asctime() + " :=: Scanner :: Could not scan directory: " + str(e))
+                            num_errors += 1
+                            continue
+
+                        pending.update(executor.submit(self._scan_dir, subdir) for subdir in subdirs)
+
+            # an incomplete scan must not make the files it missed look absent
+            if num_errors == 0:
+                self._cache.put_root(self._root)
+
+            self._num_scans += 1
+            self._num_errors += num_errors
+            self._scan_time = time.monotonic() - begin
+
+        print(time.asctime() + " :=: Scanner :: Scanned " + self._root + " in %.1f seconds" % self._scan_time +
+              ("" if num_errors == 0 else ", %d directories could not be read" % num_errors))
+
+        return True
+
+    def _run(self):
+        """Scan the library periodically in a separate thread."""
+        while True:
+            if os.path.isdir(self._root):
+                self.scan()
+
+            time.sleep(SCAN_INTERVAL)
+
+    def start(self):
+        """Start scanning the library in the background."""
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def get_stats(self):
+        """Get the scanner counters as a dictionary."""
+        return {
+            "scans": self._num_scans,
+            "dirs": self._num_dirs,
+            "probed": self._num_probed,
+            "errors": self._num_errors,
+            "scan_time": self._scan_time
+        }
@@ -0,0 +1,229 @@
+"""The session module provides a shared HTTP session for the server API.
+
+Every request to the server goes through a single requests.Session, so
+connections are pooled and kept alive between calls instead of paying
+for a new TCP and TLS handshake on every call. Each endpoint can be
+given its own connection pool with its own size.
+
+Every request has a timeout, which may be shortened by a Deadline that
+is shared by a sequence of calls. A circuit breaker fails requests fast
+after repeated errors, so that a stalled server cannot hold up callers
+such as the cart queue transition. Only connection errors, timeouts and
+server errors count; a request which the server rejects as invalid
+shows that the server is up.
+"""
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_SIZE_DEFAULT = 2
+
+# default timeout of a single request, in seconds
+TIMEOUT_DEFAULT = 5.0
+
+# number of consecutive failures which opens the circuit breaker
+BREAKER_THRESHOLD = 3
+
+# time until an open circuit breaker allows a trial request, in seconds
+BREAKER_RESET = 30.0
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """The CircuitOpenError is raised when the circuit breaker is open."""
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The DeadlineExceeded error is raised when a deadline has expired."""
+
+
+class Deadline(object):
+    """The Deadline class is a time budget shared by a sequence of calls."""
+    _end = None
+
+    def __init__(self, seconds):
+        """Construct a Deadline.
+
+        :param seconds: time budget in seconds
+        """
+        self._end = time.monotonic() + seconds
+
+    def remaining(self):
+        """Get the remaining time in seconds."""
+        return max(0.0, self._end - time.monotonic())
+
+    def expired(self):
+        """Get whether the deadline has expired."""
+        return self.remaining() <= 0.0
+
+
+class CircuitBreaker(object):
+    """The CircuitBreaker class fails requests fast after repeated errors.
+
+    The breaker opens after a number of consecutive failures. While it
+    is open, every request fails immediately. After a reset time, one
+    trial request is allowed; the breaker closes if it succeeds and
+    opens again if it fails.
+    """
+    _state = STATE_CLOSED
+    _failures = 0
+    _opened_at = None
+    _num_rejected = 0
+    _lock = None
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset=BREAKER_RESET):
+        """Construct a CircuitBreaker.
+
+        :param threshold: number of consecutive failures which opens the breaker
+        :param reset: time until a trial request is allowed, in seconds
+        """
+        self._threshold = threshold
+        self._reset = reset
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Get whether a request may be sent."""
+        with self._lock:
+            if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self._reset:
+                self._state = STATE_HALF_OPEN
+                return True
+
+            if self._state == STATE_CLOSED:
+                return True
+
+            self._num_rejected += 1
+            return False
+
+    def record_success(self):
+        """Record a successful request."""
+        with self._lock:
+            self._state = STATE_CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        """Record a failed request."""
+        with self._lock:
+            self._failures += 1
+
+            if self._state == STATE_HALF_OPEN or self._failures >= self._threshold:
+                if self._state != STATE_OPEN:
+                    print(time.asctime() + " :=: CircuitBreaker :: Opened after " + str(self._failures) + " failures")
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+
+    def get_state(self):
+        """Get the state of the breaker as a dictionary."""
+        with self._lock:
+            return {
+                "state": self._state,
+                "failures": self._failures,
+                "rejected": self._num_rejected
+            }
+
+
+_session = requests.Session()
+_adapters = list(_session.adapters.values())
+_breaker = CircuitBreaker()
+
+
+def mount(url, pool_size=POOL_SIZE_DEFAULT):
+    """Give an endpoint its own connection pool.
+
+    :param url: endpoint URL, or any URL prefix
+    :param pool_size: maximum number of connections kept alive
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    _session.mount(url, adapter)
+    _adapters.append(adapter)
+
+
+def request(method, url, deadline=None, **kwargs):
+    """Send a request through the shared session.
+
+    Raises CircuitOpenError if the circuit breaker is open, and
+    DeadlineExceeded if the deadline has already expired. Server
+    errors are raised as requests.exceptions.HTTPError.
+
+    :param method: HTTP method
+    :param url
+    :param deadline: optional Deadline which bounds the timeout
+    :param kwargs: keyword arguments to requests
+    """
+    timeout = TIMEOUT_DEFAULT
+
+    if deadline is not None:
+        if deadline.expired():
+            raise DeadlineExceeded("deadline expired before request to " + url)
+        timeout = min(timeout, deadline.remaining())
+
+    if not _breaker.allow():
+        raise CircuitOpenError("circuit breaker is open")
+
+    try:
+        res = _session.request(method, url, timeout=timeout, **kwargs)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        _breaker.record_failure()
+        raise
+
+    # a client error shows that the server is reachable, so only server errors count as failures
+    if res.status_code >= 500:
+        _breaker.record_failure()
+    else:
+        _breaker.record_success()
+
+    res.raise_for_status()
+
+    return res
+
+
+def get(url, deadline=None, **kwargs):
+    """Send a GET request through the shared session.
+
+    :param url
+    :param deadline: optional Deadline which bounds the timeout
+    :param kwargs: keyword arguments to requests
+    """
+    return request("GET", url, deadline, **kwargs)
+
+
+def post(url, deadline=None, **kwargs):
+    """Send a POST request through the shared session.
+
+    :param url
+    :param deadline: optional Deadline which bounds the timeout
+    :param kwargs: keyword arguments to requests
+    """
+    return request("POST", url, deadline, **kwargs)
+
+
+def get_breaker_state():
+    """Get the state of the circuit breaker as a dictionary."""
+    return _breaker.get_state()
+
+
+def get_stats():
+    """Get the connection counters of the shared session.
+
+    - requests: number of requests sent
+    - connections: number of connections opened, i.e. handshakes
+    - reused: number of requests sent over an existing connection
+    """
+    num_requests = 0
+    num_connections = 0
+
+    for adapter in _adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+
+    return {
+        "requests": num_requests,
+        "connections": num_connections,
+        "reused": num_requests - num_connections
+    }
@@ -0,0 +1,259 @@
+"""The snapshot module provides a compact binary snapshot of the catalog.
+
+The three apps run as separate processes. Instead of each one keeping
+its own copy of the catalog in memory, one process writes a snapshot of
+every cached cart and track to a single file, and each process maps it
+read-only, so that the pages are shared through the OS page cache.
+
+A snapshot file consists of a header, a table of fixed-width records,
+a hash index from record ID to record, and a table of UTF-8 strings,
+which are stored once however many records use them:
+
+    header   magic, version, number of records, number of buckets,
+             offset of the string table
+    records  for each field of the record: offset and length in the
+             string table, both 32-bit
+    index    open-addressed hash table of record numbers plus one,
+             where zero marks an empty bucket
+    strings  UTF-8 strings
+
+Records are looked up by cart ID or album-track code in constant time.
+Snapshots are written to a temporary file and renamed over the old
+snapshot, so readers never see a partial file; readers notice the new
+file and map it on their next lookup.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b"ZASN"
+VERSION = 2
+
+HEADER = struct.Struct("<4sIIII")
+RECORD = struct.Struct("<IIIIIIIIII")
+BUCKET = struct.Struct("<I")
+
+# minimum time between checks for a new snapshot, in seconds
+RELOAD_INTERVAL = 5.0
+
+
+def _hash(key):
+    """Get the hash of a record ID, which is the same in every process.
+
+    :param key: record ID as bytes
+    """
+    return zlib.crc32(key)
+
+
+def write(path, records, mtime=None):
+    """Write a snapshot of records, replacing any previous snapshot.
+
+    :param path: location of the snapshot
+    :param records: iterable of cart or track records
+    :param mtime: optional modification time to give the snapshot file
+    """
+    strings = {}
+    string_table = bytearray()
+    record_table = bytearray()
+    keys = []
+
+    def _add_string(value):
+        data = value.encode("utf-8")
+        if data not in strings:
+            strings[data] = len(string_table)
+            string_table.extend(data)
+        return (strings[data], len(data))
+
+    for record in records:
+        fields = [_add_string(field) for field in record]
+        keys.append(record[0].encode("utf-8"))
+        record_table.extend(RECORD.pack(*([offset for offset, _ in fields] + [length for _, length in fields])))
+
+    # keep the index at most half full so that probe sequences stay short
+    num_buckets = 1
+    while num_buckets < 2 * len(keys):
+        num_buckets *= 2
+
+    buckets = [0] * num_buckets
+    for index, key in enumerate(keys):
+        bucket = _hash(key) & (num_buckets - 1)
+        while buckets[bucket] != 0:
+            bucket = (bucket + 1) & (num_buckets - 1)
+        buckets[bucket] = index + 1
+
+    strings_offset = HEADER.size + len(record_table) + num_buckets * BUCKET.size
+
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, VERSION, len(keys), num_buckets, strings_offset))
+        snapshot_file.write(record_table)
+        snapshot_file.write(struct.pack("<%dI" % num_buckets, *buckets))
+        snapshot_file.write(string_table)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+
+    if mtime is not None:
+        os.utime(tmp_path, (mtime, mtime))
+
+    os.replace(tmp_path, path)
+
+
+class Snapshot(object):
+    """The Snapshot class is a read-only view of a snapshot file."""
+    _path = None
+    _lock = None
+    _map = None
+    _stat = None
+    _checked = 0
+
+    _num_records = 0
+    _num_buckets = 0
+    _records_offset = 0
+    _index_offset = 0
+    _strings_offset = 0
+
+    def __init__(self, path):
+        """Open a snapshot. The file does not need to exist yet.
+
+        :param path: location of the snapshot
+        """
+        self._path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Map the snapshot file if it has been replaced since it was last mapped.
+
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+
+        if self._map is not None and now - self._checked < RELOAD_INTERVAL:
+            return
+
+        self._checked = now
+
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return
+
+        if self._stat is not None and (stat.st_ino, stat.st_mtime) == (self._stat.st_ino, self._stat.st_mtime):
+            return
+
+        with open(self._path, "rb") as snapshot_file:
+            snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_records, num_buckets, strings_offset = HEADER.unpack_from(snapshot_map, 0)
+
+        if magic != MAGIC or version != VERSION:
+            snapshot_map.close()
+            return
+
+        if self._map is not None:
+            self._map.close()
+
+        self._map = snapshot_map
+        self._stat = stat
+        self._num_records = num_records
+        self._num_buckets = num_buckets
+        self._records_offset = HEADER.size
+        self._index_offset = HEADER.size + num_records * RECORD.size
+        self._strings_offset = strings_offset
+
+    def _get_field(self, offset, length):
+        """Get a string from the string table.
+
+        :param offset
+        :param length
+        """
+        begin = self._strings_offset + offset
+        return self._map[begin:begin + length].decode("utf-8")
+
+    def _get_record(self, index):
+        """Get the record at an index.
+
+        :param index
+        """
+        fields = RECORD.unpack_from(self._map, self._records_offset + index * RECORD.size)
+        return tuple(self._get_field(fields[i], fields[i + 5]) for i in range(5))
+
+    def _find(self, key):
+        """Get the index of the record with an ID, or None if there is none.
+
+        :param key: record ID as bytes
+        """
+        mask = self._num_buckets - 1
+        bucket = _hash(key) & mask
+
+        while True:
+            entry = BUCKET.unpack_from(self._map, self._index_offset + bucket * BUCKET.size)[0]
+
+            if entry == 0:
+                return None
+
+            offset, _, _, _, _, length, _, _, _, _ = RECORD.unpack_from(
+                self._map, self._records_offset + (entry - 1) * RECORD.size)
+            begin = self._strings_offset + offset
+
+            if self._map[begin:begin + length] == key:
+                return entry - 1
+
+            bucket = (bucket + 1) & mask
+
+    def get(self, record_id):
+        """Get the record with a cart ID or album-track code.
+
+        Returns None if the record is not in the snapshot.
+
+        :param record_id
+        """
+        with self._lock:
+            self._load()
+
+            if self._map is None or self._num_records == 0:
+                return None
+
+            index = self._find(record_id.encode("utf-8"))
+
+            if index is None:
+                return None
+
+            return self._get_record(index)
+
+    def get_many(self, record_ids):
+        """Get the records with each of several IDs, in order.
+
+        Records which are not in the snapshot are None.
+
+        :param record_ids
+        """
+        return [self.get(record_id) for record_id in record_ids]
+
+    def get_mtime(self):
+        """Get the modification time of the snapshot file.
+
+        Returns 0 if there is no snapshot file or if it was written in
+        another format, so that it is written again.
+        """
+        try:
+            with open(self._path, "rb") as snapshot_file:
+                header = snapshot_file.read(HEADER.size)
+                stat = os.fstat(snapshot_file.fileno())
+        except OSError:
+            return 0
+
+        if len(header) < HEADER.size or HEADER.unpack(header)[0:2] != (MAGIC, VERSION):
+            return 0
+
+        return stat.st_mtime
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return self._num_records
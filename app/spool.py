@@ -0,0 +1,248 @@
+"""The spool module provides the Spool class.
+
+A spool is an append-only file of pending entries, one per line.
+Appending an entry only writes a line to the file and syncs it to disk,
+so that an entry which has been appended survives a crash or a power
+loss, and is fast enough to do on the Tk thread or on the transition
+path. A flusher thread drains the spool in batches by sending each
+entry, and retries with a growing delay when sending fails.
+
+The position of the first unsent entry is kept in a cursor file, which
+is advanced after every entry that is sent, so entries survive a
+restart and are not sent twice (except for the one entry being sent
+if the process dies before the cursor is written). The cursor is
+written to a temporary file which is synced and then renamed over the
+old cursor, and the directory is synced, so the cursor on disk is
+always either the old or the new offset. When every entry has been
+sent, the spool is truncated.
+
+An entry which can never be sent, because the send function raises
+PermanentError or any other exception for it, is moved to a dead-letter
+file next to the spool instead of being retried, so that it does not
+block the entries behind it.
+
+The spool may be shared by several processes. Appends and truncation
+are serialized with a file lock, and only one process flushes at a time.
+"""
+import fcntl
+import os
+import threading
+import time
+
+FLUSH_INTERVAL = 2.0
+FLUSH_BATCH = 50
+RETRY_MAX = 60.0
+
+
+def _fsync_dir(path):
+    """Sync a directory, so that the files created or renamed in it survive a crash.
+
+    :param path
+    """
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class PermanentError(Exception):
+    """The PermanentError exception is raised by a send function for an entry which can never be sent."""
+
+
+class Spool(object):
+    """The Spool class is a durable queue of entries to be sent."""
+    _path = None
+    _send = None
+    _file = None
+    _lock = None
+
+    _num_flushed = 0
+    _num_failed = 0
+    _num_dead = 0
+    _flush_latency = None
+
+    def __init__(self, path, send):
+        """Open a spool, creating it if necessary.
+
+        :param path: location of the spool file
+        :param send: function which sends an entry and returns whether it succeeded,
+                     or raises PermanentError if the entry can never be sent
+        """
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._path = path
+        self._send = send
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+        _fsync_dir(os.path.dirname(path))
+
+    def append(self, entry):
+        """Append an entry to the spool.
+
+        :param entry: string without newlines
+        """
+        with self._lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                self._file.write(entry + "\n")
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _read_cursor(self):
+        """Read the offset of the first unsent entry."""
+        try:
+            with open(self._path + ".cursor") as cursor_file:
+                return int(cursor_file.read() or 0)
+        except (IOError, ValueError):
+            return 0
+
+    def _write_cursor(self, offset):
+        """Write the offset of the first unsent entry.
+
+        :param offset
+        """
+        with open(self._path + ".cursor.tmp", "w") as cursor_file:
+            cursor_file.write(str(offset))
+            cursor_file.flush()
+            os.fsync(cursor_file.fileno())
+        os.replace(self._path + ".cursor.tmp", self._path + ".cursor")
+        _fsync_dir(os.path.dirname(self._path))
+
+    def _read_batch(self, offset):
+        """Read a batch of complete lines starting at an offset.
+
+        :param offset
+        """
+        lines = []
+
+        with open(self._path, "rb") as spool_file:
+            spool_file.seek(offset)
+            while len(lines) < FLUSH_BATCH:
+                line = spool_file.readline()
+                if not line.endswith(b"\n"):
+                    break
+                lines.append(line)
+
+        return lines
+
+    def _send_entry(self, entry):
+        """Send an entry, moving it to the dead-letter file if it can never be sent.
+
+        Returns False if the entry should be retried.
+
+        :param entry
+        """
+        try:
+            return self._send(entry)
+        except Exception as e:
+            print(time.asctime() + " :=: Spool :: Dropping entry " + repr(entry) +
+                  ": %s: %s" % (type(e).__name__, e))
+
+            with open(self._path + ".dead", "a") as dead_file:
+                dead_file.write(entry + "\n")
+                dead_file.flush()
+                os.fsync(dead_file.fileno())
+
+            self._num_dead += 1
+            return True
+
+    def _compact(self, offset):
+        """Truncate the spool if every entry has been sent.
+
+        :param offset: offset of the first unsent entry
+        """
+        with self._lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                if os.path.getsize(self._path) == offset:
+                    os.truncate(self._path, 0)
+                    self._write_cursor(0)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def flush(self):
+        """Send a batch of entries.
+
+        Returns False if an entry could not be sent.
+        """
+        with open(self._path + ".lock", "w") as owner:
+            try:
+                fcntl.flock(owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                # another process is flushing the spool
+                return True
+
+            offset = self._read_cursor()
+            lines = self._read_batch(offset)
+
+            if len(lines) == 0:
+                return True
+
+            begin = time.monotonic()
+
+            for line in lines:
+                if not self._send_entry(line.decode("utf-8", "replace").rstrip("\n")):
+                    self._num_failed += 1
+                    return False
+
+                offset += len(line)
+                self._write_cursor(offset)
+                self._num_flushed += 1
+
+            self._flush_latency = time.monotonic() - begin
+            self._compact(offset)
+
+        return True
+
+    def _run(self):
+        """Flush the spool in a separate thread."""
+        delay = FLUSH_INTERVAL
+
+        while True:
+            try:
+                flushed = self.flush()
+            except Exception as e:
+                print(time.asctime() + " :=: Spool :: Flush error: %s: %s" % (type(e).__name__, e))
+                flushed = False
+
+            if flushed:
+                delay = FLUSH_INTERVAL
+            else:
+                delay = min(delay * 2, RETRY_MAX)
+                print(time.asctime() + " :=: Spool :: Flush failed, retrying in " + str(delay) + " seconds")
+
+            time.sleep(delay)
+
+    def start(self):
+        """Start flushing the spool."""
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def get_depth(self):
+        """Get the number of unsent entries."""
+        offset = self._read_cursor()
+
+        with open(self._path, "rb") as spool_file:
+            spool_file.seek(offset)
+            return spool_file.read().count(b"\n")
+
+    def get_stats(self):
+        """Get the spool counters as a dictionary.
+
+        - depth: number of unsent entries
+        - flushed: number of entries sent by this process
+        - failed: number of failed sends by this process
+        - dead: number of entries moved to the dead-letter file by this process
+        - flush_latency: duration of the last complete batch, in seconds
+        """
+        return {
+            "depth": self.get_depth(),
+            "flushed": self._num_flushed,
+            "failed": self._num_failed,
+            "dead": self._num_dead,
+            "flush_latency": self._flush_latency
+        }
@@ -0,0 +1,239 @@
+"""The supervisor module provides the Supervisor class.
+
+The supervisor watches every audio stream in the process with two
+threads, instead of a polling thread per player. The timer thread
+waits for the earliest of the scheduled timers, such as the end of a
+stream, and for the exit of watched processes, which it learns about
+through a pidfd. The dispatch thread calls the callbacks for these
+events one at a time, so that a callback which stops a player or
+starts the next one never runs on the timer thread or while a player
+holds its lock.
+
+The number of threads stays the same however many carts are played.
+"""
+import heapq
+import itertools
+import os
+import queue
+import selectors
+import threading
+import time
+
+
+class Supervisor(object):
+    """The Supervisor class runs timers and process watches for the players."""
+    _timers = None
+    _counter = None
+    _selector = None
+    _wakeup = None
+    _callbacks = None
+    _lock = None
+    _started = False
+
+    _num_timers = 0
+    _num_exits = 0
+    _num_dispatched = 0
+    _num_errors = 0
+
+    def __init__(self):
+        """Construct a supervisor. Its threads start when it is first used."""
+        self._timers = []
+        self._counter = itertools.count()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup = os.pipe()
+        self._callbacks = queue.Queue()
+        self._lock = threading.Lock()
+
+        os.set_blocking(self._wakeup[0], False)
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+
+    def _start(self):
+        """Start the timer and dispatch threads if they are not running."""
+        if self._started:
+            return
+        self._started = True
+
+        threading.Thread(target=self._run_timers, daemon=True).start()
+        threading.Thread(target=self._run_dispatch, daemon=True).start()
+
+    def _wake(self):
+        """Wake the timer thread so that it sees a new timer."""
+        try:
+            os.write(self._wakeup[1], b"\0")
+        except BlockingIOError:
+            pass
+
+    def call_later(self, delay, callback):
+        """Call a function on the timer thread after a delay.
+
+        The function must be quick; it should pass any real work to
+        dispatch(). Returns a handle which can be passed to cancel().
+
+        :param delay: delay in seconds
+        :param callback: function to call
+        """
+        timer = [time.monotonic() + delay, next(self._counter), callback]
+
+        with self._lock:
+            self._start()
+            heapq.heappush(self._timers, timer)
+            self._num_timers += 1
+
+        self._wake()
+
+        return timer
+
+    def cancel(self, timer):
+        """Cancel a timer.
+
+        :param timer: handle returned by call_later()
+        """
+        with self._lock:
+            timer[2] = None
+
+    def watch_process(self, pid, callback):
+        """Call a function on the timer thread when a child process exits.
+
+        :param pid: process ID
+        :param callback: function to call
+        """
+        fd = os.pidfd_open(pid)
+
+        with self._lock:
+            self._start()
+            self._selector.register(fd, selectors.EVENT_READ, callback)
+
+        self._wake()
+
+    def dispatch(self, callback):
+        """Call a function on the dispatch thread.
+
+        :param callback: function to call
+        """
+        with self._lock:
+            self._start()
+
+        self._callbacks.put(callback)
+
+    def _get_timeout(self):
+        """Get the time until the next timer, dropping cancelled timers."""
+        with self._lock:
+            while len(self._timers) > 0 and self._timers[0][2] is None:
+                heapq.heappop(self._timers)
+
+            if len(self._timers) == 0:
+                return None
+
+            return max(0.0, self._timers[0][0] - time.monotonic())
+
+    def _pop_due(self):
+        """Remove the timers which are due and get their callbacks."""
+        due = []
+        now = time.monotonic()
+
+        with self._lock:
+            while len(self._timers) > 0 and self._timers[0][0] <= now:
+                _, _, callback = heapq.heappop(self._timers)
+
+                if callback is not None:
+                    due.append(callback)
+
+        return due
+
+    def _run_timers(self):
+        """Wait for timers and process exits in a separate thread."""
+        while True:
+            due = []
+
+            for key, _ in self._selector.select(self._get_timeout()):
+                if key.data is None:
+                    # drain the wakeup pipe
+                    try:
+                        os.read(self._wakeup[0], 4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    with self._lock:
+                        self._selector.unregister(key.fd)
+                        self._num_exits += 1
+                    os.close(key.fd)
+                    due.append(key.data)
+
+            for callback in due + self._pop_due():
+                self._call(callback)
+
+    def _run_dispatch(self):
+        """Call dispatched functions in a separate thread."""
+        while True:
+            callback = self._callbacks.get()
+
+            with self._lock:
+                self._num_dispatched += 1
+
+            self._call(callback)
+
+    def _call(self, callback):
+        """Call a function, logging any exception so that the thread survives.
+
+        :param callback
+        """
+        try:
+            callback()
+        except Exception as e:
+            with self._lock:
+                self._num_errors += 1
+            print(time.asctime() + " :=: Supervisor :: Callback failed: %s: %s" % (type(e).__name__, e))
+
+    def get_stats(self):
+        """Get the supervisor counters as a dictionary."""
+        with self._lock:
+            return {
+                "timers": len(self._timers),
+                "watched": len(self._selector.get_map()) - 1,
+                "scheduled": self._num_timers,
+                "exits": self._num_exits,
+                "dispatched": self._num_dispatched,
+                "errors": self._num_errors
+            }
+
+
+_supervisor = Supervisor()
+
+
+def call_later(delay, callback):
+    """Call a function on the timer thread of the shared supervisor after a delay.
+
+    :param delay: delay in seconds
+    :param callback: function to call
+    """
+    return _supervisor.call_later(delay, callback)
+
+
+def cancel(timer):
+    """Cancel a timer of the shared supervisor.
+
+    :param timer: handle returned by call_later()
+    """
+    _supervisor.cancel(timer)
+
+
+def watch_process(pid, callback):
+    """Call a function on the timer thread of the shared supervisor when a child process exits.
+
+    :param pid: process ID
+    :param callback: function to call
+    """
+    _supervisor.watch_process(pid, callback)
+
+
+def dispatch(callback):
+    """Call a function on the dispatch thread of the shared supervisor.
+
+    :param callback: function to call
+    """
+    _supervisor.dispatch(callback)
+
+
+def get_stats():
+    """Get the counters of the shared supervisor."""
+    return _supervisor.get_stats()
@@ -0,0 +1,402 @@
+"""The timeline module provides the Timeline class.
+
+A timeline is the sequence of carts in the Automation queue together
+with their start times. Rather than storing a start time on every cart
+and recomputing them whenever the queue changes, the timeline stores the
+start time of the first cart and the length of every cart, and keeps
+prefix sums of the lengths so that any start time can be computed and
+any target time can be found by bisection.
+
+The carts are stored in chunks of about CHUNK_SIZE carts, each with the
+prefix sums of its own lengths, plus prefix sums over the chunks. An
+insertion only updates one chunk and the chunk sums, so it takes
+O(sqrt n) time rather than O(n); removing the first cart takes constant
+time, and lookups take O(log n) time.
+
+The timeline also counts the artists that it holds, so that artist
+separation checks take constant time.
+"""
+import bisect
+import datetime
+
+# target number of carts in each chunk
+CHUNK_SIZE = 256
+
+
+def normalize_artist(name):
+    """Get the normalized form of an artist name for comparisons.
+
+    :param name
+    """
+    return " ".join(name.lower().split())
+
+
+class Timeline(object):
+    """The Timeline class is a sequence of carts with start times."""
+    _start_time = None
+    _chunks = None
+    _lengths = None
+    _offsets = None
+    _chunk_offsets = None
+    _chunk_indices = None
+    _head = 0
+    _length = 0
+
+    _artists = None
+
+    def __init__(self, carts=()):
+        """Construct a timeline.
+
+        :param carts: initial carts
+        """
+        self._start_time = datetime.datetime.now()
+        self._reset(carts)
+
+    def _reset(self, carts):
+        """Replace the carts in the timeline.
+
+        :param carts
+        """
+        self._chunks = []
+        self._lengths = []
+        self._offsets = []
+        self._chunk_offsets = []
+        self._chunk_indices = []
+        self._head = 0
+        self._length = 0
+        self._artists = {}
+
+        self.extend(carts)
+
+    def _count(self, cart, delta):
+        """Update the artist counts for a cart.
+
+        :param cart
+        :param delta: 1 if the cart was added, -1 if it was removed
+        """
+        artist = normalize_artist(cart.issuer)
+        count = self._artists.get(artist, 0) + delta
+
+        if count > 0:
+            self._artists[artist] = count
+        else:
+            self._artists.pop(artist, None)
+
+    def _update_offsets(self, chunk_index):
+        """Recompute the prefix sums of the lengths in a chunk.
+
+        The offsets of a chunk have one more entry than the chunk, so
+        that the last entry is the total length of the chunk.
+
+        :param chunk_index
+        """
+        offsets = [0]
+        for length in self._lengths[chunk_index]:
+            offsets.append(offsets[-1] + length)
+        self._offsets[chunk_index] = offsets
+
+    def _update_chunks(self, chunk_index):
+        """Recompute the prefix sums of a chunk and the positions of every chunk after it.
+
+        Chunk positions and offsets are counted from the first cart ever
+        added, so removing carts from the front does not change them.
+
+        :param chunk_index
+        """
+        # split the chunk if it has grown too large
+        if len(self._chunks[chunk_index]) > 2 * CHUNK_SIZE:
+            self._chunks.insert(chunk_index + 1, self._chunks[chunk_index][CHUNK_SIZE:])
+            self._lengths.insert(chunk_index + 1, self._lengths[chunk_index][CHUNK_SIZE:])
+            self._offsets.insert(chunk_index + 1, None)
+            del self._chunks[chunk_index][CHUNK_SIZE:]
+            del self._lengths[chunk_index][CHUNK_SIZE:]
+            self._update_offsets(chunk_index + 1)
+
+        # remove the chunk if it is empty
+        if len(self._chunks[chunk_index]) == 0:
+            del self._chunks[chunk_index]
+            del self._lengths[chunk_index]
+            del self._offsets[chunk_index]
+        else:
+            self._update_offsets(chunk_index)
+
+        self._update_positions(chunk_index)
+
+    def _compact(self):
+        """Drop the removed carts from the first chunk, so that it can be changed."""
+        if self._head > 0:
+            self._chunk_offsets[0] += self._offsets[0][self._head]
+            self._chunk_indices[0] += self._head
+            del self._chunks[0][0:self._head]
+            del self._lengths[0][0:self._head]
+            self._update_offsets(0)
+            self._head = 0
+
+    def _update_positions(self, chunk_index):
+        """Recompute the positions and start offsets of a chunk and every chunk after it.
+
+        :param chunk_index
+        """
+        first = (self._chunk_offsets[0], self._chunk_indices[0]) if len(self._chunk_offsets) > 0 else (0, 0)
+
+        del self._chunk_offsets[chunk_index:]
+        del self._chunk_indices[chunk_index:]
+
+        for i in range(chunk_index, len(self._chunks)):
+            if i == 0:
+                self._chunk_offsets.append(first[0])
+                self._chunk_indices.append(first[1])
+            else:
+                self._chunk_offsets.append(self._chunk_offsets[i - 1] + self._offsets[i - 1][-1])
+                self._chunk_indices.append(self._chunk_indices[i - 1] + len(self._chunks[i - 1]))
+
+    def _get_origin(self):
+        """Get the position and offset of the first cart, counted from the first cart ever added."""
+        if len(self._chunks) == 0:
+            return (0, 0)
+
+        return (self._chunk_indices[0] + self._head, self._chunk_offsets[0] + self._offsets[0][self._head])
+
+    def _locate(self, index):
+        """Get the chunk index and the index within the chunk of a position.
+
+        :param index: position in the timeline, which may be negative
+        """
+        if index < 0:
+            index += self._length
+
+        if index < 0 or index >= self._length:
+            raise IndexError("timeline index out of range")
+
+        index += self._get_origin()[0]
+        chunk_index = bisect.bisect_right(self._chunk_indices, index) - 1
+
+        return (chunk_index, index - self._chunk_indices[chunk_index])
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        chunk_index, i = self._locate(index)
+        return self._chunks[chunk_index][i]
+
+    def __iter__(self):
+        for chunk_index, chunk in enumerate(self._chunks):
+            for i in range(self._head if chunk_index == 0 else 0, len(chunk)):
+                yield chunk[i]
+
+    def extend(self, carts):
+        """Append carts to the timeline.
+
+        :param carts
+        """
+        first_changed = max(0, len(self._chunks) - 1)
+        num_added = 0
+
+        for cart in carts:
+            # start a new chunk when the last one is full
+            if len(self._chunks) == 0 or len(self._chunks[-1]) >= CHUNK_SIZE:
+                self._chunks.append([])
+                self._lengths.append([])
+                self._offsets.append([0])
+
+            length = cart.get_meter_data()[1]
+            self._chunks[-1].append(cart)
+            self._lengths[-1].append(length)
+            self._offsets[-1].append(self._offsets[-1][-1] + length)
+            self._count(cart, 1)
+            num_added += 1
+
+        if num_added == 0:
+            return
+
+        self._length += num_added
+        self._update_positions(first_changed)
+
+    def append(self, cart):
+        """Append a cart to the timeline.
+
+        :param cart
+        """
+        self.extend([cart])
+
+    def insert(self, index, cart):
+        """Insert a cart before a position in the timeline.
+
+        :param index
+        :param cart
+        """
+        if index >= self._length:
+            self.append(cart)
+            return
+
+        self._compact()
+        chunk_index, i = self._locate(index)
+        self._chunks[chunk_index].insert(i, cart)
+        self._lengths[chunk_index].insert(i, cart.get_meter_data()[1])
+        self._count(cart, 1)
+        self._length += 1
+        self._update_chunks(chunk_index)
+
+    def pop(self, index):
+        """Remove and return the cart at a position.
+
+        Unlike pop_front, the start time of the first cart does not
+        change, so every cart after the position starts earlier.
+
+        :param index
+        """
+        self._compact()
+        chunk_index, i = self._locate(index)
+        cart = self._chunks[chunk_index].pop(i)
+        del self._lengths[chunk_index][i]
+        self._count(cart, -1)
+        self._length -= 1
+        self._update_chunks(chunk_index)
+
+        return cart
+
+    def truncate(self, index):
+        """Remove and return every cart from a position to the end.
+
+        :param index
+        """
+        if index >= self._length:
+            return []
+
+        self._compact()
+        chunk_index, i = self._locate(index)
+        carts = self._chunks[chunk_index][i:]
+
+        for chunk in self._chunks[chunk_index + 1:]:
+            carts.extend(chunk)
+
+        del self._chunks[chunk_index][i:]
+        del self._lengths[chunk_index][i:]
+        del self._chunks[chunk_index + 1:]
+        del self._lengths[chunk_index + 1:]
+        del self._offsets[chunk_index + 1:]
+
+        for cart in carts:
+            self._count(cart, -1)
+
+        self._length -= len(carts)
+        self._update_chunks(chunk_index)
+
+        return carts
+
+    def pop_front(self):
+        """Remove and return the first cart.
+
+        The start time of the timeline moves to the end of the removed
+        cart, so the start times of the remaining carts do not change.
+        """
+        if self._length == 0:
+            raise IndexError("pop from empty timeline")
+
+        cart = self._chunks[0][self._head]
+        length = self._lengths[0][self._head]
+        self._count(cart, -1)
+        self._length -= 1
+        self._start_time += datetime.timedelta(milliseconds=length)
+
+        # removed carts stay in the first chunk until all of its carts are removed
+        self._head += 1
+
+        if self._head == len(self._chunks[0]):
+            del self._chunks[0]
+            del self._lengths[0]
+            del self._offsets[0]
+            del self._chunk_offsets[0]
+            del self._chunk_indices[0]
+            self._head = 0
+
+        return cart
+
+    def remove_if(self, predicate):
+        """Remove every cart for which a predicate is true.
+
+        The start times of the remaining carts are recomputed.
+
+        :param predicate: function of a cart
+        """
+        self._reset([cart for cart in self if not predicate(cart)])
+
+    def set_start_time(self, start_time):
+        """Set the start time of the first cart.
+
+        :param start_time: datetime
+        """
+        self._start_time = start_time
+
+    def get_offset(self, index):
+        """Get the start offset of a position from the first cart, in milliseconds.
+
+        The position may be the length of the timeline, which gives the
+        end of the last cart.
+
+        :param index
+        """
+        if self._length == 0:
+            return 0
+
+        if index == self._length:
+            offset = self._chunk_offsets[-1] + self._offsets[-1][-1]
+        else:
+            chunk_index, i = self._locate(index)
+            offset = self._chunk_offsets[chunk_index] + self._offsets[chunk_index][i]
+
+        return offset - self._get_origin()[1]
+
+    def get_start_time(self, index):
+        """Get the start time of a position.
+
+        :param index
+        """
+        return self._start_time + datetime.timedelta(milliseconds=self.get_offset(index))
+
+    def get_end_time(self):
+        """Get the time at which the last cart ends."""
+        return self.get_start_time(self._length)
+
+    def find_nearest(self, target, begin=0):
+        """Get the position whose start time is closest to a target time.
+
+        Returns None if the timeline has no positions from begin.
+
+        :param target: datetime
+        :param begin: first position to consider
+        """
+        if begin >= self._length:
+            return None
+
+        origin_index, origin_offset = self._get_origin()
+        offset = (target - self._start_time) / datetime.timedelta(milliseconds=1)
+
+        # find the first position which starts at or after the target
+        chunk_index = max(0, bisect.bisect_right(self._chunk_offsets, origin_offset + offset) - 1)
+        i = bisect.bisect_left(self._offsets[chunk_index], origin_offset + offset - self._chunk_offsets[chunk_index],
+                               self._head if chunk_index == 0 else 0, len(self._chunks[chunk_index]))
+        index = min(self._chunk_indices[chunk_index] + i - origin_index, self._length - 1)
+
+        # the closest start time is either that position or the one before it
+        if index > begin and abs(self.get_offset(index - 1) - offset) <= abs(self.get_offset(index) - offset):
+            index -= 1
+
+        return max(begin, index)
+
+    def iter_schedule(self):
+        """Iterate over 2-tuples (start time, cart) for every cart."""
+        origin_offset = self._get_origin()[1]
+
+        for chunk_index, chunk in enumerate(self._chunks):
+            for i in range(self._head if chunk_index == 0 else 0, len(chunk)):
+                offset = self._chunk_offsets[chunk_index] + self._offsets[chunk_index][i] - origin_offset
+                yield (self._start_time + datetime.timedelta(milliseconds=offset), chunk[i])
+
+    def has_artist(self, name):
+        """Get whether the timeline holds a cart by an artist.
+
+        :param name: artist name
+        """
+        return normalize_artist(name) in self._artists
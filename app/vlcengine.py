@@ -0,0 +1,387 @@
+"""The vlcengine module provides the Engine class and a pool of engines.
+
+An engine is a long-lived VLC process which is controlled through its
+RC interface on a Unix socket. Playing a file only loads it into an
+engine that is already running, instead of starting a new VLC process
+for every cart and track, which saves the start-up time of VLC and the
+memory of a process per play.
+
+An engine plays one file at a time, so several carts which play at
+once each acquire their own engine from the pool. Engines are returned
+to the pool when their file stops, and idle engines are kept for the
+next play, so the number of VLC processes follows the number of carts
+which play at once rather than the number of carts played.
+
+The shared supervisor watches each VLC process, so that a player whose
+engine exits while it plays learns about it at once. An engine which
+does not respond to a command in time is dropped like one which has
+lost its connection, and is stopped when it is released, so the next
+play starts a new engine instead of reusing a hung one.
+
+Starting an engine takes as long as starting VLC, so once the pool has
+been prewarmed, it keeps at least MIN_IDLE engines idle by starting new
+ones in the background whenever an engine is acquired, and a play does
+not wait for VLC to start unless more carts play at once than the pool
+has prepared for.
+"""
+import atexit
+import os
+import pathlib
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import supervisor
+
+VLC_PATH = "/usr/bin/vlc"
+
+# audio output module, such as "alsa" or "adummy" for no output
+VLC_AOUT = os.environ.get("ZAUTOMATE_VLC_AOUT", "")
+
+# time to wait for a new engine to accept commands, in seconds
+START_TIMEOUT = 5.0
+
+# time to wait for the response to a command, in seconds
+COMMAND_TIMEOUT = 1.0
+
+# maximum number of idle engines kept in the pool
+MAX_IDLE = 4
+
+# number of idle engines kept ready in the background once the pool is prewarmed
+MIN_IDLE = 1
+
+PROMPT = b"> "
+
+
+class Engine(object):
+    """The Engine class is a VLC process controlled through its RC interface."""
+    _process = None
+    _socket = None
+    _path = None
+    _lock = None
+    _on_exit = None
+
+    def __init__(self, aout=VLC_AOUT):
+        """Start a VLC process and connect to it.
+
+        :param aout: optional audio output module
+        """
+        self._path = os.path.join(tempfile.mkdtemp(prefix="zautomate-vlc-"), "rc.sock")
+        self._lock = threading.Lock()
+
+        command = [VLC_PATH, "--intf", "rc", "--rc-unix", self._path, "--rc-fake-tty", "--no-video"]
+
+        if aout != "":
+            command += ["--aout", aout]
+
+        self._process = subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            self._connect()
+        except IOError:
+            self.close()
+            raise
+
+        supervisor.watch_process(self._process.pid, self._exited)
+
+    def _connect(self):
+        """Connect to the RC socket once VLC has created it."""
+        deadline = time.monotonic() + START_TIMEOUT
+
+        while True:
+            if self._process.poll() is not None:
+                raise IOError("VLC exited with status %d" % self._process.returncode)
+
+            try:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.settimeout(COMMAND_TIMEOUT)
+                self._socket.connect(self._path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                self._socket.close()
+                self._socket = None
+
+                if time.monotonic() > deadline:
+                    raise IOError("VLC did not open its RC socket")
+
+                time.sleep(0.01)
+
+        # discard the greeting
+        self._read_response()
+
+    def _read_response(self):
+        """Read the lines written by VLC up to the next prompt.
+
+        Raises socket.timeout if VLC does not finish its response in
+        time, since a partial response would leave the rest of it to be
+        read as the response to the next command.
+        """
+        data = b""
+
+        while not data.endswith(PROMPT):
+            chunk = self._socket.recv(4096)
+
+            if chunk == b"":
+                raise IOError("VLC closed its RC socket")
+
+            data += chunk
+
+        lines = data.decode("utf-8", "replace").splitlines()
+
+        return [line.replace("> ", "").strip() for line in lines if line.replace("> ", "").strip() != ""]
+
+    def _command(self, command):
+        """Send a command and get the lines of its response.
+
+        :param command
+        """
+        with self._lock:
+            if self._socket is None:
+                raise IOError("VLC engine is not connected")
+
+            try:
+                self._socket.sendall(command.encode("utf-8") + b"\n")
+                return self._read_response()
+            except OSError:
+                # the engine cannot be used again once its connection is lost or it hangs
+                self._socket.close()
+                self._socket = None
+                raise
+
+    def _get_number(self, command):
+        """Send a command whose response is a number.
+
+        Returns None if the response has no number.
+
+        :param command
+        """
+        numbers = [line for line in self._command(command) if line.isdigit()]
+
+        return int(numbers[-1]) if len(numbers) > 0 else None
+
+    def _exited(self):
+        """Notify the owner of the engine that the VLC process has exited."""
+        on_exit = self._on_exit
+        self._on_exit = None
+
+        if on_exit is not None:
+            on_exit()
+
+    def set_on_exit(self, on_exit):
+        """Set the function to call if the VLC process exits.
+
+        The function is called on the timer thread of the supervisor.
+
+        :param on_exit: function, or None to clear it
+        """
+        self._on_exit = on_exit
+
+    def get_pid(self):
+        """Get the process ID of the engine."""
+        return self._process.pid
+
+    def is_alive(self):
+        """Get whether the VLC process is running and connected."""
+        return self._socket is not None and self._process.poll() is None
+
+    def load(self, filename, paused=False):
+        """Play a file, replacing whatever was playing.
+
+        A file which is loaded paused is opened and decoded up to its
+        first frame, and starts when the engine is resumed.
+
+        :param filename
+        :param paused: whether to hold the file at its first frame
+        """
+        command = "add " + pathlib.Path(filename).absolute().as_uri()
+
+        if paused:
+            command += " :start-paused"
+
+        self._command("clear")
+        self._command(command)
+
+    def resume(self):
+        """Start a file which was loaded paused."""
+        self._command("play")
+
+    def stop(self):
+        """Stop playing and clear the playlist."""
+        self._command("stop")
+        self._command("clear")
+
+    def is_playing(self):
+        """Get whether the engine is playing a file."""
+        return self._get_number("is_playing") == 1
+
+    def get_time(self):
+        """Get the position in the current file in seconds, or None if nothing is playing."""
+        return self._get_number("get_time")
+
+    def close(self):
+        """Stop the VLC process."""
+        self.set_on_exit(None)
+
+        # a hung engine cannot be asked to shut down, and waiting for the
+        # lock would wait for the command which hung
+        if self._lock.acquire(timeout=COMMAND_TIMEOUT):
+            try:
+                if self._socket is not None:
+                    try:
+                        self._socket.sendall(b"shutdown\n")
+                    except OSError:
+                        pass
+                    self._socket.close()
+                    self._socket = None
+                elif self._process.poll() is None:
+                    self._process.kill()
+            finally:
+                self._lock.release()
+        elif self._process.poll() is None:
+            self._process.kill()
+
+        try:
+            self._process.wait(timeout=COMMAND_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+        if os.path.exists(self._path):
+            os.remove(self._path)
+        os.rmdir(os.path.dirname(self._path))
+
+
+_idle = []
+_engines = set()
+_lock = threading.Lock()
+_num_started = 0
+_prewarmed = False
+_warming = False
+
+
+def _start_engine():
+    """Start an engine and add it to the set of running engines."""
+    global _num_started
+
+    engine = Engine()
+
+    with _lock:
+        _engines.add(engine)
+        _num_started += 1
+
+    return engine
+
+
+def _run_warm():
+    """Start engines until MIN_IDLE are idle, in a separate thread."""
+    global _warming
+
+    try:
+        while True:
+            with _lock:
+                if len(_idle) >= MIN_IDLE:
+                    break
+
+            try:
+                engine = _start_engine()
+            except IOError as e:
+                print(time.asctime() + " :=: VLCEngine :: Could not start engine: " + str(e))
+                break
+
+            release(engine)
+    finally:
+        with _lock:
+            _warming = False
+
+
+def _warm():
+    """Start idle engines in the background if the pool is below MIN_IDLE."""
+    global _warming
+
+    with _lock:
+        if not _prewarmed or _warming or len(_idle) >= MIN_IDLE:
+            return
+        _warming = True
+
+    threading.Thread(target=_run_warm, daemon=True).start()
+
+
+def prewarm():
+    """Start MIN_IDLE engines in the background and keep that many idle from now on.
+
+    The apps which play through VLC call this at startup, so that the
+    first play does not wait for VLC to start.
+    """
+    global _prewarmed
+
+    with _lock:
+        _prewarmed = True
+
+    _warm()
+
+
+def acquire():
+    """Get an idle engine from the pool, starting one if necessary."""
+    dead = []
+
+    with _lock:
+        while len(_idle) > 0:
+            engine = _idle.pop()
+
+            if engine.is_alive():
+                break
+
+            _engines.discard(engine)
+            dead.append(engine)
+        else:
+            engine = None
+
+    for dead_engine in dead:
+        dead_engine.close()
+
+    # replace the engine which was taken before the next play needs it
+    _warm()
+
+    if engine is not None:
+        return engine
+
+    return _start_engine()
+
+
+def release(engine):
+    """Return an engine to the pool once it has stopped.
+
+    :param engine
+    """
+    with _lock:
+        if engine.is_alive() and len(_idle) < MAX_IDLE:
+            _idle.append(engine)
+            return
+
+        _engines.discard(engine)
+
+    engine.close()
+
+
+def get_stats():
+    """Get the number of engines running, idle and started so far."""
+    with _lock:
+        return {
+            "running": len(_engines),
+            "idle": len(_idle),
+            "started": _num_started
+        }
+
+
+@atexit.register
+def _close_all():
+    """Stop every engine when the process exits."""
+    with _lock:
+        engines = list(_engines)
+        _engines.clear()
+        del _idle[:]
+
+    for engine in engines:
+        engine.close()
@@ -3,6 +3,9 @@
 """The Automation module provides a GUI for radio automation."""
 import tkinter
 from tkinter import Label, StringVar, Button, Frame, Scrollbar, Listbox
+from cart import set_player_backend
+import database
+import supervisor
 from cartqueue import CartQueue
 from meter import Meter
 
@@ -115,9 +118,10 @@ class Automation(Frame):
         The state machine is as follows:
         STATE_STOPPED -> STATE_PLAYING -> STATE_STOPPING -> STATE_STOPPED
         """
+        # the queue is changed only on the dispatch thread, where its transitions run
         if self._state is STATE_STOPPED:
             print("Starting Automation...")
-            self._cart_queue.start()
+            supervisor.dispatch(self._cart_queue.start)
             self._state = STATE_PLAYING
         elif self._state is STATE_PLAYING:
             print("Stopping Automation after this track...")
@@ -125,7 +129,7 @@ class Automation(Frame):
             self._state = STATE_STOPPING
         elif self._state is STATE_STOPPING:
             print("Stopping Automation immediately.")
-            self._cart_queue.transition()
+            supervisor.dispatch(self._cart_queue.transition)
             self._state = STATE_STOPPED
         self._update_ui()
 
@@ -154,19 +158,23 @@ class Automation(Frame):
         self._list_track.delete(0, tkinter.END)
         self._list_artist.delete(0, tkinter.END)
 
-        for cart in self._cart_queue.get_queue():
-            self._list_time.insert(tkinter.END, cart.start_time.strftime("%I:%M:%S %p"))
+        for start_time, cart in self._cart_queue.get_schedule():
+            self._list_time.insert(tkinter.END, start_time.strftime("%I:%M:%S %p"))
             self._list_track.insert(tkinter.END, cart.title)
             self._list_artist.insert(tkinter.END, cart.issuer)
 
     def _get_meter_data(self):
         """Get meter data for the first track in the queue."""
-        queue = self._cart_queue.get_queue()
+        cart = self._cart_queue.get_current()
 
-        if len(queue) > 0:
-            return queue[0].get_meter_data()
+        if cart is not None:
+            return cart.get_meter_data()
         else:
             return None
 
 
+# segue from each track into the next
+set_player_backend("mixer")
+
+database.start()
 Automation()
@@ -4,6 +4,7 @@
 import random
 import tkinter
 from tkinter import Frame, Label, Button
+from cart import set_player_backend
 import database
 from cartgrid import Grid
 from meter import Meter
@@ -242,4 +243,8 @@ class CartMachine(Frame):
         return self._grid.get_active_cell().get_cart().get_meter_data()
 
 
+# start VLC before the first cart is played
+set_player_backend("vlc")
+
+database.start()
 CartMachine()
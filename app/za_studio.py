@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 
 """The Studio module provides a GUI for the digital library."""
+import queue
 import threading
+import time
 import tkinter
 from tkinter import Frame, Label, BooleanVar, Checkbutton, Entry, Button
+from cart import set_player_backend
+import catalog
 import database
 from dualbox import DualBox
 from cartgrid import Grid
@@ -21,6 +25,17 @@ TEXT_AUTOSLOT = "Auto-queue tracks"
 TEXT_SEARCHBOX = "Search Box"
 TEXT_SEARCH = "Search"
 
+SEARCH_MIN_LENGTH = 3
+
+# time to wait after the last keystroke before searching, in milliseconds
+SEARCH_DELAY = 300
+
+# interval at which search results are moved into the UI, in milliseconds
+SEARCH_POLL_INTERVAL = 50
+
+# number of search results probed and shown at a time
+SEARCH_PAGE_SIZE = 50
+
 
 def get_next_key(rows, cols, key):
     """Get the next cell to queue after a cell.
@@ -59,6 +74,15 @@ class Studio(Frame):
     _search_results = None
     _selected_cart = None
 
+    _search_id = 0
+    _search_query = None
+    _search_after = None
+    _search_requests = None
+    _search_pages = None
+
+    _cache_query = None
+    _cache_results = None
+
     def __init__(self):
         """Construct a Studio window."""
         Frame.__init__(self)
@@ -102,6 +126,7 @@ class Studio(Frame):
         Label(control, font=FONT, text=TEXT_SEARCHBOX).pack(anchor=tkinter.NW)
         self._entry = Entry(control, takefocus=True, width=45)
         self._entry.bind("<Return>", self.search)
+        self._entry.bind("<KeyRelease>", self._schedule_search)
         # self._entry.grid(row=GRID_ROWS + 3, column=0, columnspan=5)
         self._entry.pack(anchor=tkinter.NW)
         self._entry.focus_set()
@@ -110,30 +135,117 @@ class Studio(Frame):
         # button.grid(row=GRID_ROWS + 3, column=5)
         button.pack(anchor=tkinter.S)
 
+        # initialize the search worker
+        self._search_results = []
+        self._search_requests = queue.Queue()
+        self._search_pages = queue.Queue()
+
+        thread = threading.Thread(target=self._search_internal, daemon=True)
+        thread.start()
+
+        self.after(SEARCH_POLL_INTERVAL, self._poll_search)
+
         # begin the event loop
         self.master.protocol("WM_DELETE_WINDOW", self.master.destroy)
         self.master.title(TEXT_TITLE)
         self.master.mainloop()
 
     def _search_internal(self):
-        """Search the digital library in a separate thread."""
-        query = self._entry.get()
+        """Run searches in a separate thread.
+
+        Only the most recent search request is run, and a search stops
+        as soon as a newer one is requested. Each page of results is
+        passed to the UI thread as soon as it is ready. A search which
+        fails is passed on as complete with no query, so that the UI
+        does not wait for it and does not keep its results.
+        """
+        while True:
+            search_id, query = self._search_requests.get()
+
+            # skip to the most recent request
+            while not self._search_requests.empty():
+                search_id, query = self._search_requests.get()
 
-        if len(query) >= 3:
             print("Searching library with query \"%s\"..." % query)
 
-            self._search_results = database.search_library(query)
-            self._dual_box.fill(self._search_results)
+            try:
+                truncated = False
+                for page, truncated in database.iter_search(query, SEARCH_PAGE_SIZE):
+                    if search_id != self._search_id:
+                        break
+                    self._search_pages.put((search_id, query, page, False))
+                else:
+                    self._search_pages.put((search_id, query, [], not truncated))
+            except Exception as e:
+                print(time.asctime() + " :=: Studio :: Search failed: %s: %s" % (type(e).__name__, e))
+                self._search_pages.put((search_id, None, [], True))
+
+    def _poll_search(self):
+        """Move pages of search results into the UI."""
+        while not self._search_pages.empty():
+            search_id, query, page, is_complete = self._search_pages.get()
+
+            # discard results of stale searches
+            if search_id != self._search_id:
+                continue
+
+            self._search_results.extend(page)
+            self._dual_box.append(page)
+
+            # allow a failed search to be run again
+            if query is None:
+                self._search_query = None
+            elif is_complete:
+                print("Found %d results." % len(self._search_results))
+                self._cache_query = query
+                self._cache_results = list(self._search_results)
+
+        self.after(SEARCH_POLL_INTERVAL, self._poll_search)
+
+    def _schedule_search(self, event):
+        """Search the digital library once typing has paused.
+
+        :param event
+        """
+        if event.keysym == "Return":
+            return
 
-            print("Found %d results." % len(self._search_results))
+        if self._search_after is not None:
+            self.after_cancel(self._search_after)
+
+        self._search_after = self.after(SEARCH_DELAY, self.search)
 
     def search(self, *args):
         """Search the digital library.
 
+        If the query extends a previous query whose results were
+        complete, the previous results are refined without searching
+        again.
+
         :param args
         """
-        thread = threading.Thread(target=self._search_internal, daemon=True)
-        thread.start()
+        if self._search_after is not None:
+            self.after_cancel(self._search_after)
+            self._search_after = None
+
+        query = self._entry.get().strip()
+
+        if len(query) < SEARCH_MIN_LENGTH or query == self._search_query:
+            return
+
+        self._search_id += 1
+        self._search_query = query
+        self._selected_cart = None
+
+        if self._cache_query is not None and query.lower().startswith(self._cache_query.lower()):
+            self._search_results = [cart for cart in self._cache_results
+                                    if catalog.matches(query, cart.title, cart.issuer)]
+            self._dual_box.fill(self._search_results)
+            return
+
+        self._search_results = []
+        self._dual_box.fill([])
+        self._search_requests.put((self._search_id, query))
 
     def select_cart(self, index):
         """Select a cart from the search results.
@@ -178,4 +290,8 @@ class Studio(Frame):
         return self._grid.get_active_cell().get_cart().get_meter_data()
 
 
+# start VLC before the first cart is played
+set_player_backend("vlc")
+
+database.start()
 Studio()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""Benchmark for constructing carts.
+
+Constructs a batch of carts and tracks for an MP3 file, as a search or
+playlist load does, and prints the time and memory used when each cart
+creates its audio stream eagerly and when it is created lazily.
+"""
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, 'app')
+from cart import Cart, Track
+from player_vlc import VLCPlayer
+
+NUM_CARTS = 5000
+
+if len(sys.argv) != 2:
+    print("usage: test/bench_cart.py [mp3-file]")
+    sys.exit(1)
+
+FILENAME = sys.argv[1]
+
+
+def load_eager():
+    carts = []
+    for i in range(NUM_CARTS):
+        cart = Cart(str(i), "Title %d" % i, "Artist %d" % (i % 100), "N", FILENAME)
+        cart._player = VLCPlayer(FILENAME.encode())
+        carts.append(cart)
+    return carts
+
+
+def load_lazy():
+    carts = []
+    for i in range(NUM_CARTS):
+        cart = Cart(str(i), "Title %d" % i, "Artist %d" % (i % 100), "N", FILENAME)
+        cart.is_playable()
+        carts.append(cart)
+    return carts
+
+
+def load_tracks():
+    tracks = []
+    for i in range(NUM_CARTS):
+        track = Track("A%d-01" % i, "Title %d" % i, "Artist %d" % (i % 100), "N", FILENAME)
+        track.is_playable()
+        tracks.append(track)
+    return tracks
+
+
+# warm the metadata cache so that both loads measure a known file
+load_lazy()
+
+print("%8s %12s %14s" % ("load", "ms/cart", "bytes/cart"))
+
+for name, load in [("eager", load_eager), ("lazy", load_lazy), ("tracks", load_tracks)]:
+    tracemalloc.start()
+    begin = time.monotonic()
+    carts = load()
+    elapsed = time.monotonic() - begin
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("%8s %12.4f %14.0f" % (name, elapsed * 1000 / NUM_CARTS, size / NUM_CARTS))
+
+    del carts
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""Benchmark for the database module.
+
+Runs the database functions against the local stand-in server and
+prints the throughput and latency percentiles of each one. The apps'
+caches are kept in a temporary directory, and the catalog and the
+search result cache are emptied before each call to a function which
+fetches from the server, so that every call measures the network path
+rather than a mix of cold and warm calls.
+
+add_tracks is measured on a single cart queue whose reservoir is filled
+between calls, outside of the timed section, so that each call measures
+taking tracks from a full reservoir.
+
+usage: test/bench_database.py [library-directory] [options]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'test')
+sys.path.insert(0, 'app')
+from standin_server import Library, StandinServer
+
+parser = argparse.ArgumentParser(description="Benchmark the database module against the stand-in server.")
+parser.add_argument("library", help="directory for the generated audio files")
+parser.add_argument("--tracks", type=int, default=100000)
+parser.add_argument("--iterations", type=int, default=100)
+parser.add_argument("--latency", type=float, default=0.02, help="mean latency in seconds")
+parser.add_argument("--error-rate", type=float, default=0.0)
+args = parser.parse_args()
+
+print("Generating library of %d tracks..." % args.tracks)
+library = Library(args.library, args.tracks)
+
+server = StandinServer(library, latency=args.latency, error_rate=args.error_rate)
+server.start()
+
+# point the apps at the stand-in and give them empty caches
+os.environ["ZAUTOMATE_API_ROOT"] = server.get_api_root()
+os.environ["ZAUTOMATE_LIBRARY_PREFIX"] = os.path.abspath(args.library) + "/"
+os.environ["HOME"] = tempfile.mkdtemp()
+
+import database
+import session
+from cartqueue import CartQueue
+from catalog import Catalog
+from clock import Clock
+
+
+class DeferredClock(Clock):
+    """The DeferredClock class is a wall clock which runs background work only when asked to."""
+
+    def __init__(self):
+        self.pending = []
+
+    def run_async(self, target):
+        self.pending.append(target)
+
+    def run_pending(self):
+        while len(self.pending) > 0:
+            self.pending.pop(0)()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(name, func, setup=None):
+    latencies = []
+
+    for _ in range(args.iterations):
+        if setup is not None:
+            setup()
+
+        call_begin = time.monotonic()
+        func()
+        latencies.append((time.monotonic() - call_begin) * 1000)
+
+    elapsed = sum(latencies) / 1000
+    latencies.sort()
+
+    print("%-16s %10.1f %10.2f %10.2f %10.2f %10.2f" % (
+        name, args.iterations / elapsed, percentile(latencies, 0.50), percentile(latencies, 0.95),
+        percentile(latencies, 0.99), latencies[-1]))
+
+
+def search():
+    track = random.choice(library.tracks)
+    word = random.choice(track["track_name"].split())
+    database.search_library(word[0:random.randint(3, len(word))])
+
+
+catalog_dir = tempfile.mkdtemp()
+num_catalogs = 0
+
+
+def clear_caches():
+    global num_catalogs
+
+    num_catalogs += 1
+    database._catalog = Catalog(os.path.join(catalog_dir, "catalog-%d.db" % num_catalogs))
+    database._search_cache.clear()
+
+
+clock = DeferredClock()
+cart_queue = CartQueue(None, None, clock=clock)
+
+
+def fill_reservoir():
+    cart_queue._queue.truncate(0)
+    clock.run_pending()
+
+    # a reservoir above its low-water mark may still hold fewer tracks than a call takes
+    cart_queue._reservoir.fill()
+
+
+print("%-16s %10s %10s %10s %10s %10s" % ("function", "ops/sec", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+
+measure("get_carts", database.get_carts, clear_caches)
+measure("get_playlist", lambda: database.get_playlist(random.choice(list(library.shows))), clear_caches)
+measure("search_library", search, clear_caches)
+measure("add_tracks", cart_queue.add_tracks, fill_reservoir)
+
+print("server requests: %d" % server.num_requests)
+print("session: %s" % session.get_stats())
+print("breaker: %s" % session.get_breaker_state())
+print("search cache: %s" % database.get_search_stats())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""Benchmark for fitting tracks before carts.
+
+Places a top-of-hour StationID into random queues of tracks, with and
+without fitting, and prints how far the cart lands from its target and
+how much CPU time the fitter takes.
+"""
+import contextlib
+import datetime
+import io
+import random
+import sys
+import time
+
+sys.path.insert(0, 'app')
+import fitter
+import planner
+from planner import Planner
+from timeline import Timeline
+
+NUM_TRIALS = 1000
+QUEUE_LENGTH = 20
+
+CONFIG = [{"type": "StationID", "minute": 0, "max_delta": 300}]
+
+
+class FakeCart(object):
+    """The FakeCart class stands in for a cart with a fixed length."""
+
+    def __init__(self, cart_id, cart_type, length):
+        self.cart_id = cart_id
+        self.issuer = cart_id
+        self.cart_type = cart_type
+        self._length = length
+
+    def get_meter_data(self):
+        return (0, self._length, self.cart_id, self.issuer)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def place(rand, now, fit_tolerance):
+    """Place a StationID into a random queue and get its deviation from the target in seconds."""
+    planner.FIT_TOLERANCE = fit_tolerance
+    tracks = [FakeCart("track%d" % i, "N", rand.randint(120, 420) * 1000) for i in range(QUEUE_LENGTH)]
+    queue = Timeline(tracks)
+    queue.set_start_time(now)
+
+    station_id = FakeCart("0001", "StationID", 10000)
+    plan = Planner(CONFIG, lambda cart_type: station_id, lookahead=1)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        plan.plan(queue, now)
+
+    for start_time, cart in queue.iter_schedule():
+        if cart is station_id:
+            return abs((start_time - now.replace(minute=0, second=0) - datetime.timedelta(hours=1)).total_seconds())
+
+    return None
+
+
+now = datetime.datetime(2020, 1, 1, 12, 20)
+
+for name, fit_tolerance in (("nearest", float("inf")), ("fitted", 5.0)):
+    rand = random.Random(0)
+    deltas = sorted(place(rand, now, fit_tolerance) for _ in range(NUM_TRIALS))
+
+    print("%-8s p50 %6.1f s, p90 %6.1f s, max %6.1f s, exact %.1f%%" % (
+        name, percentile(deltas, 0.50), percentile(deltas, 0.90), deltas[-1],
+        100.0 * sum(1 for delta in deltas if delta < 1) / NUM_TRIALS))
+
+# CPU time of the fitter alone for a one-hour gap
+rand = random.Random(0)
+times = []
+
+for _ in range(NUM_TRIALS):
+    lengths = [rand.randint(120, 420) for _ in range(fitter.MAX_CANDIDATES)]
+    begin = time.process_time()
+    fitter.fit(lengths, 3600, 300)
+    times.append((time.process_time() - begin) * 1000)
+
+times.sort()
+print("fit: %d candidates, p50 %.3f ms, p99 %.3f ms, max %.3f ms (budget %.1f ms)" % (
+    fitter.MAX_CANDIDATES, percentile(times, 0.50), percentile(times, 0.99), times[-1], fitter.FIT_BUDGET * 1000))
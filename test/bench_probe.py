@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""Benchmark for probing audio files in parallel.
+
+Probes every MP3 file under a directory with worker pools of
+increasing size and prints the throughput of each pool size. Each pool
+size starts with an empty metadata cache, so that every file is probed
+instead of being found in the cache filled by the previous pool size,
+and the caches are kept away from the real ones.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, 'app')
+
+# keep the database module away from the real caches
+workdir = tempfile.mkdtemp(prefix="bench_probe.")
+os.environ["HOME"] = workdir
+
+import database
+import metacache
+
+POOL_SIZES = [1, 2, 4, 8, 16, 32]
+
+if len(sys.argv) != 2:
+    print("usage: test/bench_probe.py [mp3-directory]")
+    sys.exit(1)
+
+RECORDS = []
+
+for dirpath, dirnames, filenames in os.walk(sys.argv[1]):
+    for filename in filenames:
+        if filename.lower().endswith(".mp3"):
+            RECORDS.append((str(len(RECORDS)), filename, "Artist", "N", os.path.join(dirpath, filename)))
+
+print("%d files" % len(RECORDS))
+print("%8s %10s %12s" % ("workers", "seconds", "files/sec"))
+
+try:
+    for pool_size in POOL_SIZES:
+        metacache._cache = metacache.MetadataCache(os.path.join(workdir, "metadata-%d.db" % pool_size))
+        executor = ThreadPoolExecutor(max_workers=pool_size)
+
+        begin = time.monotonic()
+        carts = database.build_playable(RECORDS, executor)
+        elapsed = time.monotonic() - begin
+
+        executor.shutdown()
+
+        print("%8d %10.3f %12.1f" % (pool_size, elapsed, len(RECORDS) / elapsed))
+finally:
+    shutil.rmtree(workdir)
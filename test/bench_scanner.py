@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Benchmark for indexing the music library.
+
+Generates a library of fake MP3 files in an artist/album tree, indexes
+it into a fresh metadata cache, and prints the time of a cold scan, a
+rescan of the unchanged library, a rescan after a file is removed, and
+a number of length lookups through the index.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'app')
+sys.path.insert(0, 'test')
+import metacache
+from scanner import Scanner
+from standin_server import make_audio
+
+NUM_TRACKS = 20000
+NUM_LOOKUPS = 10000
+TRACKS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 3
+
+num_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_TRACKS
+
+workdir = tempfile.mkdtemp(prefix="bench_scanner.")
+library = os.path.join(workdir, "library")
+filenames = []
+
+try:
+    rand = random.Random(1)
+
+    for i in range(num_tracks):
+        album = i // TRACKS_PER_ALBUM
+        path = os.path.join(library, "artist%05d" % (album // ALBUMS_PER_ARTIST), "album%06d" % album)
+        os.makedirs(path, exist_ok=True)
+
+        filename = os.path.join(path, "track%02d.mp3" % (i % TRACKS_PER_ALBUM))
+        make_audio(filename, rand.randint(120, 420))
+        filenames.append(filename)
+
+    cache = metacache.MetadataCache(os.path.join(workdir, "metadata.db"))
+    scanner = Scanner(library, cache=cache)
+
+    print("%d tracks in %d directories" % (num_tracks, sum(1 for _ in os.walk(library))))
+    print("%-28s %10s" % ("operation", "seconds"))
+
+    begin = time.monotonic()
+    scanner.scan()
+    print("%-28s %10.3f" % ("cold scan", time.monotonic() - begin))
+
+    begin = time.monotonic()
+    scanner.scan()
+    print("%-28s %10.3f" % ("rescan, unchanged", time.monotonic() - begin))
+
+    os.remove(filenames.pop(rand.randrange(len(filenames))))
+
+    begin = time.monotonic()
+    scanner.scan()
+    print("%-28s %10.3f" % ("rescan, one file removed", time.monotonic() - begin))
+
+    lookups = [rand.choice(filenames) for _ in range(NUM_LOOKUPS)]
+
+    begin = time.monotonic()
+    for filename in lookups:
+        cache.get_length(filename)
+    print("%-28s %10.3f" % ("%d lookups" % NUM_LOOKUPS, time.monotonic() - begin))
+
+    print(scanner.get_stats())
+finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Benchmark for searching the catalog.
+
+Builds a catalog of synthetic tracks in a temporary directory and
+prints the latency percentiles of local searches against it.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'app')
+from catalog import Catalog
+
+NUM_TRACKS = 500000
+NUM_QUERIES = 1000
+BATCH_SIZE = 10000
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "to", "sha", "vel", "dor", "qu", "ing", "ar", "bel", "xo", "ne", "ty", "or"]
+
+
+def make_word(rand):
+    return "".join(rand.choice(SYLLABLES) for _ in range(rand.randint(2, 4)))
+
+
+def make_name(rand, num_words):
+    return " ".join(make_word(rand) for _ in range(num_words)).title()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+rand = random.Random(0)
+artists = [make_name(rand, rand.randint(1, 3)) for _ in range(NUM_TRACKS // 20)]
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    catalog = Catalog(os.path.join(tmpdir, "catalog.db"))
+
+    begin = time.monotonic()
+    for i in range(0, NUM_TRACKS, BATCH_SIZE):
+        records = []
+        for j in range(i, i + BATCH_SIZE):
+            title = make_name(rand, rand.randint(1, 5))
+            records.append(("A%06d-%02d" % (j // 12, j % 12 + 1), title, rand.choice(artists), "N",
+                            "/media/Jemaine/%d.mp3" % j))
+        catalog.put_tracks(records)
+    print("indexed %d tracks in %.1f s" % (NUM_TRACKS, time.monotonic() - begin))
+
+    # queries are one or two words, each truncated like a partially typed word
+    queries = []
+    for _ in range(NUM_QUERIES):
+        words = [make_word(rand) for _ in range(rand.randint(1, 2))]
+        queries.append(" ".join(word[0:rand.randint(3, len(word))] for word in words))
+
+    latencies = []
+    num_results = 0
+    for query in queries:
+        begin = time.monotonic()
+        num_results += len(catalog.search(query))
+        latencies.append((time.monotonic() - begin) * 1000)
+
+    latencies.sort()
+
+    print("%d queries, %.1f results per query" % (NUM_QUERIES, num_results / NUM_QUERIES))
+    print("p50 %.2f ms, p90 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+        percentile(latencies, 0.50), percentile(latencies, 0.90), percentile(latencies, 0.99), latencies[-1]))
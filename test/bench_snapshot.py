@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""Benchmark for the catalog snapshot.
+
+Writes a snapshot of synthetic tracks in a temporary directory and
+prints its size and the latency of record lookups, compared with
+lookups in the SQLite catalog.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'app')
+import snapshot
+from catalog import Catalog
+
+NUM_TRACKS = 500000
+NUM_LOOKUPS = 100000
+BATCH_SIZE = 10000
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "to", "sha", "vel", "dor", "qu", "ing", "ar", "bel", "xo", "ne", "ty", "or"]
+
+
+def make_name(rand, num_words):
+    words = ["".join(rand.choice(SYLLABLES) for _ in range(rand.randint(2, 4))) for _ in range(num_words)]
+    return " ".join(words).title()
+
+
+rand = random.Random(0)
+artists = [make_name(rand, rand.randint(1, 3)) for _ in range(NUM_TRACKS // 36 + 1)]
+records = [("%06d-%02d" % (i // 12, i % 12 + 1), make_name(rand, rand.randint(1, 5)), artists[i // 36],
+            rand.choice("NHMLO"), "/media/Jemaine/%d.mp3" % i) for i in range(NUM_TRACKS)]
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, "catalog.snap")
+
+    begin = time.monotonic()
+    snapshot.write(path, records)
+    print("wrote %d records in %.1f s, %.1f MB" % (
+        NUM_TRACKS, time.monotonic() - begin, os.path.getsize(path) / 1e6))
+
+    catalog = Catalog(os.path.join(tmpdir, "catalog.db"))
+    for i in range(0, NUM_TRACKS, BATCH_SIZE):
+        catalog.put_playlist(i, records[i:i + BATCH_SIZE])
+
+    view = snapshot.Snapshot(path)
+    keys = [rand.choice(records)[0] for _ in range(NUM_LOOKUPS)]
+
+    begin = time.monotonic()
+    for key in keys:
+        assert view.get(key) is not None
+    elapsed = time.monotonic() - begin
+    print("snapshot: %.2f us per lookup" % (elapsed / NUM_LOOKUPS * 1e6))
+
+    begin = time.monotonic()
+    for key in keys:
+        catalog._conn.execute("SELECT track_id, title, artist, rotation, filename FROM tracks "
+                              "WHERE track_id = ?", (key,)).fetchone()
+    elapsed = time.monotonic() - begin
+    print("catalog:  %.2f us per lookup" % (elapsed / NUM_LOOKUPS * 1e6))
+
+    assert view.get("missing") is None
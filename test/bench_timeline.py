@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""Benchmark for the Automation queue timeline.
+
+Compares the Timeline with the plain list used by the queue before it,
+at several queue lengths, for the three operations on the transition
+path: inserting a cart at a target time, moving to the next track, and
+checking whether an artist is already queued. The start times of the
+timeline are checked against a plain prefix sum along the way.
+"""
+import datetime
+import random
+import sys
+import time
+
+sys.path.insert(0, 'app')
+from timeline import Timeline
+
+QUEUE_LENGTHS = [10, 1000, 100000]
+
+# number of operations of each kind, or the queue length if it is shorter
+NUM_OPS = 1000
+
+
+class FakeCart(object):
+    """The FakeCart class stands in for a cart with a fixed length."""
+
+    def __init__(self, cart_id, issuer, length):
+        self.cart_id = cart_id
+        self.issuer = issuer
+        self.cart_type = "Track"
+        self.start_time = None
+        self._length = length
+
+    def get_meter_data(self):
+        return (0, self._length, self.cart_id, self.issuer)
+
+
+def make_carts(rand, count):
+    return [FakeCart(str(i), "Artist %d" % rand.randrange(count), rand.randint(120, 420) * 1000)
+            for i in range(count)]
+
+
+### the plain list implementation which the timeline replaced
+
+def list_gen_start_times(queue, begin_index):
+    start_time = datetime.datetime.now()
+
+    for i in range(begin_index, len(queue)):
+        if i > 0:
+            prev = queue[i - 1]
+            start_time = prev.start_time + datetime.timedelta(milliseconds=prev.get_meter_data()[1])
+        queue[i].start_time = start_time
+
+
+def list_insert(queue, target, cart):
+    min_index = -1
+    min_delta = None
+
+    for i in range(1, len(queue)):
+        delta = abs(target - queue[i].start_time)
+        if min_delta is None or delta < min_delta:
+            min_index = i
+            min_delta = delta
+        elif delta > min_delta:
+            break
+
+    queue.insert(min_index, cart)
+    list_gen_start_times(queue, min_index)
+
+
+def list_transition(queue, cart):
+    queue.pop(0)
+    queue.append(cart)
+    list_gen_start_times(queue, len(queue) - 1)
+
+
+def list_has_artist(queue, issuer):
+    return any(item.issuer == issuer for item in queue)
+
+
+def timeline_insert(queue, target, cart):
+    queue.insert(queue.find_nearest(target, 1), cart)
+
+
+def timeline_transition(queue, cart):
+    queue.pop_front()
+    queue.append(cart)
+
+
+def measure(func, args_list):
+    begin = time.monotonic()
+    for args in args_list:
+        func(*args)
+    return (time.monotonic() - begin) / len(args_list) * 1e6
+
+
+def check(queue):
+    offset = 0
+    for index, (start_time, cart) in enumerate(queue.iter_schedule()):
+        assert start_time == queue.get_start_time(index)
+        assert queue.get_offset(index) == offset
+        offset += cart.get_meter_data()[1]
+
+
+rand = random.Random(0)
+
+print("%-8s %-12s %12s %12s" % ("length", "operation", "list us", "timeline us"))
+
+for length in QUEUE_LENGTHS:
+    carts = make_carts(rand, length)
+    num_ops = min(NUM_OPS, length)
+    extra = make_carts(rand, 2 * num_ops)
+
+    queue_list = list(carts)
+    list_gen_start_times(queue_list, 0)
+    queue_timeline = Timeline(carts)
+    queue_timeline.set_start_time(queue_list[0].start_time)
+
+    end_time = queue_timeline.get_end_time()
+    duration = end_time - queue_timeline.get_start_time(0)
+    targets = [queue_timeline.get_start_time(0) + duration * rand.random() for _ in range(num_ops)]
+    artists = ["Artist %d" % rand.randrange(2 * length) for _ in range(num_ops)]
+
+    results = [
+        ("insert",
+         measure(list_insert, [(queue_list, t, c) for t, c in zip(targets, extra[0:num_ops])]),
+         measure(timeline_insert, [(queue_timeline, t, c) for t, c in zip(targets, extra[0:num_ops])])),
+        ("transition",
+         measure(list_transition, [(queue_list, c) for c in extra[num_ops:]]),
+         measure(timeline_transition, [(queue_timeline, c) for c in extra[num_ops:]])),
+        ("has_artist",
+         measure(list_has_artist, [(queue_list, a) for a in artists]),
+         measure(queue_timeline.has_artist, [(a,) for a in artists]))
+    ]
+
+    for name, list_time, timeline_time in results:
+        print("%-8d %-12s %12.2f %12.2f" % (length, name, list_time, timeline_time))
+
+    # both queues must agree on the order of the carts
+    assert [cart.cart_id for cart in queue_list] == [cart.cart_id for cart in queue_timeline]
+    check(queue_timeline)
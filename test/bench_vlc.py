@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""Benchmark for starting playback in VLC.
+
+Plays an audio file repeatedly with VLC's null audio output, first by
+starting a new VLC process for every play as VLCPlayer used to, then by
+loading the file into a pooled engine, and prints the start latency
+(until VLC reports that it is playing) and the memory of the VLC
+processes for each.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, 'app')
+
+# play without an audio device
+os.environ["ZAUTOMATE_VLC_AOUT"] = "adummy"
+
+import vlcengine
+
+NUM_PLAYS = 20
+
+if len(sys.argv) != 2:
+    print("usage: test/bench_vlc.py [audio-file]")
+    sys.exit(1)
+
+if not os.path.exists(vlcengine.VLC_PATH):
+    print("%s not found" % vlcengine.VLC_PATH)
+    sys.exit(1)
+
+FILENAME = sys.argv[1]
+
+
+def get_rss(pid):
+    """Get the resident memory of a process in kB."""
+    with open("/proc/%d/status" % pid) as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+
+    return 0
+
+
+def wait_playing(engine):
+    """Wait until an engine reports that it is playing."""
+    while not engine.is_playing():
+        time.sleep(0.001)
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_spawn():
+    """Start a new VLC process for every play."""
+    latencies = []
+    rss = []
+
+    for _ in range(NUM_PLAYS):
+        begin = time.monotonic()
+        engine = vlcengine.Engine()
+        engine.load(FILENAME)
+        wait_playing(engine)
+        latencies.append((time.monotonic() - begin) * 1000)
+
+        rss.append(get_rss(engine.get_pid()))
+        engine.close()
+
+    return latencies, rss
+
+
+def bench_engine():
+    """Load every play into an engine from the pool."""
+    latencies = []
+    rss = []
+
+    # start the engine before the first play, as after the first cart
+    vlcengine.release(vlcengine.acquire())
+
+    for _ in range(NUM_PLAYS):
+        begin = time.monotonic()
+        engine = vlcengine.acquire()
+        engine.load(FILENAME)
+        wait_playing(engine)
+        latencies.append((time.monotonic() - begin) * 1000)
+
+        rss.append(get_rss(engine.get_pid()))
+        engine.stop()
+        vlcengine.release(engine)
+
+    return latencies, rss
+
+
+print("%-8s %10s %10s %10s %12s %10s" % ("mode", "p50 ms", "p90 ms", "max ms", "RSS kB", "processes"))
+
+for name, bench in (("spawn", bench_spawn), ("engine", bench_engine)):
+    latencies, rss = bench()
+    processes = NUM_PLAYS if name == "spawn" else vlcengine.get_stats()["started"]
+
+    print("%-8s %10.1f %10.1f %10.1f %12d %10d" % (
+        name, percentile(latencies, 0.5), percentile(latencies, 0.9), max(latencies), max(rss), processes))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+"""Simulation of the Automation queue on a virtual clock.
+
+Runs a CartQueue against a fake database and a fake player whose tracks
+end on a virtual clock, so that days of automation run in seconds. The
+fake tracks can play longer or shorter than their reported lengths, to
+exercise drift, and a fraction of them can fail to open, to exercise
+skipping broken files. Prints the compliance of each cart configuration entry
+with its window, the number of artist repeats, queue refills and
+reservoir low-water events, the time from the end of each track to the
+start of the next, and the CPU time per simulated hour.
+
+usage: test/simulate.py [options]
+"""
+import argparse
+import contextlib
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'app')
+
+# keep the database module away from the real server, library and caches
+os.environ["ZAUTOMATE_API_ROOT"] = "http://127.0.0.1:9/"
+os.environ["ZAUTOMATE_LIBRARY_PREFIX"] = "/nonexistent/"
+os.environ["HOME"] = tempfile.mkdtemp()
+
+from cart import Cart
+from clock import VirtualClock
+from player import Player
+from timeline import normalize_artist
+import cartqueue
+from cartqueue import CartQueue
+
+NUM_SHOWS = 2000
+NUM_ARTISTS = 3000
+TRACKS_PER_SHOW = 15
+CARTS_PER_TYPE = 10
+
+# time within which playing an artist again counts as a repeat, in hours
+ARTIST_WINDOW = 1
+
+
+class SimPlayer(Player):
+    """The SimPlayer class is an audio stream which plays on a virtual clock."""
+
+    def __init__(self, filename, length, duration, clock):
+        """Construct a simulated player.
+
+        :param filename
+        :param length: reported length in milliseconds
+        :param duration: actual playing time in milliseconds
+        :param clock: VirtualClock
+        """
+        super().__init__(filename)
+        self._length = length
+        self._duration = duration
+        self._clock = clock
+        self._started = None
+        self._event = None
+
+    @property
+    def length(self):
+        return self._length
+
+    @property
+    def time_elapsed(self):
+        if self._started is None:
+            return 0
+        return min(self._length, (self._clock.now() - self._started).total_seconds() * 1000)
+
+    def _finish(self):
+        callback = self._callback
+        self._is_playing = False
+        self._started = None
+        self._callback = None
+
+        if callback is not None:
+            callback()
+
+    def play(self, callback=None):
+        self._is_playing = True
+        self._callback = callback
+        self._started = self._clock.now()
+        self._event = self._clock.call_at(self._started + datetime.timedelta(milliseconds=self._duration),
+                                          self._finish)
+
+    def stop(self):
+        if self._event is not None:
+            self._clock.cancel(self._event)
+        self._is_playing = False
+        self._started = None
+        self._callback = None
+
+
+class SimCart(Cart):
+    """The SimCart class is a cart or track which plays on a virtual clock."""
+    __slots__ = ("_duration", "_clock")
+
+    def __init__(self, record, length, duration, clock):
+        """Construct a simulated cart.
+
+        :param record: cart or track record
+        :param length: reported length in milliseconds
+        :param duration: actual playing time in milliseconds, or None if the file is broken
+        :param clock: VirtualClock
+        """
+        Cart.__init__(self, *record)
+        self._length = length
+        self._playable = True
+        self._duration = duration
+        self._clock = clock
+
+    def _get_player(self):
+        if self._duration is None:
+            raise IOError("could not open audio file " + self._filename)
+        if self._player is None:
+            self._player = SimPlayer(self._filename, self._length, self._duration, self._clock)
+        return self._player
+
+
+class SimDatabase(object):
+    """The SimDatabase class stands in for the database module."""
+
+    def __init__(self, rand, clock, error, broken=0.0):
+        """Generate a library of shows and carts.
+
+        :param rand: random.Random
+        :param clock: VirtualClock
+        :param error: standard deviation of the playing time from the reported length, in seconds
+        :param broken: fraction of files which cannot be opened
+        """
+        self._rand = rand
+        self._clock = clock
+        self._error = error
+        self._broken = broken
+        self.num_playlists = 0
+        self.num_carts = 0
+        self.logged = []
+
+        self._shows = {}
+        for show_id in range(1, NUM_SHOWS + 1):
+            self._shows[show_id] = [("%06d-%02d" % (show_id, i + 1), "Track %d" % i,
+                                     "Artist %d" % rand.randrange(NUM_ARTISTS), rand.choice("NHMLO"),
+                                     rand.randint(120, 420) * 1000) for i in range(TRACKS_PER_SHOW)]
+
+        self._carts = {}
+        for cart_type in ("StationID", "PSA", "Underwriting", "Promotion"):
+            self._carts[cart_type] = [("%d" % (1000 + i), cart_type + " %d" % i, "Issuer", cart_type,
+                                       rand.choice([10, 15, 30, 60]) * 1000) for i in range(CARTS_PER_TYPE)]
+
+    def _make_cart(self, entry):
+        length = entry[4]
+        duration = max(1000, length + int(self._rand.gauss(0, self._error) * 1000))
+        if self._rand.random() < self._broken:
+            duration = None
+        return SimCart(entry[0:4] + ("/dev/null",), length, duration, self._clock)
+
+    def get_new_show_id(self, show_id, deadline=None):
+        new_show_id = show_id
+        while new_show_id == show_id:
+            new_show_id = self._rand.randint(1, NUM_SHOWS)
+        return new_show_id
+
+    def fetch_concurrent(self, func, args_list, max_workers=None):
+        for args in args_list:
+            yield (args, func(*args))
+
+    def iter_playlists(self, show_ids, deadline=None):
+        for show_id in show_ids:
+            self.num_playlists += 1
+            yield (show_id, [self._make_cart(entry) for entry in self._shows[show_id]])
+
+    def get_cart(self, cart_type, deadline=None):
+        self.num_carts += 1
+        return self._make_cart(self._rand.choice(self._carts[cart_type]))
+
+    def log_cart(self, cart_id):
+        self.logged.append(cart_id)
+
+
+def simulate(hours, seed, error, broken=0.0):
+    """Run the queue for a number of simulated hours and print a report.
+
+    :param hours
+    :param seed: random seed
+    :param error: standard deviation of the playing time from the reported length, in seconds
+    :param broken: fraction of files which cannot be opened
+    """
+    clock = VirtualClock(datetime.datetime(2020, 1, 6, 0, 7))
+    db = SimDatabase(random.Random(seed), clock, error, broken)
+    played = []
+
+    def on_cart_start():
+        played.append((clock.now(), queue.get_queue()[0]))
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        queue = CartQueue(on_cart_start, lambda: None, db=db, clock=clock)
+
+        begin = time.process_time()
+        queue.add_tracks()
+        queue.start()
+        num_events = clock.run_until(clock.now() + datetime.timedelta(hours=hours))
+        cpu_time = time.process_time() - begin
+
+    # count tracks whose artist was played within the window before them
+    last_played = {}
+    num_tracks = 0
+    num_repeats = 0
+
+    for start_time, cart in played:
+        if cart.cart_type in cartqueue.CART_TYPES:
+            continue
+
+        artist = normalize_artist(cart.issuer)
+        if artist in last_played and start_time - last_played[artist] < datetime.timedelta(hours=ARTIST_WINDOW):
+            num_repeats += 1
+        last_played[artist] = start_time
+        num_tracks += 1
+
+    print("simulated %d hours in %.2f s of CPU time, %.1f ms per hour" % (hours, cpu_time, cpu_time / hours * 1000))
+    print("%d events, %d tracks, %d carts played" % (num_events, num_tracks, len(played) - num_tracks))
+    stats = queue.get_stats()
+    print("%d refills, %d playlists and %d carts fetched" % (stats["refills"], db.num_playlists, db.num_carts))
+    print("%d broken files skipped" % stats["skipped"])
+    print("reservoir: %d fills, %d low-water events, %d empty takes" % (
+        stats["reservoir"]["fills"], stats["reservoir"]["low_water"], stats["reservoir"]["empty"]))
+    print("transition gap: p50 %.3f ms, max %.3f ms" % (stats["gap_p50"], stats["gap_max"]))
+    print("%d artist repeats within %d hour(s)" % (num_repeats, ARTIST_WINDOW))
+    print()
+    print("%-14s %6s %8s %8s %8s %8s %12s" % ("cart", "minute", "window", "played", "within", "missed", "worst s"))
+
+    for entry in queue.get_report():
+        num_slots = entry["played"] + entry["missed"]
+        print("%-14s %6d %8d %8d %7.1f%% %8d %12s" % (
+            entry["type"], entry["minute"], entry["max_delta"], entry["played"],
+            100.0 * entry["within"] / num_slots if num_slots > 0 else 0.0, entry["missed"],
+            "%.1f" % entry["worst_played"] if entry["worst_played"] is not None else "-"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the Automation queue on a virtual clock.")
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--error", type=float, default=0.0,
+                        help="standard deviation of the playing time from the track length, in seconds")
+    parser.add_argument("--max-delta", type=int, help="override the window of every cart, in seconds")
+    parser.add_argument("--broken", type=float, default=0.0, help="fraction of files which cannot be opened")
+    args = parser.parse_args()
+
+    if args.max_delta is not None:
+        for config in cartqueue.AUTOMATION_CARTS:
+            config["max_delta"] = args.max_delta
+
+    simulate(int(args.days * 24), args.seed, args.error, args.broken)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+"""A local stand-in for the ZAutomate server API.
+
+Serves the seven endpoints used by the database module over a generated
+library of tracks and carts, with fake audio files written to a library
+directory. Each track is a symlink to a sparse silent MP3 file of the
+track's length. Responses can be delayed and errors can be injected, so that
+the network path can be measured offline.
+
+To run the apps against the stand-in, point them at it with:
+
+    ZAUTOMATE_API_ROOT=http://127.0.0.1:8000/api/zautomate/
+    ZAUTOMATE_LIBRARY_PREFIX=[library directory]/
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+NUM_TRACKS = 100000
+NUM_CARTS = 40
+TRACKS_PER_ALBUM = 12
+TRACKS_PER_SHOW = 15
+ALBUMS_PER_ARTIST = 3
+SEARCH_LIMIT = 500
+
+CART_TYPES = ["PSA", "Underwriting", "StationID", "Promotion"]
+ROTATIONS = ["N", "H", "M", "L", "O"]
+SYLLABLES = ["ka", "lo", "mi", "ren", "to", "sha", "vel", "dor", "qu", "ing", "ar", "bel", "xo", "ne", "ty", "or"]
+
+# a silent MPEG-1 Layer III frame at 32 kbps and 44.1 kHz
+MP3_FRAME = b"\xff\xfb\x10\x00" + b"\x00" * 100
+MP3_BITRATE = 32000
+
+
+def make_audio(path, seconds):
+    """Write a fake MP3 file of a given length.
+
+    Only the first frames are written; the rest of the file is sparse,
+    so the file takes almost no disk space but parses to the full length.
+
+    :param path
+    :param seconds
+    """
+    with open(path, "wb") as audio_file:
+        audio_file.write(MP3_FRAME * 20)
+        audio_file.truncate(int(seconds * MP3_BITRATE / 8))
+
+
+def make_name(rand, num_words):
+    """Make a random name of made-up words.
+
+    :param rand: random.Random
+    :param num_words
+    """
+    words = ["".join(rand.choice(SYLLABLES) for _ in range(rand.randint(2, 4))) for _ in range(num_words)]
+    return " ".join(words).title()
+
+
+class Library(object):
+    """The Library class is a generated library of tracks, carts and shows."""
+
+    def __init__(self, path, num_tracks=NUM_TRACKS, seed=0):
+        """Generate a library and write its audio files.
+
+        :param path: library directory
+        :param num_tracks: number of tracks
+        :param seed: random seed
+        """
+        rand = random.Random(seed)
+
+        self.tracks = []
+        self.carts = {cart_type: [] for cart_type in range(len(CART_TYPES))}
+        self.shows = {}
+        self._words = {}
+
+        os.makedirs(os.path.join(path, "audio"), exist_ok=True)
+        os.makedirs(os.path.join(path, "carts"), exist_ok=True)
+        os.makedirs(os.path.join(path, "tracks"), exist_ok=True)
+
+        num_albums = (num_tracks + TRACKS_PER_ALBUM - 1) // TRACKS_PER_ALBUM
+        artists = [make_name(rand, rand.randint(1, 3)) for _ in range(num_albums // ALBUMS_PER_ARTIST + 1)]
+
+        for i in range(num_tracks):
+            album = i // TRACKS_PER_ALBUM
+            file_name = "tracks/%06d.mp3" % i
+
+            seconds = rand.randint(120, 420)
+            if not os.path.lexists(os.path.join(path, file_name)):
+                os.symlink(self._get_audio(path, seconds), os.path.join(path, file_name))
+
+            track = {
+                "album_code": "%06d" % album,
+                "track_num": "%02d" % (i % TRACKS_PER_ALBUM + 1),
+                "track_name": make_name(rand, rand.randint(1, 5)),
+                "artist_name": artists[album // ALBUMS_PER_ARTIST],
+                "rotation": rand.choice(ROTATIONS),
+                "file_name": file_name
+            }
+            self.tracks.append(track)
+            self._index(len(self.tracks) - 1, track["track_name"] + " " + track["artist_name"])
+
+        for i in range(NUM_CARTS):
+            cart_type = i % len(CART_TYPES)
+            filename = "%04d.mp3" % i
+
+            seconds = rand.choice([10, 15, 30, 60])
+            if not os.path.lexists(os.path.join(path, "carts", filename)):
+                os.symlink(self._get_audio(path, seconds), os.path.join(path, "carts", filename))
+
+            self.carts[cart_type].append({
+                "cartID": str(1000 + i),
+                "title": make_name(rand, 2),
+                "issuer": make_name(rand, 1),
+                "type": CART_TYPES[cart_type],
+                "filename": filename
+            })
+
+        for show_id in range(1, num_tracks // TRACKS_PER_SHOW + 1):
+            self.shows[show_id] = rand.sample(range(num_tracks), TRACKS_PER_SHOW)
+
+    def _get_audio(self, path, seconds):
+        """Get a fake audio file of a given length, writing it if necessary.
+
+        Tracks of the same length are symlinks to the same file.
+
+        :param path: library directory
+        :param seconds
+        """
+        audio_path = os.path.join(path, "audio", "%d.mp3" % seconds)
+
+        if not os.path.exists(audio_path):
+            make_audio(audio_path, seconds)
+
+        return os.path.abspath(audio_path)
+
+    def _index(self, track_index, text):
+        """Add a track to the word index.
+
+        :param track_index
+        :param text
+        """
+        for word in set(re.findall(r"\w+", text.lower())):
+            self._words.setdefault(word, []).append(track_index)
+
+    def search(self, query):
+        """Get the tracks and carts which match every word of a query.
+
+        :param query
+        """
+        words = re.findall(r"\w+", query.lower())
+        matches = None
+
+        for word in words:
+            indices = set()
+            for key in self._words:
+                if key.startswith(word):
+                    indices.update(self._words[key])
+            matches = indices if matches is None else matches & indices
+
+        tracks = [self.tracks[i] for i in sorted(matches or [])[0:SEARCH_LIMIT]]
+        carts = [cart for carts in self.carts.values() for cart in carts
+                 if all(word in (cart["title"] + " " + cart["issuer"]).lower() for word in words)]
+
+        return {"carts": carts, "tracks": tracks}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """The Handler class serves the API endpoints."""
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        endpoint = url.path.rsplit("/", 1)[-1]
+
+        with server.lock:
+            server.num_requests += 1
+            rand = server.rand.random()
+
+        # inject latency, stalls and errors
+        time.sleep(max(0.0, random.gauss(server.latency, server.latency / 4)))
+
+        if rand < server.stall_rate:
+            time.sleep(server.stall_time)
+        elif rand < server.stall_rate + server.error_rate:
+            self._respond(500, {"error": "injected error"})
+            return
+
+        library = server.library
+
+        if endpoint == "cartmachine_load.php":
+            self._respond(200, library.carts.get(int(params.get("type", 0)), []))
+        elif endpoint == "automation_add_carts.php":
+            carts = library.carts.get(int(params.get("type", 0)), [])
+            self._respond(200, random.choice(carts) if len(carts) > 0 else None)
+        elif endpoint == "automation_generate_showid.php":
+            show_ids = [show_id for show_id in library.shows if str(show_id) != params.get("showid")]
+            self._respond(200, random.choice(show_ids))
+        elif endpoint == "automation_generate_showplist.php":
+            tracks = [library.tracks[i] for i in library.shows.get(int(params.get("showid", -1)), [])]
+            self._respond(200, [{
+                "lb_album_code": track["album_code"],
+                "lb_track_num": track["track_num"],
+                "lb_track_name": track["track_name"],
+                "artist_name": track["artist_name"],
+                "rotation": track["rotation"],
+                "file_name": track["file_name"]
+            } for track in tracks])
+        elif endpoint == "studio_search.php":
+            self._respond(200, library.search(params.get("query", "")))
+        elif endpoint in ("log_cart.php", "log_track.php"):
+            with server.lock:
+                server.logged.append(params)
+            self._respond(200, "logged")
+        else:
+            self._respond(404, {"error": "unknown endpoint"})
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self._handle()
+
+    def log_message(self, *args):
+        pass
+
+
+class StandinServer(ThreadingHTTPServer):
+    """The StandinServer class is an HTTP server for a generated library."""
+    daemon_threads = True
+
+    def __init__(self, library, port=0, latency=0.0, error_rate=0.0, stall_rate=0.0, stall_time=10.0):
+        """Construct a stand-in server.
+
+        :param library: Library to serve
+        :param port: port to listen on, or 0 for any free port
+        :param latency: mean response latency in seconds
+        :param error_rate: fraction of requests which fail with status 500
+        :param stall_rate: fraction of requests which stall
+        :param stall_time: duration of a stall in seconds
+        """
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", port), Handler)
+        self.library = library
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+
+        self.lock = threading.Lock()
+        self.rand = random.Random(1)
+        self.num_requests = 0
+        self.logged = []
+
+    def get_api_root(self):
+        """Get the API root URL of the server."""
+        return "http://127.0.0.1:%d/api/zautomate/" % self.server_address[1]
+
+    def start(self):
+        """Serve requests in a separate thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the ZAutomate server API.")
+    parser.add_argument("library", help="directory for the generated audio files")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--tracks", type=int, default=NUM_TRACKS)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    print("Generating library of %d tracks in %s..." % (args.tracks, args.library))
+    server = StandinServer(Library(args.library, args.tracks), args.port, args.latency, args.error_rate,
+                           args.stall_rate)
+
+    print("Serving %s" % server.get_api_root())
+    server.serve_forever()
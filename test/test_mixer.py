@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""Test suite for the mixer module.
+
+Mixes synthetic sources block by block and checks the sums, the fade
+curves, the end of a source and the counting of source underruns, then
+runs the mixer in real time into the null sink and prints its stats.
+"""
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.insert(0, 'app')
+import mixer
+from mixer import Mixer, NullSink, Source
+
+BLOCK = mixer.BLOCK_FRAMES
+
+
+def constant(value, frames, chunk=4096, gaps=()):
+    """Get a decode function for a constant signal.
+
+    :param value: sample value as a 16-bit integer
+    :param frames: length of the signal in frames
+    :param chunk: frames per decoded buffer
+    :param gaps: indices of the calls which return no frames, as a slow decoder would
+    """
+    state = {"left": frames, "calls": 0}
+
+    def decode():
+        state["calls"] += 1
+        if state["calls"] - 1 in gaps:
+            return b""
+        if state["left"] <= 0:
+            return None
+        count = min(chunk, state["left"])
+        state["left"] -= count
+        return np.full(count * mixer.CHANNELS, value, dtype=np.int16).tobytes()
+
+    return decode
+
+
+def mix_blocks(mix, count):
+    """Mix a number of blocks and get them as one array of samples."""
+    return np.concatenate([np.frombuffer(mix.mix()[0], dtype=np.int16).reshape(-1, mixer.CHANNELS)
+                           for _ in range(count)])
+
+
+# two sources are summed
+mix = Mixer(NullSink())
+mix.add(Source(constant(1000, BLOCK * 4)))
+mix.add(Source(constant(2000, BLOCK * 4)))
+samples = mix_blocks(mix, 2)
+assert abs(int(samples[0, 0]) - 3000) <= 1, samples[0]
+
+# an equal-power crossfade keeps the power of two equal signals constant
+mix = Mixer(NullSink())
+out_source = Source(constant(10000, BLOCK * 8))
+in_source = Source(constant(10000, BLOCK * 8), gain=0.0)
+mix.add(out_source)
+mix.add(in_source)
+out_source.fade(BLOCK * 4 / mixer.SAMPLE_RATE, 0.0, "equal_power", stop=True)
+in_source.fade(BLOCK * 4 / mixer.SAMPLE_RATE, 1.0, "equal_power")
+mix_blocks(mix, 2)
+gains = (out_source._gain, in_source._gain)
+assert abs(gains[0] ** 2 + gains[1] ** 2 - 1.0) < 0.01, gains
+mix_blocks(mix, 2)
+assert out_source.is_finished() and not in_source.is_finished()
+assert mix.get_stats()["sources"] == 1
+
+# a source ends after its last frame and calls its callback
+ended = threading.Event()
+mix = Mixer(NullSink())
+mix.add(Source(constant(1000, BLOCK + 10), on_end=ended.set))
+data, finished = mix.mix()
+assert len(finished) == 0
+data, finished = mix.mix()
+assert len(finished) == 1
+finished[0].end()
+assert ended.wait(1.0)
+
+# a source which is not decoded in time underruns and is padded with silence
+mix = Mixer(NullSink())
+mix.add(Source(constant(1000, BLOCK * 4, chunk=BLOCK, gaps=(1,))))
+mix_blocks(mix, 2)
+assert mix.get_stats()["source_underruns"] == 1, mix.get_stats()
+
+# a second of real time into the null sink, with one source playing
+mix = Mixer(NullSink())
+mix.start()
+mix.add(Source(constant(1000, mixer.SAMPLE_RATE * 2)))
+time.sleep(1.0)
+stats = mix.get_stats()
+print(stats)
+assert stats["output_underruns"] == 0 and stats["source_underruns"] == 0, stats
+assert stats["max_mix_ms"] < stats["latency_ms"], stats
+
+print("ok")
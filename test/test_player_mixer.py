@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""Test suite for the player_mixer module.
+
+Plays two generated silent files through the mixer into the null sink:
+the first segues into the second from its end callback, and the second
+is stopped. Checks when the callback is called, that the tail of the
+first stream keeps playing during the segue, and that both streams are
+removed from the mixer afterwards. The second stream is prerolled, so
+it is decoded before the segue and played from its prerolled source.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+os.environ["ZAUTOMATE_MIXER_SINK"] = "null"
+
+sys.path.insert(0, 'app')
+sys.path.insert(0, 'test')
+import player_mixer
+from player_mixer import MixerPlayer, get_mixer
+from standin_server import make_audio
+
+LENGTH = 3.0
+SEGUE = 1.0
+TOLERANCE = 0.3
+
+player_mixer.SEGUE = SEGUE
+
+workdir = tempfile.mkdtemp(prefix="test_player_mixer.")
+
+try:
+    make_audio(os.path.join(workdir, "first.mp3"), LENGTH)
+    make_audio(os.path.join(workdir, "second.mp3"), LENGTH)
+
+    first = MixerPlayer(os.path.join(workdir, "first.mp3"))
+    second = MixerPlayer(os.path.join(workdir, "second.mp3"))
+    segued = threading.Event()
+    times = {}
+
+    def on_end():
+        """Segue into the second stream."""
+        times["segue"] = time.monotonic()
+        assert not first.is_playing
+        second.play()
+        segued.set()
+
+    # a cancelled preroll is released and can be prerolled again
+    second.preroll()
+    assert second._prerolled is not None
+    second.cancel_preroll()
+    assert second._prerolled is None
+
+    second.preroll()
+    prerolled = second._prerolled
+
+    times["start"] = time.monotonic()
+    first.play(on_end)
+    assert first.is_playing
+
+    # the callback is called the length of the segue before the end
+    assert segued.wait(LENGTH + 1.0), "segue callback was not called"
+    elapsed = times["segue"] - times["start"]
+    assert abs(elapsed - (LENGTH - SEGUE)) < TOLERANCE, elapsed
+    assert second.is_playing
+    assert second._source is prerolled and second._prerolled is None
+
+    # the tail of the first stream plays under the second
+    assert get_mixer().get_stats()["sources"] == 2, get_mixer().get_stats()
+
+    time.sleep(SEGUE + TOLERANCE)
+    assert get_mixer().get_stats()["sources"] == 1, get_mixer().get_stats()
+
+    # stopping fades the second stream out and removes it
+    second.stop()
+    assert not second.is_playing
+
+    time.sleep(player_mixer.STOP_FADE + TOLERANCE)
+    assert get_mixer().get_stats()["sources"] == 0, get_mixer().get_stats()
+
+    print(get_mixer().get_stats())
+finally:
+    shutil.rmtree(workdir)
+
+print("OK")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""Test suite for the playback position of the player module.
+
+Plays a one-hour stream on a simulated clock, where every sleep
+oversleeps by a random amount as a loaded machine would, and compares
+the position reported by the Position class and by counting one-second
+ticks with the true position, along with how late the end of the stream
+is detected.
+"""
+import random
+import sys
+
+sys.path.insert(0, 'app')
+from player import Position
+
+LENGTH = 3600 * 1000
+POLL_INTERVAL = 1.0
+MAX_OVERSLEEP = 0.020
+MAX_END_LATENESS = 50
+
+
+class SimClock(object):
+    """The SimClock class is a monotonic clock whose sleeps oversleep."""
+
+    def __init__(self, rand):
+        self._rand = rand
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds + self._rand.uniform(0, MAX_OVERSLEEP)
+
+
+def play_position(clock):
+    """Play with the Position class and get (worst drift, end lateness) in ms."""
+    position = Position(LENGTH, clock.monotonic)
+    start = clock.now
+    position.start()
+    drift = 0
+
+    while not position.is_finished():
+        clock.sleep(min(position.get_remaining() / 1000.0, POLL_INTERVAL))
+        true_elapsed = min(LENGTH, (clock.now - start) * 1000)
+        drift = max(drift, abs(position.get_elapsed() - true_elapsed))
+
+    return drift, (clock.now - start) * 1000 - LENGTH
+
+
+def play_ticks(clock):
+    """Play by counting one-second ticks and get (worst drift, end lateness) in ms."""
+    start = clock.now
+    elapsed = 0
+    drift = 0
+
+    while elapsed < LENGTH:
+        elapsed += 1000
+        clock.sleep(1.0)
+        true_elapsed = min(LENGTH, (clock.now - start) * 1000)
+        drift = max(drift, abs(min(LENGTH, elapsed) - true_elapsed))
+
+    return drift, (clock.now - start) * 1000 - LENGTH
+
+
+for name, play in (("position", play_position), ("ticks", play_ticks)):
+    drift, lateness = play(SimClock(random.Random(0)))
+    print("%-8s worst drift %10.1f ms, end detected %10.1f ms late" % (name, drift, lateness))
+
+    if name == "position":
+        assert drift < 1, "position drifted by %.1f ms" % drift
+        assert 0 <= lateness < MAX_END_LATENESS, "end detected %.1f ms late" % lateness
+
+# pausing stops the position, and resuming continues from it
+clock = SimClock(random.Random(0))
+position = Position(LENGTH, clock.monotonic)
+position.start()
+clock.now += 10.0
+position.pause()
+clock.now += 5.0
+assert position.get_elapsed() == 10000
+position.start()
+clock.now += 1.0
+assert position.get_elapsed() == 11000
+position.reset()
+assert position.get_elapsed() == 0
+
+print("ok")
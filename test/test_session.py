@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""Test suite for the session module.
+
+Sends a batch of requests to a local HTTP/1.1 server, once with bare
+requests calls and once through the shared session, and prints the
+number of connections opened by each. Then checks that client errors
+leave the circuit breaker closed while server errors open it.
+"""
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, 'app')
+import session
+
+NUM_REQUESTS = 20
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        Handler.connections += 1
+
+    def do_GET(self):
+        body = b"[]"
+        status = 200
+        if "/missing" in self.path:
+            status = 404
+        elif "/error" in self.path:
+            status = 500
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+URL = "http://127.0.0.1:%d/api/zautomate/studio_search.php" % server.server_address[1]
+
+for i in range(NUM_REQUESTS):
+    requests.get(URL, params={"query": i})
+
+print("bare requests: %d requests, %d connections" % (NUM_REQUESTS, Handler.connections))
+
+Handler.connections = 0
+session.mount(URL, 2)
+
+for i in range(NUM_REQUESTS):
+    session.get(URL, params={"query": i})
+
+print("shared session: %d requests, %d connections" % (NUM_REQUESTS, Handler.connections))
+print(session.get_stats())
+
+ROOT = "http://127.0.0.1:%d/" % server.server_address[1]
+
+# client errors show that the server is up
+for i in range(session.BREAKER_THRESHOLD + 1):
+    try:
+        session.get(ROOT + "missing")
+    except requests.exceptions.HTTPError:
+        pass
+
+assert session.get_breaker_state()["state"] == session.STATE_CLOSED, session.get_breaker_state()
+
+# server errors open the breaker
+for i in range(session.BREAKER_THRESHOLD):
+    try:
+        session.get(ROOT + "error")
+    except requests.exceptions.HTTPError:
+        pass
+
+assert session.get_breaker_state()["state"] == session.STATE_OPEN, session.get_breaker_state()
+print("breaker: OK")
+
+server.shutdown()